@@ -0,0 +1,302 @@
+'''
+Author: Joseph Hopwood
+Description: Checks that what we deployed is actually serving. Targets come
+from the 'export.csv' of ec2_report.py (every instance with a public IP), from
+`terraform output -json` (like web_server_public_ip of terraform-web), from S3
+buckets set up as websites (like s3website.py does), or are given as URLs.
+All of them are probed at once (see prober.py), and every target is reported
+as ready or not, along with its latency percentiles. With --wait, targets that
+aren't ready yet are probed again until they are, so it can be run right after
+a deploy. It exits with 1 if any target isn't ready.
+
+Example:
+
+python3 cli.py health-probe --ec2-report export.csv --wait 300
+terraform output -json | python3 cli.py health-probe --terraform -
+python3 cli.py health-probe --bucket example-bucket --expect "<html" --rounds 5
+python3 cli.py health-probe --url http://127.0.0.1:8000/ --rounds 20
+'''
+
+import argparse
+import csv
+import json
+import sys
+
+from common import clients
+
+# Regions whose website endpoints have a dash before the region instead of a
+# dot, e.g. "s3-website-us-east-1" but "s3-website.eu-central-1".
+DASH_REGIONS: frozenset = frozenset({
+    "us-east-1", "us-west-1", "us-west-2", "ap-southeast-1", "ap-southeast-2",
+    "ap-northeast-1", "eu-west-1", "sa-east-1", "us-gov-west-1",
+})
+
+
+
+
+def as_url(address: str, path: str = "/") -> str:
+    """_Turn an IP address or host name into a URL. URLs are left as they
+    are._"""
+    if "://" in address:
+        return address
+    return f"http://{address}{path}"
+
+
+
+
+def targets_from_report(path: str, url_path: str = "/") -> list[str]:
+    """_Get a URL for every instance with a public IP in a report of
+    ec2_report.py._
+
+    Args:
+        path (str): _Path of the report, e.g. export.csv._
+        url_path (str, optional): _Path to probe on every instance. Defaults
+            to "/"._
+
+    Returns:
+        list[str]: _The URLs._
+    """
+    with open(path, 'r', newline='') as file:
+        return [
+            as_url(row['PublicIpAddress'], url_path)
+            for row in csv.DictReader(file)
+            if row.get('PublicIpAddress') not in (None, '', 'N/A')
+        ]
+
+
+
+
+def targets_from_terraform(path: str, url_path: str = "/") -> list[str]:
+    """_Get a URL for every output of `terraform output -json` that holds an
+    address, or a list of them._
+
+    Args:
+        path (str): _Path of the saved output, or "-" to read it from stdin._
+        url_path (str, optional): _Path to probe on every address. Defaults to
+            "/"._
+
+    Returns:
+        list[str]: _The URLs._
+    """
+    if path == "-":
+        outputs: dict = json.load(sys.stdin)
+    else:
+        with open(path, 'r') as file:
+            outputs = json.load(file)
+
+    urls: list[str] = []
+    for output in outputs.values():
+        values = output.get("value") if isinstance(output, dict) else output
+        if isinstance(values, str):
+            values = [values]
+        if not isinstance(values, list):
+            continue
+
+        # Anything that isn't a single word can't be an address.
+        urls.extend(
+            as_url(value, url_path) for value in values
+            if isinstance(value, str) and value and not value.split()[1:]
+        )
+
+    return urls
+
+
+
+
+def website_endpoint(bucket_name: str, region: str) -> str:
+    """_The website endpoint of a bucket._"""
+    separator: str = "-" if region in DASH_REGIONS else "."
+    return f"http://{bucket_name}.s3-website{separator}{region}.amazonaws.com/"
+
+
+
+
+def bucket_region(s3_client, bucket_name: str) -> str:
+    """_Ask S3 what region a bucket is in. Buckets in us-east-1 don't say._"""
+    response: dict = s3_client.get_bucket_location(Bucket = bucket_name)
+    return response.get('LocationConstraint') or 'us-east-1'
+
+
+
+
+def print_results(report: dict, quiet: bool = False):
+    """_Print whether every target is ready, and how fast it answered._
+
+    Args:
+        report (dict): _See `prober.probe_all()`._
+        quiet (bool, optional): _Only print the targets that aren't ready.
+            Defaults to False._
+    """
+    all_latencies: list[float] = []
+    ready: int = 0
+
+    for url, result in report["targets"].items():
+        all_latencies.extend(result["latencies"])
+        ready += result["ready"]
+        if quiet and result["ready"]:
+            continue
+
+        p50, p90, p99 = (
+            f"{value * 1000:.0f}" if value is not None else "-"
+            for value in result["percentiles"].values()
+        )
+        outcome: str = ", ".join(
+            [f"{status} x{count}" for status, count in result["statuses"].items()]
+            + [f"{error} x{count}" for error, count in result["errors"].items()]
+        )
+        print(f"{'READY' if result['ready'] else 'DOWN':<6} {url:<60} "
+            f"p50 {p50:>5} p90 {p90:>5} p99 {p99:>5} ms  {outcome}")
+
+    # Imported here, so that --help never pays for asyncio.
+    import prober
+
+    p50, p90, p99 = (
+        f"{value * 1000:.0f}" if value is not None else "-"
+        for value in prober.percentiles(all_latencies).values()
+    )
+    print(f"{ready} of {len(report['targets'])} target(s) ready, "
+        f"{len(all_latencies)} probe(s) over {report['connections']} "
+        f"connection(s) in {report['seconds']:.1f}s, "
+        f"p50 {p50} p90 {p90} p99 {p99} ms")
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Health Probe",
+        description="Check that web servers and S3 websites are serving",
+    )
+    parser.add_argument(
+        "-u", "--url",
+        action="append",
+        default=[],
+        help="URL to probe. Can be repeated",
+    )
+    parser.add_argument(
+        "-r", "--ec2-report",
+        type=str,
+        help="Probe every instance with a public IP in this report of "
+            "ec2_report.py",
+    )
+    parser.add_argument(
+        "-t", "--terraform",
+        type=str,
+        help="Probe every address in this `terraform output -json`, or - for "
+            "stdin",
+    )
+    parser.add_argument(
+        "-b", "--bucket",
+        action="append",
+        default=[],
+        help="Probe the website endpoint of this bucket. Can be repeated",
+    )
+    parser.add_argument(
+        "--region",
+        type=str,
+        help="Region of the buckets. Defaults to asking S3",
+    )
+    parser.add_argument(
+        "--path",
+        default="/",
+        help="Path to probe on instances. Defaults to /",
+    )
+    parser.add_argument(
+        "-e", "--expect",
+        type=str,
+        help="Text a page must have to be ready. Defaults to any status under "
+            "400",
+    )
+    parser.add_argument(
+        "-n", "--rounds",
+        type=int,
+        default=1,
+        help="How many times to probe every target. Defaults to 1",
+    )
+    parser.add_argument(
+        "-w", "--wait",
+        type=float,
+        default=0.0,
+        help="Seconds to keep probing targets that aren't ready. Defaults to 0",
+    )
+    parser.add_argument(
+        "-c", "--concurrency",
+        type=int,
+        default=500,
+        help="Requests in flight at once. Defaults to 500",
+    )
+    parser.add_argument(
+        "--per-host",
+        type=int,
+        default=8,
+        help="Connections to a single host at most. Defaults to 8",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=10.0,
+        help="Seconds a request gets. Defaults to 10",
+    )
+    parser.add_argument(
+        "-q", "--quiet",
+        action="store_true",
+        help="Only print the targets that aren't ready",
+    )
+    parser.add_argument(
+        "-j", "--json",
+        type=str,
+        help="Also write the results of every target to this JSON file",
+    )
+    args = parser.parse_args()
+
+    urls: list[str] = [as_url(url, args.path) for url in args.url]
+    if args.ec2_report:
+        urls.extend(targets_from_report(args.ec2_report, args.path))
+    if args.terraform:
+        urls.extend(targets_from_terraform(args.terraform, args.path))
+    if args.bucket:
+        s3_client = None if args.region else clients.client('s3')
+        urls.extend(
+            website_endpoint(
+                bucket_name, args.region or bucket_region(s3_client, bucket_name)
+            )
+            for bucket_name in args.bucket
+        )
+
+    # The same target from two sources only needs probing once.
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        parser.error("Nothing to probe. Give --url, --ec2-report, --terraform "
+            "or --bucket")
+
+    # Imported here, so that --help never pays for asyncio.
+    import asyncio
+    import prober
+
+    report: dict = asyncio.run(prober.probe_all(
+        urls,
+        rounds=args.rounds,
+        wait=args.wait,
+        expect=args.expect,
+        concurrency=args.concurrency,
+        per_host=args.per_host,
+        timeout=args.timeout,
+    ))
+
+    print_results(report, args.quiet)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    # Let's let whatever ran us know if anything isn't serving.
+    if not all(result["ready"] for result in report["targets"].values()):
+        sys.exit(1)
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+'''
+Author: Joseph Hopwood
+Description: Module containing an asyncio HTTP prober, on nothing but the
+standard library. Thousands of URLs are probed at once, over a pool of
+keep-alive connections per host, with a timeout on connecting and on every
+request. Every target gets its latencies, status codes and errors kept, and is
+ready once its latest probe came back with a good status (and the text we
+expect, if any). Targets that aren't ready can be probed again until they are,
+or until we give up. Any HTTP/1.x server works, a local one included.
+'''
+
+import asyncio
+import math
+import ssl
+import time
+import urllib.parse
+
+# How many requests are in flight at once, over every host...
+DEFAULT_CONCURRENCY: int = 500
+
+# ...and how many connections we open to a single host.
+DEFAULT_PER_HOST: int = 8
+
+# How many idle connections are kept alive, over every host. Past this, the
+# one idle the longest is closed, so probing thousands of hosts once each
+# doesn't leave a socket open for every one of them.
+MAX_IDLE: int = 256
+
+# Seconds we give a connection to open, and a request to come back.
+CONNECT_TIMEOUT: float = 5.0
+REQUEST_TIMEOUT: float = 10.0
+
+# Seconds between probes of targets that aren't ready yet.
+RETRY_SECONDS: float = 5.0
+
+# We only need enough of a page to look for the text we expect in it. Past
+# this, the rest is left unread and the connection is closed.
+MAX_BODY: int = 1024 * 1024
+
+PERCENTILES: tuple[int, ...] = (50, 90, 99)
+
+USER_AGENT: str = "health-probe/1.0"
+
+
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections, kept per host, so probing the same host again
+    doesn't pay for a new connection (or TLS handshake) every time.
+    """
+
+
+    def __init__(
+            self,
+            per_host: int = DEFAULT_PER_HOST,
+            connect_timeout: float = CONNECT_TIMEOUT,
+            max_idle: int = MAX_IDLE
+    ):
+        """Initialize an empty pool.
+
+        Args:
+            per_host (int, optional): How many connections a host gets at
+                most. Defaults to DEFAULT_PER_HOST.
+            connect_timeout (float, optional): Seconds a connection gets to
+                open. Defaults to CONNECT_TIMEOUT.
+            max_idle (int, optional): How many idle connections are kept, over
+                every host. Defaults to MAX_IDLE.
+        """
+        self.per_host: int = per_host
+        self.connect_timeout: float = connect_timeout
+        self.max_idle: int = max_idle
+        self.opened: int = 0
+
+        # Idle connections and free slots, keyed by (scheme, host, port).
+        self._idle: dict[tuple, list[tuple]] = {}
+        # Every idle connection and its key, the one idle the longest first.
+        self._idle_order: dict[tuple, tuple] = {}
+        self._slots: dict[tuple, asyncio.Semaphore] = {}
+        self._ssl: ssl.SSLContext = None
+
+
+    async def get(self, url: str, timeout: float = REQUEST_TIMEOUT) -> tuple:
+        """GET a URL. A connection that was kept alive may have been closed by
+        the server in the meantime, so a request on one that fails is sent
+        once more on a new connection.
+
+        Args:
+            url (str): The URL.
+            timeout (float, optional): Seconds the request gets to come back,
+                not counting connecting. Defaults to REQUEST_TIMEOUT.
+
+        Returns:
+            tuple: The status code, the (start of the) body, and the seconds it
+                took from when a connection to the host was free.
+        """
+        parts: urllib.parse.SplitResult = urllib.parse.urlsplit(url)
+        https: bool = parts.scheme == "https"
+        port: int = parts.port or (443 if https else 80)
+        key: tuple = (parts.scheme, parts.hostname, port)
+
+        path: str = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        host: str = parts.netloc.rpartition("@")[2]
+        request: bytes = (
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {host}\r\n"
+            f"User-Agent: {USER_AGENT}\r\n"
+            "Accept: */*\r\n"
+            "Connection: keep-alive\r\n"
+            "\r\n"
+        ).encode("latin-1")
+
+        slot: asyncio.Semaphore = self._slots.setdefault(
+            key, asyncio.Semaphore(self.per_host)
+        )
+        async with slot:
+            sent: float = time.monotonic()
+            idle: list[tuple] = self._idle.setdefault(key, [])
+
+            while True:
+                reused: bool = bool(idle)
+                connection: tuple = (
+                    self._take(key) if reused
+                    else await self._open(parts.hostname, port, https)
+                )
+                try:
+                    status, body, keep = await asyncio.wait_for(
+                        _exchange(connection, request), timeout
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    _close(connection)
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    _close(connection)
+                    raise
+
+                if keep:
+                    self._release(key, connection)
+                else:
+                    _close(connection)
+                return status, body, time.monotonic() - sent
+
+
+    def _take(self, key: tuple) -> tuple:
+        """Take the idle connection to a host that was used last."""
+        connection: tuple = self._idle[key].pop()
+        del self._idle_order[connection]
+        return connection
+
+
+    def _release(self, key: tuple, connection: tuple):
+        """Keep a connection alive for the next request to its host, closing
+        the one idle the longest if that's too many."""
+        self._idle[key].append(connection)
+        self._idle_order[connection] = key
+
+        if len(self._idle_order) > self.max_idle:
+            oldest: tuple = next(iter(self._idle_order))
+            self._idle[self._idle_order.pop(oldest)].remove(oldest)
+            _close(oldest)
+
+
+    async def _open(self, hostname: str, port: int, https: bool) -> tuple:
+        """Open a new connection."""
+        if https and self._ssl is None:
+            self._ssl = ssl.create_default_context()
+
+        connection: tuple = await asyncio.wait_for(
+            asyncio.open_connection(
+                hostname, port, ssl=self._ssl if https else None
+            ),
+            self.connect_timeout,
+        )
+        self.opened += 1
+        return connection
+
+
+    def close(self):
+        """Close every idle connection."""
+        for connections in self._idle.values():
+            for connection in connections:
+                _close(connection)
+        self._idle.clear()
+        self._idle_order.clear()
+
+
+
+
+async def _exchange(connection: tuple, request: bytes) -> tuple[int, bytes, bool]:
+    """_Send a request and read its response._
+
+    Returns:
+        tuple[int, bytes, bool]: _The status code, the (start of the) body,
+            and whether the connection can be used again._
+    """
+    reader, writer = connection
+    writer.write(request)
+    await writer.drain()
+
+    status_line: bytes = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("Connection closed before the response")
+    version, status, *_ = status_line.split(None, 2)
+
+    headers: dict[str, str] = {}
+    while True:
+        line: bytes = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    keep: bool = (
+        version == b"HTTP/1.1" and headers.get("connection", "").lower() != "close"
+    )
+
+    # 1xx, 204 and 304 responses never have a body.
+    if int(status) in (204, 304) or int(status) < 200:
+        return int(status), b"", keep
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        body: bytes = b""
+        while True:
+            size: int = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                # Let's skip any trailers.
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            if len(body) + size > MAX_BODY:
+                return int(status), body, False
+            body += await reader.readexactly(size)
+            await reader.readline()
+        return int(status), body, keep
+
+    if "content-length" in headers:
+        length: int = int(headers["content-length"])
+        if length > MAX_BODY:
+            return int(status), await reader.readexactly(MAX_BODY), False
+        return int(status), await reader.readexactly(length), keep
+
+    # No length at all, so the body runs until the server closes.
+    return int(status), await reader.read(MAX_BODY), False
+
+
+
+
+def _close(connection: tuple):
+    """_Close a connection without waiting on it._"""
+    connection[1].close()
+
+
+
+
+def percentiles(values: list[float], points=PERCENTILES) -> dict[int, float]:
+    """_Work out percentiles of a list of values, by nearest rank._
+
+    Args:
+        values (list[float]): _The values._
+        points (optional): _The percentiles. Defaults to PERCENTILES._
+
+    Returns:
+        dict[int, float]: _The value at every percentile, or None for all of
+            them when there are no values._
+    """
+    ordered: list[float] = sorted(values)
+    return {
+        point: ordered[max(math.ceil(point / 100 * len(ordered)) - 1, 0)]
+            if ordered else None
+        for point in points
+    }
+
+
+
+
+async def probe_all(
+        urls: list[str],
+        rounds: int = 1,
+        wait: float = 0.0,
+        expect: str = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        per_host: int = DEFAULT_PER_HOST,
+        timeout: float = REQUEST_TIMEOUT,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        retry_seconds: float = RETRY_SECONDS,
+        max_idle: int = MAX_IDLE
+) -> dict:
+    """_Probe every URL a few rounds, then keep probing the ones that aren't
+    ready until they are, or until we've waited long enough._
+
+    Args:
+        urls (list[str]): _The URLs._
+        rounds (int, optional): _How many times every URL is probed. More
+            rounds make for better percentiles. Defaults to 1._
+        wait (float, optional): _Seconds to keep probing URLs that aren't
+            ready. Defaults to not at all._
+        expect (str, optional): _Text a page must have to be ready. Defaults
+            to any page with a status under 400._
+        concurrency (int, optional): _Requests in flight at once. Defaults to
+            DEFAULT_CONCURRENCY._
+        per_host (int, optional): _Connections to a single host at most.
+            Defaults to DEFAULT_PER_HOST._
+        timeout (float, optional): _Seconds a request gets. Defaults to
+            REQUEST_TIMEOUT._
+        connect_timeout (float, optional): _Seconds a connection gets to open.
+            Defaults to CONNECT_TIMEOUT._
+        retry_seconds (float, optional): _Seconds between probes of URLs that
+            aren't ready. Defaults to RETRY_SECONDS._
+        max_idle (int, optional): _Idle connections kept alive, over every
+            host. Defaults to MAX_IDLE._
+
+    Returns:
+        dict: _The results of every URL under "targets" (see `_new_result()`),
+            how many connections were opened under "connections", and how long
+            it all took under "seconds"._
+    """
+    pool: ConnectionPool = ConnectionPool(per_host, connect_timeout, max_idle)
+    semaphore: asyncio.Semaphore = asyncio.Semaphore(concurrency)
+    expected: bytes = expect.encode() if expect else None
+    results: dict[str, dict] = {url: _new_result() for url in urls}
+    start: float = time.monotonic()
+
+    async def probe(url: str):
+        result: dict = results[url]
+        async with semaphore:
+            try:
+                status, body, seconds = await pool.get(url, timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    ValueError) as error:
+                code: str = type(error).__name__
+                result["errors"][code] = result["errors"].get(code, 0) + 1
+                result["ready"] = False
+                return
+
+        result["latencies"].append(seconds)
+        result["statuses"][status] = result["statuses"].get(status, 0) + 1
+        result["ready"] = status < 400 and (expected is None or expected in body)
+        if result["ready"] and result["ready_seconds"] is None:
+            result["ready_seconds"] = time.monotonic() - start
+
+    try:
+        # Every round goes out at once. The semaphore and the pool keep it
+        # within bounds, and a slow target doesn't hold up the rounds after.
+        await asyncio.gather(*(probe(url) for _ in range(rounds) for url in urls))
+
+        deadline: float = start + wait
+        while time.monotonic() + retry_seconds <= deadline:
+            waiting: list[str] = [
+                url for url, result in results.items() if not result["ready"]
+            ]
+            if not waiting:
+                break
+            await asyncio.sleep(retry_seconds)
+            await asyncio.gather(*(probe(url) for url in waiting))
+    finally:
+        pool.close()
+
+    for result in results.values():
+        result["percentiles"] = percentiles(result["latencies"])
+
+    return {
+        "targets" : results,
+        "connections" : pool.opened,
+        "seconds" : time.monotonic() - start,
+    }
+
+
+
+
+def _new_result() -> dict:
+    """_The results of a URL before it was probed._
+
+    Returns:
+        dict: _Results._
+        `
+        {  `<br>`
+            "ready" : bool,  `<br>`
+            "ready_seconds" : float, until the first good probe  `<br>`
+            "latencies" : list[float], of every probe that came back  `<br>`
+            "statuses" : dict[int, int], probes by status code  `<br>`
+            "errors" : dict[str, int], probes by what went wrong  `<br>`
+        }
+        `
+    """
+    return {
+        "ready" : False,
+        "ready_seconds" : None,
+        "latencies" : [],
+        "statuses" : {},
+        "errors" : {},
+    }
@@ -6,9 +6,9 @@ Checks each security group to ensure that port 22 is not open to the internet
 that is ok. If port 22 is open to the internet, removes access to port 22.
 '''
 
-import boto3
-import botocore
-import botocore.exceptions
+import argparse
+
+from common import clients, paginate
 
 
 
@@ -45,13 +45,17 @@ class SecurityGroup:
 
 
 
-    def __init__(self, id: str, name: str):
+    def __init__(self, id: str, name: str, sg_rules: list[dict] = None):
         """Initialize a new SecurityGroup. While initializing, the sg will make
-        an API call to AWS and populate its inbound rules.
+        an API call to AWS and populate its inbound rules, unless the rules
+        were already fetched and handed to it.
 
         Args:
             id (str): The ID of the Security Group or "GroupId".
             name (str): The name of the Security Group of "GroupName".
+            sg_rules (list[dict], optional): The rules of the group, as found
+                in `response["SecurityGroupRules"]` of a
+                `EC2.client.describe_security_group_rules()` call.
         """
         self.id: str = id
         self.name: str = name
@@ -61,19 +65,25 @@ class SecurityGroup:
         self.rules: list[self.InboundRule] = []
 
         # Reaching out to AWS to get a list of ALL sg rules associated with sg.
-        client = boto3.client("ec2")
-        response: dict = client.describe_security_group_rules(
-            Filters=[
-                {
-                    "Name": "group-id",
-                    "Values": [self.id]
-                }
-            ]
-        )
+        if sg_rules is None:
+            client = clients.client("ec2")
+            sg_rules = list(
+                paginate.items(
+                    client,
+                    "describe_security_group_rules",
+                    "SecurityGroupRules",
+                    Filters=[
+                        {
+                            "Name": "group-id",
+                            "Values": [self.id]
+                        }
+                    ],
+                )
+            )
 
         # Filter out all rules that aren't inbound IPv4 rules. Than cache all
         # associated inbound ipv4 rules.
-        for rule in response["SecurityGroupRules"]:
+        for rule in sg_rules:
             if not rule["IsEgress"]:
                 try:
                     self.rules.append(
@@ -166,57 +176,82 @@ class SecurityGroup:
 
 
 
-    def remove_unsafe_rules(self):
+    def unsafe_rules(self) -> list[InboundRule]:
         """
-        Call to AWS to delete unsafe rules (publicly open port 22 access)
-        from a sg. Updates the local cache as well.
+        Find the unsafe rules (publicly open port 22 access) of the sg.
+
+        Returns:
+            list[InboundRule]: The unsafe rules.
         """
 
         port: int = 22
         public_ipv4 = "0.0.0.0/0"
 
-        for rule in self.rules:
+        return [
+            rule for rule in self.rules
+            if rule.from_port <= port <= rule.to_port
+                and rule.cidr_ipv4 == public_ipv4
+        ]
 
-            is_open_22: bool = (rule.from_port <= port <= rule.to_port)
-            is_public: bool = rule.cidr_ipv4 == public_ipv4
 
-            if is_open_22 and is_public:
 
-                # Notify user.
-                print("REMOVING UNSAFE RULE(S):" )
-                print(f"Group: {self.name} / {self.id}")
-                print(f" - {rule.id}")
-                print(" ")
-
-                # Removal API call.
-                client = boto3.client("ec2")
-                response: dict = client.revoke_security_group_ingress(
-                    SecurityGroupRuleIds=[rule.id],
-                    GroupId=self.id
-                )
 
-                # Local cache removal.
-                self.rules.remove(rule)
+    def remove_unsafe_rules(self):
+        """
+        Call to AWS to delete unsafe rules (publicly open port 22 access)
+        from a sg. Updates the local cache as well.
+        """
+
+        # We go over a copy, since we take rules out of the cache as we go.
+        for rule in self.unsafe_rules():
 
-                # Redisplay sg details to show the user the change.
-                print("SUCCESSFULLY REMOVED | NEW CONFIGURATION")
-                self.print()
-                
+            # Notify user.
+            print("REMOVING UNSAFE RULE(S):" )
+            print(f"Group: {self.name} / {self.id}")
+            print(f" - {rule.id}")
+            print(" ")
+
+            # Removal API call.
+            client = clients.client("ec2")
+            response: dict = client.revoke_security_group_ingress(
+                SecurityGroupRuleIds=[rule.id],
+                GroupId=self.id
+            )
+
+            # Local cache removal.
+            self.rules.remove(rule)
+
+            # Redisplay sg details to show the user the change.
+            print("SUCCESSFULLY REMOVED | NEW CONFIGURATION")
+            self.print()
+            
 
 
     
 
 def main():
 
+    # Let's create a parser to handle the arguments passed ot the script. There
+    # aren't any, but it means --help explains what we do instead of doing it.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Security Monitor",
+        description="Remove port 22 access open to the internet from the "
+            "security groups of every instance",
+    )
+    parser.parse_args()
+
     # Let's get our low level client to make API calls.
-    client_ec2 = boto3.client('ec2')
+    client_ec2 = clients.client('ec2')
 
-    # First lets retrieve all of the ec2 instances on the account.
-    resp_all_instances: dict = {}
+    # First lets retrieve all of the ec2 instances on the account, through
+    # every page of them.
+    reservations: list[dict] = []
     try:
-        resp_all_instances = client_ec2.describe_instances()
+        reservations = list(
+            paginate.items(client_ec2, "describe_instances", "Reservations")
+        )
 
-    except botocore.exceptions.ClientError as error:
+    except clients.client_error() as error:
         if error.response["Error"]["Code"] == "RequestExpired":
             print("~/.aws tokens likely expired. Please change.")
             exit()
@@ -231,7 +266,7 @@ def main():
     print("\nRETRIEVING ACTIVE EC2 SECURITY GROUPS...\n")
 
     # OK, let's populate our active security groups
-    for reservation in resp_all_instances["Reservations"]:
+    for reservation in reservations:
 
         for instance in reservation["Instances"]:
 
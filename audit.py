@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+
+'''
+Author: Joseph Hopwood
+Description: Run every security check of the course against one shared
+snapshot of the account. Each describe call is made at most once per audit, all
+of them at the same time, and the checks then run side by side over the cached
+results to produce one combined report.
+
+The checks come from:
+ - week 7 - Security Auditing/ec2-sg.py
+ - week 7 - Security Auditing/exposure_map.py
+ - week 7 - Security Auditing/iam-roles.py (through its IAM snapshot)
+ - week 7 - Security Auditing/student-choice.py (through its topology)
+ - Final/monitor-security/monitor_security.py (report only, nothing is removed)
+'''
+
+import argparse
+import datetime
+import json
+
+from common import clients, loader, paginate
+from common.findings import finding
+
+# None of these import boto3 up front, so loading them here is cheap.
+ec2_sg = loader.load_script("week 7 - Security Auditing/ec2-sg.py")
+exposure_map = loader.load_script("week 7 - Security Auditing/exposure_map.py")
+iam_analyzer = loader.load_script("week 7 - Security Auditing/iam_analyzer.py")
+iam_snapshot = loader.load_script("week 7 - Security Auditing/iam_snapshot.py")
+vpc_topology = loader.load_script("week 7 - Security Auditing/vpc_topology.py")
+
+# These two do, so they are loaded the first time they are needed.
+MONITOR_SECURITY: str = "Final/monitor-security/monitor_security.py"
+NOTIFY: str = "week 5 - SNS/notify.py"
+
+# How many describe calls, and how many checks, run at the same time.
+MAX_WORKERS: int = 8
+
+# Roles younger than this many days show up in the report.
+RECENT_ROLE_DAYS: int = 90
+
+# Every EC2 describe call a check can need, and the key its results come back
+# under.
+EC2_SOURCES: dict[str, tuple[str, str]] = {
+    "instances" : ("describe_instances", "Reservations"),
+    "network_interfaces" : ("describe_network_interfaces", "NetworkInterfaces"),
+    "security_groups" : ("describe_security_groups", "SecurityGroups"),
+    "security_group_rules" : (
+        "describe_security_group_rules", "SecurityGroupRules"
+    ),
+}
+
+# The sources the network topology is built from.
+TOPOLOGY_SOURCES: dict[str, str] = {
+    "vpcs" : "describe_vpcs",
+    "subnets" : "describe_subnets",
+    "route_tables" : "describe_route_tables",
+    "nat_gateways" : "describe_nat_gateways",
+    "internet_gateways" : "describe_internet_gateways",
+}
+
+
+
+
+def describe(ec2_client, operation: str, result_key: str) -> list:
+    """_Run an EC2 describe call through every page._
+
+    Args:
+        ec2_client: _A low level boto3 client for the EC2 service._
+        operation (str): _Name of the describe call._
+        result_key (str): _The key its results come back under._
+
+    Returns:
+        list: _Every resource the call returned._
+    """
+    return list(paginate.items(ec2_client, operation, result_key))
+
+
+
+
+class ResourceSnapshot:
+    """
+    Everything the checks look at, fetched once. Checks never make API calls of
+    their own, they only read from here.
+    """
+
+
+    def __init__(self, sources: dict[str, list]):
+        """Initialize a new snapshot from already fetched sources.
+
+        Args:
+            sources (dict[str, list]): The results of each source, keyed by
+                source name (see `EC2_SOURCES`, `TOPOLOGY_SOURCES` and "iam").
+        """
+        self.sources: dict[str, list] = sources
+
+        # Let's build the shared models once, so checks don't each build
+        # their own.
+        self.topology = None
+        if all(source in sources for source in TOPOLOGY_SOURCES):
+            self.topology = vpc_topology.NetworkTopology(
+                *(sources[source] for source in TOPOLOGY_SOURCES)
+            )
+
+        self.iam = None
+        if "iam" in sources:
+            self.iam = iam_snapshot.IamSnapshot(sources["iam"])
+
+
+    @classmethod
+    def from_api(
+            cls,
+            ec2_client,
+            iam_client,
+            needs: set[str],
+            max_workers: int = MAX_WORKERS
+    ) -> "ResourceSnapshot":
+        """Fetch the sources the checks need, each exactly once, all at the
+        same time.
+
+        Args:
+            ec2_client: A low level boto3 client for the EC2 service.
+            iam_client: A low level boto3 client for the IAM service.
+            needs (set[str]): Names of the sources to fetch.
+            max_workers (int, optional): How many calls can be in flight at
+                once. Defaults to `MAX_WORKERS`.
+
+        Returns:
+            ResourceSnapshot: The new snapshot.
+        """
+        # Imported here, so that --help never pays for the thread pool.
+        import concurrent.futures
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures: dict = {}
+
+            for source in needs:
+                if source in EC2_SOURCES:
+                    futures[source] = executor.submit(
+                        describe, ec2_client, *EC2_SOURCES[source]
+                    )
+                elif source in TOPOLOGY_SOURCES:
+                    futures[source] = executor.submit(
+                        vpc_topology.describe_all,
+                        ec2_client,
+                        TOPOLOGY_SOURCES[source],
+                    )
+                elif source == "iam":
+                    futures[source] = executor.submit(
+                        iam_snapshot.fetch_authorization_details, iam_client
+                    )
+
+        return cls({source: future.result() for source, future in futures.items()})
+
+
+    def instances(self) -> list[dict]:
+        """Every instance on the account, out of their reservations."""
+        return [
+            instance
+            for reservation in self.sources["instances"]
+            for instance in reservation["Instances"]
+        ]
+
+
+
+
+
+def check_open_security_groups(snapshot: ResourceSnapshot) -> list[dict]:
+    """_Inbound rules open to the public internet, see `ec2-sg.py`._"""
+    return [
+        finding(
+            "sg_open_to_internet",
+            f"{rule['group_name']} ({rule['group_id']})",
+            f"Ports {rule['from_port']}-{rule['to_port']} are open to "
+                "0.0.0.0/0",
+        )
+        for rule in ec2_sg.find_open_rules(snapshot.sources["security_groups"])
+        if rule["too_open"]
+    ]
+
+
+
+
+def check_instance_ssh(snapshot: ResourceSnapshot) -> list[dict]:
+    """_Port 22 open to the internet on the security groups instances actually
+    use, see `monitor_security.py`. Nothing is removed here._"""
+    rules_by_group: dict[str, list[dict]] = {}
+    for rule in snapshot.sources["security_group_rules"]:
+        rules_by_group.setdefault(rule["GroupId"], []).append(rule)
+
+    # Every group only once, even if many instances share it.
+    groups: dict[str, str] = {}
+    for instance in snapshot.instances():
+        for group in instance.get("SecurityGroups", []):
+            groups[group["GroupId"]] = group["GroupName"]
+
+    monitor_security = loader.load_script(MONITOR_SECURITY)
+
+    findings: list[dict] = []
+    for group_id, group_name in groups.items():
+        security_group = monitor_security.SecurityGroup(
+            group_id, group_name, rules_by_group.get(group_id, [])
+        )
+        for rule in security_group.unsafe_rules():
+            findings.append(
+                finding(
+                    "ssh_open_to_internet",
+                    f"{group_name} ({group_id})",
+                    f"Rule {rule.id} opens port 22 to {rule.cidr_ipv4} on an "
+                        "active instance",
+                    "CRITICAL",
+                )
+            )
+
+    return findings
+
+
+
+
+def check_public_exposure(snapshot: ResourceSnapshot) -> list[dict]:
+    """_Public addresses the internet can reach, and on which ports, see
+    `exposure_map.py`. One finding per resource._"""
+    exposure: list[dict] = exposure_map.build_exposure_map(
+        snapshot.instances(),
+        snapshot.sources["security_group_rules"],
+        snapshot.sources["network_interfaces"],
+        snapshot.topology,
+    )
+
+    by_resource: dict[str, list[dict]] = {}
+    for entry in exposure:
+        by_resource.setdefault(entry["resource"], []).append(entry)
+
+    findings: list[dict] = []
+    for resource, entries in by_resource.items():
+        pairs: list[str] = list(dict.fromkeys(
+            f"{entry['address']}:{exposure_map.port_label(entry)}"
+            for entry in entries
+        ))
+        sensitive: bool = any(
+            exposure_map.sensitive_ports(entry) for entry in entries
+        )
+        findings.append(
+            finding(
+                "public_exposure",
+                resource,
+                "Reachable from the internet on " + ", ".join(pairs),
+                "CRITICAL" if sensitive else "WARNING",
+            )
+        )
+
+    return findings
+
+
+
+
+def check_vpc_availability(snapshot: ResourceSnapshot) -> list[dict]:
+    """_VPCs that lack High Availability, see `student-choice.py`._"""
+    findings: list[dict] = []
+
+    for vpc_id in snapshot.topology.vpcs:
+        evaluation: dict = snapshot.topology.evaluate_ha(vpc_id)
+        for issue in evaluation["issues"]:
+            findings.append(
+                finding("vpc_not_highly_available", vpc_id, issue)
+            )
+
+    return findings
+
+
+
+
+def check_recent_roles(snapshot: ResourceSnapshot) -> list[dict]:
+    """_Roles created in the last 90 days, see `iam-roles.py`._"""
+    created_after: datetime.datetime = (
+        datetime.datetime.now(datetime.timezone.utc)
+        - datetime.timedelta(days=RECENT_ROLE_DAYS)
+    )
+
+    return [
+        finding(
+            "recent_role",
+            role["RoleName"],
+            f"Created {role['CreateDate']} with "
+                f"{len(role['ManagedPolicies'])} managed and "
+                f"{len(role['UnmanagedPolicies'])} unmanaged policies",
+            "INFO",
+        )
+        for role in snapshot.iam.audit(created_after)
+    ]
+
+
+
+
+def check_admin_roles(snapshot: ResourceSnapshot) -> list[dict]:
+    """_Roles that are allowed to do anything on anything._"""
+    index = iam_analyzer.PolicyIndex.from_snapshot(snapshot.iam)
+
+    return [
+        finding(
+            "admin_role",
+            role_name,
+            "Allowed to perform * on *",
+            "CRITICAL",
+        )
+        for role_name in index.who_can("*", "*")
+    ]
+
+
+
+
+# Every check, and the sources it reads from the snapshot.
+CHECKS: dict[str, tuple] = {
+    "sg_open_to_internet" : (
+        check_open_security_groups, {"security_groups"}
+    ),
+    "ssh_open_to_internet" : (
+        check_instance_ssh, {"instances", "security_group_rules"}
+    ),
+    "public_exposure" : (
+        check_public_exposure,
+        {"instances", "network_interfaces", "security_group_rules"}
+            | set(TOPOLOGY_SOURCES),
+    ),
+    "vpc_not_highly_available" : (
+        check_vpc_availability, set(TOPOLOGY_SOURCES)
+    ),
+    "recent_role" : (check_recent_roles, {"iam"}),
+    "admin_role" : (check_admin_roles, {"iam"}),
+}
+
+
+
+
+def run_checks(
+        snapshot: ResourceSnapshot,
+        checks: list[str],
+        max_workers: int = MAX_WORKERS
+) -> list[dict]:
+    """_Run checks side by side over a snapshot._
+
+    Args:
+        snapshot (ResourceSnapshot): _The snapshot to check._
+        checks (list[str]): _Names of the checks, see `CHECKS`._
+        max_workers (int, optional): _How many checks run at once. Defaults to
+            `MAX_WORKERS`._
+
+    Returns:
+        list[dict]: _The findings of every check, in the order of `checks`._
+    """
+    # Imported here, so that --help never pays for the thread pool.
+    import concurrent.futures
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures: list = [
+            executor.submit(CHECKS[check][0], snapshot) for check in checks
+        ]
+
+    return [
+        check_finding
+        for future in futures
+        for check_finding in future.result()
+    ]
+
+
+
+
+def print_report(findings: list[dict]):
+    """_Print the combined report, grouped by check._
+
+    Args:
+        findings (list[dict]): _The findings of every check._
+    """
+    by_check: dict[str, list[dict]] = {}
+    for check_finding in findings:
+        by_check.setdefault(check_finding["check"], []).append(check_finding)
+
+    for check, check_findings in by_check.items():
+        print(f"\n{check} ({len(check_findings)})")
+        for check_finding in check_findings:
+            print(f"  [{check_finding['severity']}] "
+                f"{check_finding['resource']}: {check_finding['message']}")
+
+    print(f"\n{len(findings)} finding(s) from {len(by_check)} check(s)\n")
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Security Audit",
+        description="Run every security check over one snapshot of the account",
+    )
+    parser.add_argument(
+        "-c", "--check",
+        action="append",
+        choices=list(CHECKS),
+        help="Only run this check. Can be repeated. Defaults to every check",
+        dest="checks",
+    )
+    parser.add_argument(
+        "-j", "--json",
+        type=str,
+        help="Also write the findings to this JSON file",
+    )
+    parser.add_argument(
+        "-n", "--notify",
+        type=str,
+        help="Also publish the findings to this SNS topic as digests",
+    )
+    args = parser.parse_args()
+
+    checks: list[str] = args.checks or list(CHECKS)
+
+    # Only the sources the chosen checks read, and every one of them once.
+    needs: set[str] = set().union(*(CHECKS[check][1] for check in checks))
+
+    snapshot: ResourceSnapshot = ResourceSnapshot.from_api(
+        clients.client('ec2', max_pool_connections=MAX_WORKERS),
+        clients.client('iam', max_pool_connections=MAX_WORKERS),
+        needs,
+    )
+
+    findings: list[dict] = run_checks(snapshot, checks)
+    print_report(findings)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(findings, file, indent=2)
+
+    if args.notify:
+        notify = loader.load_script(NOTIFY)
+        notifier = notify.Notifier(
+            clients.client('sns'), notify.sns.create_sns_topic(args.notify)
+        )
+        notifier.add(findings)
+        notifier.flush()
+
+
+
+
+if __name__ == "__main__":
+    main()
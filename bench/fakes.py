@@ -0,0 +1,825 @@
+'''
+Author: Joseph Hopwood
+Description: Module containing a synthetic AWS account for the benchmarks. It
+stands in for `boto3.client()` and answers the calls the scripts make with
+generated resources, at whatever scale we ask for. Resources are generated from
+their index when a page is asked for, so even a million instances never sit in
+memory on the fake's side. Latency and throttling can be injected per call.
+'''
+
+import bisect
+import collections
+import datetime
+import fnmatch
+import random
+import threading
+import time
+
+# How many items a page holds, per operation. These follow the defaults of the
+# real APIs.
+PAGE_SIZES: dict[str, int] = {
+    "describe_instances" : 1000,
+    "describe_network_interfaces" : 1000,
+    "describe_security_groups" : 1000,
+    "describe_security_group_rules" : 1000,
+    "describe_vpcs" : 1000,
+    "describe_subnets" : 1000,
+    "describe_route_tables" : 1000,
+    "describe_nat_gateways" : 1000,
+    "describe_internet_gateways" : 1000,
+    "list_roles" : 100,
+    "list_attached_role_policies" : 100,
+    "list_role_policies" : 100,
+    "get_account_authorization_details" : 100,
+    "list_objects_v2" : 1000,
+    "list_buckets" : 10000,
+    "describe_alarms" : 100,
+}
+
+# How many times a throttled call is retried before it goes through anyway.
+# Real clients give up eventually, but a benchmark should always finish.
+MAX_RETRIES: int = 10
+
+INSTANCE_TYPES: tuple[str] = ("t3.micro", "t3.large", "m5.xlarge", "c5.2xlarge")
+AZS: tuple[tuple[str, str]] = (
+    ("us-east-1a", "use1-az1"),
+    ("us-east-1b", "use1-az2"),
+    ("us-east-1c", "use1-az4"),
+)
+
+# Marks the end of the items of a call.
+_END: object = object()
+
+# Inbound rules of every security group. Every fifth group also has port 22
+# open to the internet.
+RULES_PER_GROUP: int = 4
+
+# Regions buckets are spread over, and the grantee ACLs make buckets public with.
+REGIONS: tuple[str] = ("us-east-1", "us-west-2", "eu-west-1")
+ALL_USERS: str = "http://acs.amazonaws.com/groups/global/AllUsers"
+
+# The date every generated resource is dated relative to, so runs are the same.
+EPOCH: datetime.datetime = datetime.datetime(
+    2024, 1, 1, tzinfo=datetime.timezone.utc
+)
+
+# Roles are dated back from the start of today instead, so that the same
+# share of them is always "created in the last 90 days".
+TODAY: datetime.datetime = datetime.datetime.now(datetime.timezone.utc).replace(
+    hour=0, minute=0, second=0, microsecond=0
+)
+
+
+
+
+class Account:
+    """
+    A synthetic account. Every kind of resource has a count, and resource `i`
+    of a kind always looks the same.
+    """
+
+
+    def __init__(
+            self,
+            scale: int,
+            latency: float = 0.0,
+            throttle_rate: float = 0.0,
+            seed: int = 0,
+            objects_per_bucket: int = None
+    ):
+        """Initialize a new account.
+
+        Args:
+            scale (int): How many instances, security group rules, roles and
+                S3 objects there are. Everything else is sized relative to it.
+            latency (float, optional): Seconds every call takes. Defaults to 0.
+            throttle_rate (float, optional): Chance that a call is throttled
+                and has to be retried. Defaults to 0.
+            seed (int, optional): Seed of the throttling dice. Defaults to 0.
+            objects_per_bucket (int, optional): How many objects every bucket
+                holds, to try out huge buckets. Defaults to the S3 objects
+                spread over the buckets.
+        """
+        self.scale: int = scale
+        self.latency: float = latency
+        self.throttle_rate: float = throttle_rate
+
+        self.instances: int = scale
+        self.groups: int = max(scale // RULES_PER_GROUP, 1)
+        self.vpcs: int = max(scale // 1000, 1)
+        self.roles: int = scale
+        self.policies: int = max(scale // 100, 5)
+        self.buckets: int = min(max(scale // 1000, 1), 1000)
+        self.objects_per_bucket: int = (
+            objects_per_bucket or max(scale // self.buckets, 1)
+        )
+
+        # Instances that were terminated, and instances whose termination
+        # protection was turned off, by index.
+        self.terminated: set[int] = set()
+        self.unprotected: set[int] = set()
+
+        # How many instances were launched. They're numbered after the ones
+        # the account started with.
+        self.launched: int = 0
+
+        # What every benchmark reports on.
+        self.calls: collections.Counter = collections.Counter()
+        self.throttles: int = 0
+
+        self._random: random.Random = random.Random(seed)
+        self._lock: threading.Lock = threading.Lock()
+
+
+    def client(self, service_name: str, *args, **kwargs) -> "Client":
+        """Stands in for `boto3.client()`. Any config is ignored."""
+        return Client(self, service_name)
+
+
+    def call(self, operation: str):
+        """Account for one call: count it, wait out its latency, and retry it
+        with backoff as often as it gets throttled."""
+        for attempt in range(MAX_RETRIES):
+            with self._lock:
+                self.calls[operation] += 1
+                throttled: bool = self._random.random() < self.throttle_rate
+                if throttled:
+                    self.throttles += 1
+
+            if self.latency:
+                time.sleep(self.latency)
+
+            if not throttled:
+                return
+
+            # Like botocore, back off exponentially before trying again.
+            time.sleep(self.latency * 2 ** attempt)
+
+
+    # Let's define what every resource looks like.
+
+    def alarm(self, i: int) -> dict:
+        instance_id: str = f"i-{i:017x}"
+        return {
+            "AlarmName" : f"Web_server_HIGH_CPU_Utilization_{instance_id}",
+            "MetricName" : "CPUUtilization",
+            "Namespace" : "AWS/EC2",
+            "Dimensions" : [{"Name" : "InstanceId", "Value" : instance_id}],
+        }
+
+
+    def protected(self, i: int) -> bool:
+        """Every hundredth instance has termination protection on, except the
+        ones we launched."""
+        return i < self.instances and i % 100 == 50 and i not in self.unprotected
+
+
+    def capacity(self, instance_type: str, zone: str) -> int:
+        """How many instances of a type a zone has room for in one call. The
+        smallest type is out everywhere, zones ending in "a" are out of
+        everything, and the next smallest type comes in small lots."""
+        if instance_type == INSTANCE_TYPES[0] or (zone or "").endswith("a"):
+            return 0
+        if instance_type == INSTANCE_TYPES[1]:
+            return 50
+        return 10 ** 9
+
+
+    def instance(self, i: int) -> dict:
+        vpc: int = i % self.vpcs
+        subnet: int = vpc * 3 + i % 3
+        instance: dict = {
+            "InstanceId" : f"i-{i:017x}",
+            "InstanceType" : INSTANCE_TYPES[i % len(INSTANCE_TYPES)],
+            "State" : {"Name" : (
+                "terminated" if i in self.terminated
+                else "stopped" if i % 10 == 9 else "running"
+            )},
+            "Monitoring" : {"State" : "disabled"},
+            "VpcId" : f"vpc-{vpc:017x}",
+            "SubnetId" : f"subnet-{subnet:017x}",
+            "SecurityGroups" : [
+                {
+                    "GroupId" : f"sg-{i % self.groups:017x}",
+                    "GroupName" : f"group-{i % self.groups}",
+                },
+            ],
+        }
+        if i % 4:
+            instance["Tags"] = [{"Key" : "Name", "Value" : f"instance-{i}"}]
+        if i % 3 == 0:
+            instance["PublicIpAddress"] = f"54.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+        return instance
+
+
+    def network_interface(self, i: int) -> dict:
+        instance: dict = self.instance(i)
+        interface: dict = {
+            "NetworkInterfaceId" : f"eni-{i:017x}",
+            "InterfaceType" : "interface",
+            "Status" : "in-use",
+            "VpcId" : instance["VpcId"],
+            "SubnetId" : instance["SubnetId"],
+            "Attachment" : {"InstanceId" : instance["InstanceId"]},
+            "Groups" : instance["SecurityGroups"],
+        }
+        if "PublicIpAddress" in instance:
+            interface["Association"] = {"PublicIp" : instance["PublicIpAddress"]}
+        return interface
+
+
+    def group_rules(self, g: int) -> list[tuple]:
+        """(protocol, from port, to port, CIDR) of the inbound rules of a
+        group. A CIDR of None means the rule references another group."""
+        return [
+            ("tcp", 22, 22, "0.0.0.0/0" if g % 5 == 0 else "10.0.0.0/8"),
+            ("tcp", 443, 443, "0.0.0.0/0"),
+            ("tcp", 5432, 5432, "10.0.0.0/16"),
+            ("-1", -1, -1, None),
+        ]
+
+
+    def security_group(self, g: int) -> dict:
+        permissions: list[dict] = []
+        for protocol, from_port, to_port, cidr in self.group_rules(g):
+            permission: dict = {
+                "IpProtocol" : protocol,
+                "IpRanges" : [{"CidrIp" : cidr}] if cidr else [],
+                "UserIdGroupPairs" : [] if cidr else [{"GroupId" : f"sg-{g:017x}"}],
+            }
+            if protocol != "-1":
+                permission["FromPort"] = from_port
+                permission["ToPort"] = to_port
+            permissions.append(permission)
+
+        return {
+            "GroupId" : f"sg-{g:017x}",
+            "GroupName" : f"group-{g}",
+            "VpcId" : f"vpc-{g % self.vpcs:017x}",
+            "IpPermissions" : permissions,
+        }
+
+
+    def security_group_rule(self, r: int) -> dict:
+        g, k = divmod(r, RULES_PER_GROUP)
+        protocol, from_port, to_port, cidr = self.group_rules(g)[k]
+        rule: dict = {
+            "SecurityGroupRuleId" : f"sgr-{r:017x}",
+            "GroupId" : f"sg-{g:017x}",
+            "IsEgress" : False,
+            "IpProtocol" : protocol,
+            "FromPort" : from_port,
+            "ToPort" : to_port,
+        }
+        if cidr:
+            rule["CidrIpv4"] = cidr
+        else:
+            rule["ReferencedGroupInfo"] = {"GroupId" : f"sg-{g:017x}"}
+        return rule
+
+
+    def vpc(self, v: int) -> dict:
+        return {
+            "VpcId" : f"vpc-{v:017x}",
+            "CidrBlock" : f"10.{v % 256}.0.0/16",
+            "Tags" : [{"Key" : "Name", "Value" : f"vpc-{v}"}],
+        }
+
+
+    def subnet(self, s: int) -> dict:
+        v, k = divmod(s, 3)
+
+        # Every seventh VPC has all of its subnets in one AZ.
+        az, az_id = AZS[0 if v % 7 == 0 else k]
+        return {
+            "SubnetId" : f"subnet-{s:017x}",
+            "VpcId" : f"vpc-{v:017x}",
+            "AvailabilityZone" : az,
+            "AvailabilityZoneId" : az_id,
+            "CidrBlock" : f"10.{v % 256}.{k}.0/24",
+            "Tags" : [{"Key" : "Name", "Value" : f"subnet-{s}"}],
+        }
+
+
+    def route_table(self, t: int) -> dict:
+        v, private = divmod(t, 2)
+        local: dict = {"DestinationCidrBlock" : f"10.{v % 256}.0.0/16",
+            "GatewayId" : "local"}
+
+        # The main table sends everything out the internet gateway. The
+        # private one is for the last subnet, and goes through the NAT.
+        if private:
+            return {
+                "RouteTableId" : f"rtb-{t:017x}",
+                "VpcId" : f"vpc-{v:017x}",
+                "Associations" : [{"SubnetId" : f"subnet-{v * 3 + 2:017x}",
+                    "Main" : False}],
+                "Routes" : [local, {"DestinationCidrBlock" : "0.0.0.0/0",
+                    "NatGatewayId" : f"nat-{v:017x}"}],
+            }
+        return {
+            "RouteTableId" : f"rtb-{t:017x}",
+            "VpcId" : f"vpc-{v:017x}",
+            "Associations" : [{"Main" : True}],
+            "Routes" : [local, {"DestinationCidrBlock" : "0.0.0.0/0",
+                "GatewayId" : f"igw-{v:017x}"}],
+        }
+
+
+    def nat_gateway(self, v: int) -> dict:
+        return {
+            "NatGatewayId" : f"nat-{v:017x}",
+            "VpcId" : f"vpc-{v:017x}",
+            "SubnetId" : f"subnet-{v * 3:017x}",
+            "State" : "available",
+        }
+
+
+    def internet_gateway(self, v: int) -> dict:
+        return {
+            "InternetGatewayId" : f"igw-{v:017x}",
+            "Attachments" : [{"VpcId" : f"vpc-{v:017x}", "State" : "available"}],
+        }
+
+
+    def policy_arn(self, p: int) -> str:
+        return f"arn:aws:iam::123456789012:policy/policy-{p}"
+
+
+    def policy(self, p: int) -> dict:
+        # The first policy is an administrator policy, the rest are narrow.
+        if p == 0:
+            statement: dict = {"Effect" : "Allow", "Action" : "*", "Resource" : "*"}
+        else:
+            statement = {
+                "Effect" : "Allow",
+                "Action" : ["s3:GetObject", "ec2:Describe*"],
+                "Resource" : f"arn:aws:s3:::bucket-{p}/*",
+            }
+        return {
+            "PolicyName" : f"policy-{p}",
+            "Arn" : self.policy_arn(p),
+            "DefaultVersionId" : "v1",
+            "PolicyVersionList" : [
+                {
+                    "VersionId" : "v1",
+                    "IsDefaultVersion" : True,
+                    "Document" : {"Version" : "2012-10-17",
+                        "Statement" : [statement]},
+                },
+            ],
+        }
+
+
+    def role_index(self, role_name: str) -> int:
+        return int(role_name.rsplit("-", 1)[1])
+
+
+    def role_policies(self, r: int) -> list[int]:
+        # Every hundredth role is an administrator.
+        return [0 if r % 100 == 0 else 1 + r % (self.policies - 1)]
+
+
+    def role_inline_policies(self, r: int) -> list[str]:
+        return ["inline"] if r % 4 == 0 else []
+
+
+    def role(self, r: int) -> dict:
+        return {
+            "RoleName" : f"role-{r}",
+            "RoleId" : f"AROA{r:016d}",
+            "Arn" : f"arn:aws:iam::123456789012:role/role-{r}",
+            "CreateDate" : TODAY - datetime.timedelta(days=r % 730),
+        }
+
+
+    def role_detail(self, r: int) -> dict:
+        role: dict = self.role(r)
+        role["AttachedManagedPolicies"] = [
+            {"PolicyName" : f"policy-{p}", "PolicyArn" : self.policy_arn(p)}
+            for p in self.role_policies(r)
+        ]
+        role["RolePolicyList"] = [
+            {
+                "PolicyName" : name,
+                "PolicyDocument" : {"Statement" : [{"Effect" : "Allow",
+                    "Action" : "sqs:SendMessage", "Resource" : "*"}]},
+            }
+            for name in self.role_inline_policies(r)
+        ]
+        return role
+
+
+    def bucket(self, b: int) -> dict:
+        return {"Name" : f"bucket-{b}", "CreationDate" : EPOCH}
+
+
+    def bucket_region(self, b: int) -> str:
+        return REGIONS[b % len(REGIONS)]
+
+
+    def bucket_posture(self, b: int, operation: str) -> dict:
+        """What a bucket answers to one of the posture calls of the S3 audit,
+        or the error code it answers with. Every 20th bucket hosts a public
+        website, and a few others are exposed in other ways."""
+        website: bool = b % 20 == 0
+
+        if operation == "get_bucket_location":
+            region: str = self.bucket_region(b)
+            return {"LocationConstraint" : None if region == "us-east-1" else region}
+
+        if operation == "get_public_access_block":
+            if website or b % 10 == 5:
+                return "NoSuchPublicAccessBlockConfiguration"
+            return {"PublicAccessBlockConfiguration" : {
+                "BlockPublicAcls" : True,
+                "IgnorePublicAcls" : True,
+                "BlockPublicPolicy" : b % 30 != 1,
+                "RestrictPublicBuckets" : True,
+            }}
+
+        if operation == "get_bucket_policy_status":
+            if not website and b % 2:
+                return "NoSuchBucketPolicy"
+            return {"PolicyStatus" : {"IsPublic" : website}}
+
+        if operation == "get_bucket_acl":
+            grants: list[dict] = [{
+                "Grantee" : {"ID" : "owner", "Type" : "CanonicalUser"},
+                "Permission" : "FULL_CONTROL",
+            }]
+            if b % 50 == 7:
+                grants.append({
+                    "Grantee" : {"URI" : ALL_USERS, "Type" : "Group"},
+                    "Permission" : "READ",
+                })
+            return {"Owner" : {"ID" : "owner"}, "Grants" : grants}
+
+        if operation == "get_bucket_encryption":
+            if b % 25 == 3:
+                return "ServerSideEncryptionConfigurationNotFoundError"
+            return {"ServerSideEncryptionConfiguration" : {"Rules" : [{
+                "ApplyServerSideEncryptionByDefault" : {"SSEAlgorithm" : "AES256"},
+            }]}}
+
+        if operation == "get_bucket_website":
+            if not website:
+                return "NoSuchWebsiteConfiguration"
+            return {
+                "IndexDocument" : {"Suffix" : "index.html"},
+                "ErrorDocument" : {"Key" : "error.html"},
+            }
+
+        raise NotImplementedError(f"s3.{operation}")
+
+
+    def s3_key(self, o: int) -> str:
+        # Keys sort in the order of their index, like S3 lists them, spread
+        # over 16 prefixes.
+        return f"prefix-{o * 16 // self.objects_per_bucket:02d}/object-{o:010d}.bin"
+
+
+    def s3_object(self, b: int, o: int) -> dict:
+        return {
+            "Key" : self.s3_key(o),
+            "Size" : (o * 7919) % (64 * 1024 * 1024),
+            "LastModified" : EPOCH + datetime.timedelta(minutes=o),
+            "StorageClass" : "STANDARD",
+        }
+
+
+
+
+class Paginator:
+    """
+    Stands in for a botocore paginator. Pages are generated as they are asked
+    for, and every page is one call.
+    """
+
+
+    def __init__(self, client: "Client", operation: str):
+        self.client: "Client" = client
+        self.operation: str = operation
+
+
+    def paginate(self, **kwargs):
+        yield from self.client.pages(self.operation, kwargs)
+
+
+
+
+class Client:
+    """
+    Stands in for a low level boto3 client of one service.
+    """
+
+
+    def __init__(self, account: Account, service_name: str):
+        self.account: Account = account
+        self.service_name: str = service_name
+
+
+    def get_paginator(self, operation: str) -> Paginator:
+        return Paginator(self, operation)
+
+
+    def _filter(self, kwargs: dict, name: str) -> set[str]:
+        """The values of a filter of a describe call, or None if there is none."""
+        for api_filter in kwargs.get("Filters", kwargs.get("Filter", [])):
+            if isinstance(api_filter, dict) and api_filter["Name"] == name:
+                return set(api_filter["Values"])
+        return None
+
+
+    def _tagged(self, instances, key: str, patterns: list[str]):
+        """The instances with a tag that matches any of the patterns."""
+        for instance in instances:
+            tags: dict[str, str] = {
+                tag["Key"] : tag["Value"] for tag in instance.get("Tags", [])
+            }
+            if key in tags and any(
+                    fnmatch.fnmatchcase(tags[key], pattern) for pattern in patterns):
+                yield instance
+
+
+    def _items(self, operation: str, kwargs: dict) -> tuple[str, object]:
+        """The key the results of a call come back under, and an iterator over
+        every item it returns (across all pages)."""
+        account: Account = self.account
+
+        if operation == "describe_instances":
+            states: set[str] = self._filter(kwargs, "instance-state-name")
+            ids: set[str] = (
+                self._filter(kwargs, "instance-id") or set(kwargs.get("InstanceIds", []))
+            )
+            if ids:
+                indexes = sorted(int(instance_id[2:], 16) for instance_id in ids)
+            else:
+                indexes = range(account.instances)
+            instances = (account.instance(i) for i in indexes)
+            if states:
+                instances = (i for i in instances if i["State"]["Name"] in states)
+
+            # Tag filters may have wildcards, like the real thing.
+            for api_filter in kwargs.get("Filters", []):
+                if api_filter["Name"].startswith("tag:"):
+                    instances = self._tagged(
+                        instances, api_filter["Name"][4:], api_filter["Values"]
+                    )
+            return "Reservations", (
+                {"ReservationId" : f"r-{i['InstanceId'][2:]}", "Instances" : [i]}
+                for i in instances
+            )
+
+        # Every instance has the one network interface.
+        if operation == "describe_network_interfaces":
+            return "NetworkInterfaces", (
+                account.network_interface(i) for i in range(account.instances)
+            )
+
+        if operation == "describe_security_groups":
+            names: set[str] = set(kwargs.get("GroupNames", []))
+            groups = (account.security_group(g) for g in range(account.groups))
+            if names:
+                groups = (g for g in groups if g["GroupName"] in names)
+            return "SecurityGroups", groups
+
+        if operation == "describe_security_group_rules":
+            group_ids: set[str] = self._filter(kwargs, "group-id")
+            if group_ids:
+                rule_ids = (
+                    int(group_id[3:], 16) * RULES_PER_GROUP + k
+                    for group_id in sorted(group_ids)
+                    for k in range(RULES_PER_GROUP)
+                )
+            else:
+                rule_ids = range(account.groups * RULES_PER_GROUP)
+            return "SecurityGroupRules", (
+                account.security_group_rule(r) for r in rule_ids
+            )
+
+        # Every network resource is filtered by VPC the same way.
+        vpc_ids: set[str] = (
+            self._filter(kwargs, "vpc-id")
+            or self._filter(kwargs, "attachment.vpc-id")
+        )
+        vpcs = range(account.vpcs)
+        if vpc_ids:
+            vpcs = [v for v in vpcs if f"vpc-{v:017x}" in vpc_ids]
+
+        if operation == "describe_vpcs":
+            names = self._filter(kwargs, "tag:Name")
+            return "Vpcs", (
+                account.vpc(v) for v in vpcs
+                if not names or f"vpc-{v}" in names
+            )
+        if operation == "describe_subnets":
+            return "Subnets", (
+                account.subnet(v * 3 + k) for v in vpcs for k in range(3)
+            )
+        if operation == "describe_route_tables":
+            return "RouteTables", (
+                account.route_table(v * 2 + k) for v in vpcs for k in range(2)
+            )
+        if operation == "describe_nat_gateways":
+            return "NatGateways", (account.nat_gateway(v) for v in vpcs)
+        if operation == "describe_internet_gateways":
+            return "InternetGateways", (account.internet_gateway(v) for v in vpcs)
+
+        if operation == "list_roles":
+            return "Roles", (account.role(r) for r in range(account.roles))
+        if operation == "list_attached_role_policies":
+            r: int = account.role_index(kwargs["RoleName"])
+            return "AttachedPolicies", (
+                {"PolicyName" : f"policy-{p}", "PolicyArn" : account.policy_arn(p)}
+                for p in account.role_policies(r)
+            )
+        if operation == "list_role_policies":
+            r = account.role_index(kwargs["RoleName"])
+            return "PolicyNames", iter(account.role_inline_policies(r))
+        if operation == "get_account_authorization_details":
+            return None, (
+                [("Policies", account.policy(p)) for p in range(account.policies)]
+                + [("RoleDetailList", account.role_detail(r))
+                    for r in range(account.roles)]
+            )
+
+        if operation == "list_buckets":
+            return "Buckets", (account.bucket(b) for b in range(account.buckets))
+
+        if operation == "list_objects_v2":
+            b: int = int(kwargs["Bucket"].rsplit("-", 1)[1])
+            objects: range = range(account.objects_per_bucket)
+
+            # The keys are in order, so where a listing starts and ends can be
+            # looked up instead of listed up to.
+            prefix: str = kwargs.get("Prefix", "")
+            start: int = bisect.bisect_left(objects, prefix, key=account.s3_key)
+            if kwargs.get("StartAfter"):
+                start = max(start, bisect.bisect_right(
+                    objects, kwargs["StartAfter"], key=account.s3_key
+                ))
+            end: int = bisect.bisect_left(
+                objects, prefix + "\U0010FFFF", key=account.s3_key
+            )
+            return "Contents", (
+                account.s3_object(b, o) for o in objects[start:end]
+            )
+
+        # Every other instance has a high CPU alarm, named like alarms.py
+        # names them.
+        if operation == "describe_alarms":
+            prefix: str = kwargs.get("AlarmNamePrefix", "")
+            return "MetricAlarms", (
+                alarm for alarm in (
+                    account.alarm(i) for i in range(0, account.instances, 2)
+                )
+                if alarm["AlarmName"].startswith(prefix)
+            )
+
+        raise NotImplementedError(f"{self.service_name}.{operation}")
+
+
+    def pages(self, operation: str, kwargs: dict):
+        """Every page a call returns. Each one counts as a call."""
+        result_key, items = self._items(operation, kwargs)
+        page_size: int = kwargs.get("PaginationConfig", {}).get(
+            "PageSize", kwargs.get("MaxKeys", PAGE_SIZES.get(operation, 1000))
+        )
+
+        # We look one item ahead, so that a full last page isn't followed by
+        # an empty one.
+        items = iter(items)
+        upcoming = next(items, _END)
+        while True:
+            batch: list = []
+            while upcoming is not _END and len(batch) < page_size:
+                batch.append(upcoming)
+                upcoming = next(items, _END)
+
+            self.account.call(operation)
+
+            # The authorization details spread entities over multiple keys.
+            if result_key is None:
+                page: dict = {}
+                for key, item in batch:
+                    page.setdefault(key, []).append(item)
+            else:
+                page = {result_key : batch}
+
+            truncated: bool = upcoming is not _END
+            page["IsTruncated"] = truncated
+            yield page
+
+            if not truncated:
+                return
+
+
+    def _single(self, operation: str, kwargs: dict) -> dict:
+        """A call without a paginator only gets the first page, like the real
+        thing. EC2 is the exception, and hands back everything without a
+        MaxResults."""
+        if self.service_name == "ec2":
+            kwargs = dict(kwargs, PaginationConfig={"PageSize" : 10 ** 9})
+        return next(self.pages(operation, kwargs))
+
+
+    def __getattr__(self, operation: str):
+        """Every API call that isn't a paginator."""
+        if operation.startswith("_"):
+            raise AttributeError(operation)
+
+        account: Account = self.account
+
+        def api_call(**kwargs) -> dict:
+            if operation == "list_buckets":
+                account.call(operation)
+                count: int = min(account.buckets, kwargs.get("MaxBuckets", 10000))
+                return {"Buckets" : [account.bucket(b) for b in range(count)]}
+
+            if operation in PAGE_SIZES:
+                return self._single(operation, kwargs)
+
+            # The bucket settings the S3 audit reads.
+            if operation == "get_bucket_location" or (
+                    operation.startswith("get_") and "Bucket" in kwargs):
+                account.call(operation)
+                b: int = int(kwargs["Bucket"].rsplit("-", 1)[1])
+                answer = account.bucket_posture(b, operation)
+                if isinstance(answer, str):
+                    import botocore.exceptions
+                    raise botocore.exceptions.ClientError(
+                        {"Error" : {"Code" : answer, "Message" : answer}},
+                        operation,
+                    )
+                return answer
+
+            # Terminating fails as a whole if any instance is protected.
+            if operation == "terminate_instances":
+                account.call(operation)
+                indexes: list[int] = [
+                    int(instance_id[2:], 16) for instance_id in kwargs["InstanceIds"]
+                ]
+                protected: list[str] = [
+                    f"i-{i:017x}" for i in indexes if account.protected(i)
+                ]
+                if protected:
+                    import botocore.exceptions
+                    raise botocore.exceptions.ClientError(
+                        {"Error" : {
+                            "Code" : "OperationNotPermitted",
+                            "Message" : f"The instances '{', '.join(protected)}' "
+                                "may not be terminated. Modify its "
+                                "'disableApiTermination' instance attribute "
+                                "and try again.",
+                        }},
+                        operation,
+                    )
+                with account._lock:
+                    account.terminated.update(indexes)
+                return {"TerminatingInstances" : [
+                    {"InstanceId" : f"i-{i:017x}"} for i in indexes
+                ]}
+
+            if operation == "describe_images":
+                account.call(operation)
+                return {"Images" : [{"ImageId" : "ami-00000000000000000"}]}
+
+            # Launching takes what capacity there is, down to MinCount.
+            if operation == "run_instances":
+                account.call(operation)
+                capacity: int = account.capacity(
+                    kwargs["InstanceType"],
+                    kwargs.get("Placement", {}).get("AvailabilityZone"),
+                )
+                count: int = min(kwargs["MaxCount"], capacity)
+                if count < kwargs["MinCount"]:
+                    import botocore.exceptions
+                    raise botocore.exceptions.ClientError(
+                        {"Error" : {
+                            "Code" : "InsufficientInstanceCapacity",
+                            "Message" : "We currently do not have sufficient "
+                                f"{kwargs['InstanceType']} capacity.",
+                        }},
+                        operation,
+                    )
+                with account._lock:
+                    first: int = account.instances + account.launched
+                    account.launched += count
+                return {"Instances" : [
+                    dict(account.instance(i), InstanceType=kwargs["InstanceType"])
+                    for i in range(first, first + count)
+                ]}
+
+            if operation == "modify_instance_attribute":
+                account.call(operation)
+                if "DisableApiTermination" in kwargs:
+                    with account._lock:
+                        account.unprotected.add(int(kwargs["InstanceId"][2:], 16))
+                return {}
+
+            # Everything else changes something. We only count it.
+            account.call(operation)
+            return {}
+
+        return api_call
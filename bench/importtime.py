@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+'''
+Author: Joseph Hopwood
+Description: Benchmark of how long the CLI takes to start up. Every case is run
+in a fresh interpreter with `-X importtime`, and fails if its imports add up to
+more than the budget, or if boto3 (or NumPy) gets imported when it shouldn't
+be.
+
+Example:
+
+python3 bench/importtime.py
+python3 bench/importtime.py --budget 50 --runs 5
+'''
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# The root of the repository.
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The startup budget, in milliseconds.
+DEFAULT_BUDGET_MS: float = 50.0
+
+# The commands of the CLI, so that every one of them gets a case.
+sys.path.insert(0, ROOT)
+from cli import COMMANDS
+
+# Every case we time: the arguments to cli.py. None of these make a client, so
+# none of them should import boto3.
+CASES: list[list[str]] = [["--help"]] + [
+    [command, "--help"] for command in COMMANDS
+]
+
+# Modules that must not show up in a case's imports.
+HEAVY_MODULES: tuple[str, ...] = ("boto3", "botocore", "numpy")
+
+
+
+
+def parse_importtime(stderr: str) -> tuple[float, set[str]]:
+    """_Add up the output of `-X importtime`._
+
+    Args:
+        stderr (str): _What the interpreter wrote to stderr._
+
+    Returns:
+        tuple[float, set[str]]: _The total import time in milliseconds, and the
+            name of every module that was imported._
+    """
+    total_us: int = 0
+    modules: set[str] = set()
+
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        # "import time: self [us] | cumulative | imported package", where
+        # nested imports are indented under the package that imported them.
+        _, cumulative, package = line[len("import time:"):].split("|")
+        name: str = package.rstrip()
+        modules.add(name.strip())
+
+        # Only top level imports count, their cumulative time already
+        # includes everything they imported.
+        if not name.startswith("  "):
+            total_us += int(cumulative)
+
+    return total_us / 1000, modules
+
+
+
+
+def run_case(args: list[str]) -> tuple[float, float, set[str]]:
+    """_Run cli.py once in a fresh interpreter._
+
+    Args:
+        args (list[str]): _Arguments to cli.py._
+
+    Returns:
+        tuple[float, float, set[str]]: _The wall time and import time in
+            milliseconds, and the modules that were imported._
+    """
+    start: float = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.join(ROOT, "cli.py"), *args],
+        capture_output=True,
+        text=True,
+        cwd=ROOT,
+    )
+    wall_ms: float = (time.perf_counter() - start) * 1000
+
+    import_ms, modules = parse_importtime(result.stderr)
+    return wall_ms, import_ms, modules
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Startup Benchmark",
+        description="Time the CLI startup with -X importtime",
+    )
+    parser.add_argument(
+        "-b", "--budget",
+        type=float,
+        default=DEFAULT_BUDGET_MS,
+        help="Most milliseconds of imports a case may take. Defaults to 50",
+    )
+    parser.add_argument(
+        "-r", "--runs",
+        type=int,
+        default=5,
+        help="How many times to run each case. The median counts. Defaults to 5",
+    )
+    args = parser.parse_args()
+
+    failed: bool = False
+
+    print(f"{'case':<28}{'wall ms':>10}{'import ms':>12}  result")
+
+    for case in CASES:
+        runs: list = [run_case(case) for _ in range(args.runs)]
+        wall_ms: float = statistics.median(run[0] for run in runs)
+        import_ms: float = statistics.median(run[1] for run in runs)
+        heavy: list[str] = sorted(
+            module for module in runs[0][2] if module in HEAVY_MODULES
+        )
+
+        result: str = "ok"
+        if heavy:
+            result = f"FAIL imported {', '.join(heavy)}"
+        elif import_ms > args.budget:
+            result = f"FAIL over {args.budget:g}ms"
+        failed = failed or result != "ok"
+
+        print(f"{' '.join(case):<28}{wall_ms:>10.1f}{import_ms:>12.1f}  {result}")
+
+    sys.exit(1 if failed else 0)
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+'''
+Author: Joseph Hopwood
+Description: Write out a local S3 Inventory report of a synthetic bucket (see
+`fakes.py`), to try the inventory mode of 'week 2 - S3/listbuckets.py' against
+without an AWS account. The objects are the same ones the synthetic account
+lists, so both modes should come up with the same totals. The report is laid
+out like it would be in its destination bucket.
+
+Example:
+
+python3 bench/make_inventory.py /tmp/inventory --objects 10000000 --files 16
+python3 "week 2 - S3/listbuckets.py" -i /tmp/inventory/bucket-0/daily/2024-01-01T00-00Z/manifest.json
+'''
+
+import argparse
+import csv
+import gzip
+import json
+import os
+
+import fakes
+
+# The columns of the report, the way S3 Inventory names them.
+FILE_SCHEMA: str = "Bucket, Key, Size, LastModifiedDate, StorageClass"
+
+# Where the report goes, under the destination folder.
+CONFIG_ID: str = "daily"
+REPORT_DATE: str = "2024-01-01T00-00Z"
+
+
+
+
+def write_inventory(
+        destination: str,
+        objects: int,
+        files: int,
+        bucket: int = 0
+) -> str:
+    """_Write a CSV inventory report of a synthetic bucket._
+
+    Args:
+        destination (str): _Folder that stands in for the destination bucket._
+        objects (int): _How many objects the bucket holds._
+        files (int): _How many data files to spread them over._
+        bucket (int, optional): _Which synthetic bucket. Defaults to 0._
+
+    Returns:
+        str: _Path of the manifest._
+    """
+    account: fakes.Account = fakes.Account(objects)
+    bucket_name: str = account.bucket(bucket)["Name"]
+    prefix: str = f"{bucket_name}/{CONFIG_ID}"
+
+    os.makedirs(os.path.join(destination, prefix, "data"), exist_ok=True)
+    os.makedirs(os.path.join(destination, prefix, REPORT_DATE), exist_ok=True)
+
+    data_files: list[dict] = []
+    per_file: int = -(-objects // files)
+
+    for f in range(files):
+        key: str = f"{prefix}/data/part-{f:05d}.csv.gz"
+        path: str = os.path.join(destination, key)
+
+        # Fast compression, we're after something to read, not a small file.
+        with gzip.open(path, "wt", newline="", compresslevel=1) as file:
+            writer = csv.writer(file)
+            for o in range(f * per_file, min((f + 1) * per_file, objects)):
+                s3_object: dict = account.s3_object(bucket, o)
+                writer.writerow([
+                    bucket_name,
+                    s3_object["Key"],
+                    s3_object["Size"],
+                    s3_object["LastModified"].strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                    s3_object["StorageClass"],
+                ])
+
+        data_files.append({
+            "key" : key,
+            "size" : os.path.getsize(path),
+            "MD5checksum" : "",
+        })
+
+    manifest_path: str = os.path.join(
+        destination, prefix, REPORT_DATE, "manifest.json"
+    )
+    with open(manifest_path, "w") as file:
+        json.dump({
+            "sourceBucket" : bucket_name,
+            "destinationBucket" : "arn:aws:s3:::inventory-destination",
+            "version" : "2016-11-30",
+            "creationTimestamp" : str(int(fakes.EPOCH.timestamp() * 1000)),
+            "fileFormat" : "CSV",
+            "fileSchema" : FILE_SCHEMA,
+            "files" : data_files,
+        }, file, indent=2)
+
+    return manifest_path
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Inventory Generator",
+        description="Write a local S3 Inventory report of a synthetic bucket",
+    )
+    parser.add_argument(
+        "destination",
+        type=str,
+        help="Folder to write the report to",
+    )
+    parser.add_argument(
+        "-n", "--objects",
+        type=int,
+        default=1000000,
+        help="How many objects the bucket holds. Defaults to 1000000",
+    )
+    parser.add_argument(
+        "-f", "--files",
+        type=int,
+        default=8,
+        help="How many data files to spread them over. Defaults to 8",
+    )
+    args = parser.parse_args()
+
+    print(write_inventory(args.destination, args.objects, args.files))
+
+
+
+
+if __name__ == "__main__":
+    main()
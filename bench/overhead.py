@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+'''
+Author: Joseph Hopwood
+Description: Benchmark of what the instrumentation in common/instrument.py
+costs. A real botocore client makes the same calls with and without the
+hooks, with every HTTP request answered locally by a canned response after a
+fixed delay, so the only thing that differs between the two is the hooks.
+Fails if they add more than the budget.
+
+Example:
+
+python3 bench/overhead.py
+python3 bench/overhead.py --calls 2000 --latency 20
+'''
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import boto3
+import botocore.awsrequest
+import botocore.config
+
+# The code shared by every script lives at the root of the repository.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import instrument
+
+# The most the hooks may add, as a fraction of the time of a call.
+DEFAULT_BUDGET: float = 0.02
+
+# What DescribeVpcs answers with.
+RESPONSE_BODY: bytes = b"""<?xml version="1.0" encoding="UTF-8"?>
+<DescribeVpcsResponse xmlns="http://ec2.amazonaws.com/doc/2016-11-15/">
+    <requestId>00000000-0000-0000-0000-000000000000</requestId>
+    <vpcSet>
+        <item>
+            <vpcId>vpc-00000000000000001</vpcId>
+            <cidrBlock>10.0.0.0/16</cidrBlock>
+            <state>available</state>
+        </item>
+    </vpcSet>
+</DescribeVpcsResponse>"""
+
+
+
+
+class _Raw:
+    """Just enough of a urllib3 response for botocore to read the body."""
+
+
+    def __init__(self, body: bytes):
+        self.body: bytes = body
+
+
+    def stream(self, *args, **kwargs):
+        yield self.body
+
+
+
+
+def make_client(latency: float, instrumented: bool):
+    """_Make an EC2 client whose requests never leave the machine._
+
+    Args:
+        latency (float): _Seconds every request takes._
+        instrumented (bool): _Whether the instrumentation hooks are on._
+
+    Returns:
+        _A low level boto3 client for EC2._
+    """
+    session = boto3.session.Session(
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing",
+        region_name="us-east-1",
+    )
+    if instrumented:
+        instrument.Recorder().register(session.events)
+
+    client = session.client(
+        "ec2",
+        config=botocore.config.Config(retries={"mode" : "standard"}),
+    )
+
+    def send(request, **kwargs):
+        time.sleep(latency)
+        return botocore.awsrequest.AWSResponse(
+            request.url, 200, {}, _Raw(RESPONSE_BODY)
+        )
+
+    client.meta.events.register("before-send.ec2.DescribeVpcs", send)
+    return client
+
+
+
+
+def time_calls(client, calls: int) -> float:
+    """_Make a number of calls, and return how many seconds they took._"""
+    start: float = time.perf_counter()
+    for _ in range(calls):
+        client.describe_vpcs()
+    return time.perf_counter() - start
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Instrumentation Overhead",
+        description="Measure what the API call instrumentation costs",
+    )
+    parser.add_argument(
+        "-n", "--calls",
+        type=int,
+        default=500,
+        help="Calls per round. Defaults to 500",
+    )
+    parser.add_argument(
+        "-l", "--latency",
+        type=float,
+        default=10.0,
+        help="Milliseconds every request takes. Defaults to 10",
+    )
+    parser.add_argument(
+        "-r", "--rounds",
+        type=int,
+        default=5,
+        help="Rounds to run. The median counts. Defaults to 5",
+    )
+    parser.add_argument(
+        "-b", "--budget",
+        type=float,
+        default=DEFAULT_BUDGET,
+        help="Most overhead allowed, as a fraction. Defaults to 0.02",
+    )
+    args = parser.parse_args()
+
+    plain = make_client(args.latency / 1000, instrumented=False)
+    hooked = make_client(args.latency / 1000, instrumented=True)
+
+    # Let's warm both up, and then take turns so any drift hits both alike.
+    time_calls(plain, 10)
+    time_calls(hooked, 10)
+
+    plain_times: list[float] = []
+    hooked_times: list[float] = []
+    for _ in range(args.rounds):
+        plain_times.append(time_calls(plain, args.calls))
+        hooked_times.append(time_calls(hooked, args.calls))
+
+    plain_s: float = statistics.median(plain_times)
+    hooked_s: float = statistics.median(hooked_times)
+    overhead: float = hooked_s / plain_s - 1
+
+    print(f"without hooks: {plain_s / args.calls * 1e6:8.1f} us/call")
+    print(f"with hooks:    {hooked_s / args.calls * 1e6:8.1f} us/call")
+    print(f"overhead:      {overhead:8.2%} (budget {args.budget:.0%})")
+
+    sys.exit(1 if overhead > args.budget else 0)
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+'''
+Author: Joseph Hopwood
+Description: Check that the health prober (see Final/health-probe/prober.py)
+doesn't run out of file descriptors when every target is a host of its own,
+like the instances of an ec2_report.py export. A local HTTP server answers on
+every 127.0.x.y address, and the prober probes thousands of them under a low
+limit on open files. Fails if any target isn't ready.
+
+Example:
+
+python3 bench/probe_fds.py
+python3 bench/probe_fds.py --hosts 5000 --fd-limit 1024 --rounds 3
+'''
+
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What the server answers every request with.
+RESPONSE: bytes = (
+    b"HTTP/1.1 200 OK\r\n"
+    b"Content-Type: text/plain\r\n"
+    b"Content-Length: 2\r\n"
+    b"\r\n"
+    b"ok"
+)
+
+
+
+
+async def serve():
+    """_Answer every request on every loopback address, keeping every
+    connection alive, and print the port once listening._"""
+
+    async def answer(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line: bytes = await reader.readline()
+                if not line:
+                    break
+                # Let's skip the headers, the answer is always the same.
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                writer.write(RESPONSE)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # Bound to every address, so 127.0.x.y all reach it.
+    server: asyncio.AbstractServer = await asyncio.start_server(
+        answer, "0.0.0.0", 0, backlog=4096
+    )
+    print(server.sockets[0].getsockname()[1], flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+
+
+def host_addresses(count: int) -> list[str]:
+    """_Make distinct loopback addresses, skipping the .0 and .255 ones._
+
+    Args:
+        count (int): _How many._
+
+    Returns:
+        list[str]: _The addresses._
+    """
+    return [
+        f"127.0.{index // 254}.{index % 254 + 1}" for index in range(count)
+    ]
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Prober File Descriptor Check",
+        description="Probe many local hosts under a low limit on open files",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help=argparse.SUPPRESS,
+    )
+    parser.add_argument(
+        "--hosts",
+        type=int,
+        default=2000,
+        help="How many hosts to probe. Defaults to 2000",
+    )
+    parser.add_argument(
+        "--fd-limit",
+        type=int,
+        default=1024,
+        help="Most files the prober may have open. Defaults to 1024",
+    )
+    parser.add_argument(
+        "-n", "--rounds",
+        type=int,
+        default=1,
+        help="How many times to probe every host. Defaults to 1",
+    )
+    args = parser.parse_args()
+
+    if args.serve:
+        # The server keeps its end of every connection open, so it gets as
+        # many files as it is allowed.
+        _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        asyncio.run(serve())
+        return
+
+    server: subprocess.Popen = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve"],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        port: int = int(server.stdout.readline())
+
+        # Lowered only after the server was started, so it doesn't inherit it.
+        _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (args.fd_limit, hard))
+
+        sys.path.insert(0, os.path.join(ROOT, "Final", "health-probe"))
+        import prober
+
+        urls: list[str] = [
+            f"http://{address}:{port}/" for address in host_addresses(args.hosts)
+        ]
+        report: dict = asyncio.run(prober.probe_all(urls, rounds=args.rounds))
+    finally:
+        server.terminate()
+        server.wait()
+
+    errors: dict[str, int] = {}
+    for result in report["targets"].values():
+        for code, count in result["errors"].items():
+            errors[code] = errors.get(code, 0) + count
+    down: int = sum(
+        not result["ready"] for result in report["targets"].values()
+    )
+
+    print(
+        f"{args.hosts} hosts, {report['connections']} connections, "
+        f"{report['seconds']:.1f}s, down {down}"
+        + (f" {errors}" if errors else "")
+    )
+    print("ok" if not down else f"FAIL {down} not ready under {args.fd_limit} "
+        "open files")
+    sys.exit(1 if down else 0)
+
+
+
+
+if __name__ == "__main__":
+    main()
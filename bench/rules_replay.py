@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+'''
+Author: Joseph Hopwood
+Description: Check that the rules engine (see week 5 - SNS/rules.py) takes a
+datapoint only once, no matter how many ticks fetch it. Ticks run against a
+stand-in for CloudWatch that answers with a fixed set of datapoints, at the
+same odd times the engine would tick at. A datapoint fetched on two ticks must
+not count as two periods in a row, and two real ones still must.
+
+Example:
+
+python3 bench/rules_replay.py
+'''
+
+import datetime
+import os
+import sys
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The code shared by every script, and the scripts of week 5.
+sys.path[:0] = [os.path.join(ROOT, "week 5 - SNS"), ROOT]
+import metrics
+import rules
+
+INSTANCE_ID: str = "i-1"
+PERIOD: int = 300
+
+
+
+
+def at(clock: str) -> datetime.datetime:
+    """_A time of the day the ticks run on, like "12:18:02"._"""
+    return datetime.datetime.fromisoformat(f"2026-01-01T{clock}+00:00")
+
+
+
+
+class CloudWatch:
+    """
+    Stands in for a CloudWatch client. Every metric of every instance has the
+    same datapoints, and a call gets the ones inside its time range.
+    """
+
+
+    def __init__(self, datapoints: list[tuple[str, float]]):
+        self.datapoints: list[tuple[datetime.datetime, float]] = [
+            (at(clock), value) for clock, value in datapoints
+        ]
+
+
+    def get_paginator(self, operation: str):
+        return self
+
+
+    def paginate(self, MetricDataQueries, StartTime, EndTime, **kwargs):
+        inside: list = [
+            (timestamp, value) for timestamp, value in self.datapoints
+            if StartTime <= timestamp < EndTime
+        ]
+        yield {
+            "MetricDataResults" : [
+                {
+                    "Id" : query["Id"],
+                    "Timestamps" : [timestamp for timestamp, _ in inside],
+                    "Values" : [value for _, value in inside],
+                }
+                for query in MetricDataQueries
+            ],
+        }
+
+
+
+
+def tick(engine: rules.RulesEngine, cloudwatch: CloudWatch, clock: str) -> dict:
+    """_Run one tick of the engine, the way `rules.main()` does._"""
+    end: datetime.datetime = at(clock)
+    fleet_metrics = metrics.collect_fleet_metrics(
+        cloudwatch,
+        [INSTANCE_ID],
+        end - datetime.timedelta(seconds=2 * PERIOD),
+        end,
+        PERIOD,
+        {"CPUUtilization" : "Average"},
+    )
+    values, timestamps = rules.latest_datapoints(fleet_metrics, "CPUUtilization")
+    return engine.tick(
+        [INSTANCE_ID],
+        {"CPUUtilization" : values},
+        {"CPUUtilization" : timestamps},
+    )
+
+
+
+
+def main():
+
+    failed: bool = False
+
+    # Let's fetch one busy datapoint on two ticks. That is one period, so
+    # nothing may fire.
+    engine: rules.RulesEngine = rules.RulesEngine([rules.sustained_high_cpu()])
+    cloudwatch: CloudWatch = CloudWatch([("12:10:00", 95.0)])
+    for clock in ("12:13:00", "12:18:02"):
+        actions: dict = tick(engine, cloudwatch, clock)
+        result: str = "ok" if not actions else f"FAIL fired {actions}"
+        failed = failed or bool(actions)
+        print(f"{'same datapoint, tick ' + clock:<36}{result}")
+
+    # Then a second busy datapoint comes in. That is two periods in a row.
+    cloudwatch.datapoints.append((at("12:15:00"), 95.0))
+    actions = tick(engine, cloudwatch, "12:23:01")
+    fired: bool = actions == {"reboot" : {"sustained_high_cpu" : [INSTANCE_ID]}}
+    failed = failed or not fired
+    print(f"{'new datapoint, tick 12:23:01':<36}"
+        f"{'ok' if fired else f'FAIL got {actions}'}")
+
+    sys.exit(1 if failed else 0)
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+'''
+Author: Joseph Hopwood
+Description: Offline benchmarks of the scripts. Every case runs a script's
+`main()` in a fresh interpreter against a synthetic account (see `fakes.py`),
+and reports its wall time, how many API calls it made, and its peak memory.
+The results are compared against 'baseline.json': any increase in API calls,
+or a wall time too far over the baseline, fails the run.
+
+Example:
+
+python3 bench/run.py
+python3 bench/run.py --scale 1000 --scale 100000 --latency 20 --throttle 0.05
+python3 bench/run.py --case iam_roles --update-baseline
+'''
+
+import argparse
+import contextlib
+import json
+import os
+import resource
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+
+import fakes
+
+# The root of the repository, which every script path is relative to.
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BASELINE_PATH: str = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Every case: the script it runs, and the arguments it runs it with. "{tmp}"
+# is swapped for a scratch directory of the run.
+CASES: dict[str, tuple[str, list[str]]] = {
+    "ec2_report" : ("week 4 - Reporting/ec2_report.py", []),
+    "listbuckets" : ("week 2 - S3/listbuckets.py", []),
+    "listbuckets_estimate" : ("week 2 - S3/listbuckets.py", ["-e"]),
+    "s3bulk_delete" : ("week 2 - S3/s3bulk.py", ["delete", "-b", "bucket-0"]),
+    "monitor_security" : ("Final/monitor-security/monitor_security.py", []),
+    "sg_report" : ("week 7 - Security Auditing/ec2-sg.py", []),
+    "iam_roles" : ("week 7 - Security Auditing/iam-roles.py", []),
+    "iam_roles_snapshot" : (
+        "week 7 - Security Auditing/iam-roles.py",
+        ["-s", "{tmp}/snapshot.json", "-c", "*"],
+    ),
+    "vpc_ha" : ("week 7 - Security Auditing/student-choice.py", ["--routes"]),
+    "audit" : ("audit.py", ["-j", "{tmp}/findings.json"]),
+    "s3_audit" : ("week 7 - Security Auditing/s3_audit.py", []),
+    "exposure_map" : ("week 7 - Security Auditing/exposure_map.py", []),
+    "launcher" : (
+        "week 5 - SNS/launcher.py",
+        ["-t", "t3.micro", "t3.large", "m5.xlarge", "-n", "100"],
+    ),
+    "launcher_parallel" : (
+        "week 5 - SNS/launcher.py",
+        ["-t", "t3.micro", "t3.large", "m5.xlarge", "-n", "100", "-p"],
+    ),
+    "teardown" : (
+        "week 5 - SNS/teardown.py",
+        ["-t", "Name=instance-*", "--force", "--alarms"],
+    ),
+}
+
+# How much slower than the baseline a case may get, as a fraction...
+DEFAULT_TOLERANCE: float = 0.25
+
+# ...and never less than this many seconds, so tiny cases don't fail on noise.
+MIN_SLOWDOWN: float = 0.05
+
+
+
+
+def run_case(case: str, account: fakes.Account) -> dict:
+    """_Run one case in this interpreter, against a synthetic account._
+
+    Args:
+        case (str): _Name of the case, see `CASES`._
+        account (fakes.Account): _The account the script talks to._
+
+    Returns:
+        dict: _Wall time in seconds, peak memory in MiB, API calls by
+            operation, and throttles._
+    """
+    # Every client any script makes, directly or through common/clients.py,
+    # now comes from the synthetic account.
+    import boto3
+    boto3.client = account.client
+
+    path, args = CASES[case]
+    full_path: str = os.path.join(ROOT, path)
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        # The script should see the same path and arguments it would if it was
+        # run through cli.py: the root of the repository and its own folder.
+        # Anything it writes ends up in the scratch directory.
+        sys.path[:0] = [os.path.dirname(full_path), ROOT]
+        sys.argv = [full_path, *(arg.format(tmp=tmp) for arg in args)]
+        os.chdir(tmp)
+
+        start: float = time.perf_counter()
+        with open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stdout(devnull):
+                runpy.run_path(full_path, run_name="__main__")
+        wall: float = time.perf_counter() - start
+
+    return {
+        "wall" : round(wall, 4),
+        # ru_maxrss is in KiB on Linux.
+        "peak_mb" : round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "calls" : dict(sorted(account.calls.items())),
+        "throttles" : account.throttles,
+    }
+
+
+
+
+def spawn_case(case: str, scale: int, latency: float, throttle: float) -> dict:
+    """_Run one case in a fresh interpreter, so that memory and module caches
+    of one case never leak into the next._"""
+    result = subprocess.run(
+        [
+            sys.executable, __file__, "--worker",
+            "--case", case,
+            "--scale", str(scale),
+            "--latency", str(latency),
+            "--throttle", str(throttle),
+        ],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        return {"error" : result.stderr.strip().splitlines()[-1]}
+
+    return json.loads(result.stdout)
+
+
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """_Compare a result against its baseline._
+
+    Args:
+        result (dict): _See `run_case()`._
+        baseline (dict): _A result from an earlier run, or None._
+        tolerance (float): _How much slower it may get, as a fraction._
+
+    Returns:
+        list[str]: _Every regression. Empty if there are none._
+    """
+    if "error" in result:
+        return [result["error"]]
+    if not baseline:
+        return []
+
+    regressions: list[str] = []
+
+    for operation, count in result["calls"].items():
+        if count > baseline["calls"].get(operation, 0):
+            regressions.append(f"{operation} {baseline['calls'].get(operation, 0)}"
+                f" -> {count} calls")
+
+    allowed: float = max(baseline["wall"] * (1 + tolerance),
+        baseline["wall"] + MIN_SLOWDOWN)
+    if result["wall"] > allowed:
+        regressions.append(f"wall {baseline['wall']:.3f}s -> {result['wall']:.3f}s")
+
+    return regressions
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Offline Benchmarks",
+        description="Benchmark the scripts against a synthetic account",
+    )
+    parser.add_argument(
+        "-c", "--case",
+        action="append",
+        choices=list(CASES),
+        help="Only run this case. Can be repeated. Defaults to every case",
+        dest="cases",
+    )
+    parser.add_argument(
+        "-s", "--scale",
+        action="append",
+        type=int,
+        help="How many instances, rules, roles and objects. Can be repeated. "
+            "Defaults to 1000",
+        dest="scales",
+    )
+    parser.add_argument(
+        "-l", "--latency",
+        type=float,
+        default=0.0,
+        help="Milliseconds every API call takes. Defaults to 0",
+    )
+    parser.add_argument(
+        "-t", "--throttle",
+        type=float,
+        default=0.0,
+        help="Chance that an API call is throttled. Defaults to 0",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="How much slower than the baseline a case may get. Defaults to 0.25",
+    )
+    parser.add_argument(
+        "-u", "--update-baseline",
+        action="store_true",
+        help="Write the results to the baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help=argparse.SUPPRESS,
+    )
+    args = parser.parse_args()
+
+    cases: list[str] = args.cases or list(CASES)
+    scales: list[int] = args.scales or [1000]
+
+    # WORKER - run a single case, and hand the result back on stdout
+    if args.worker:
+        account: fakes.Account = fakes.Account(
+            scales[0], args.latency / 1000, args.throttle
+        )
+        result: dict = run_case(cases[0], account)
+        sys.stdout = sys.__stdout__
+        print(json.dumps(result))
+        return
+
+    baseline: dict = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, "r") as file:
+            baseline = json.load(file)
+
+    failed: bool = False
+
+    print(f"{'case':<20}{'scale':>9}{'wall s':>10}{'calls':>9}{'throttles':>11}"
+        f"{'peak MiB':>10}  result")
+
+    for scale in scales:
+        for case in cases:
+            result = spawn_case(case, scale, args.latency, args.throttle)
+
+            # Results are only comparable under the same conditions.
+            key: str = f"{case}@{scale}/{args.latency:g}ms/{args.throttle:g}"
+
+            if args.update_baseline and "error" not in result:
+                baseline[key] = result
+                regressions: list[str] = []
+            else:
+                regressions = compare(result, baseline.get(key), args.tolerance)
+            failed = failed or bool(regressions)
+
+            if "error" in result:
+                print(f"{case:<20}{scale:>9}  ERROR {result['error']}")
+                continue
+
+            print(f"{case:<20}{scale:>9}{result['wall']:>10.3f}"
+                f"{sum(result['calls'].values()):>9}{result['throttles']:>11}"
+                f"{result['peak_mb']:>10.1f}  "
+                f"{'; '.join(regressions) or 'ok'}")
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, "w") as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+
+    sys.exit(1 if failed else 0)
+
+
+
+
+if __name__ == "__main__":
+    main()
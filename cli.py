@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+'''
+Author: Joseph Hopwood
+Description: One entry point for the scripts of every week. A subcommand's
+script is only loaded when that subcommand is run, and the scripts only import
+boto3 once they actually make a client, so `--help` never pays for it.
+
+Example:
+
+python3 cli.py sg-report -s default
+python3 cli.py iam-roles --help
+python3 cli.py --stats --trace calls.json monitor-security
+python3 cli.py --cache --cache-ttl 600 sg-report
+'''
+
+import argparse
+import os
+import sys
+
+# Every subcommand, the script it runs, and a one line description of it.
+COMMANDS: dict[str, tuple[str, str]] = {
+    "audit" : (
+        "audit.py",
+        "Run every security check over one snapshot of the account",
+    ),
+    "sg-report" : (
+        "week 7 - Security Auditing/ec2-sg.py",
+        "Report security group rules that are open to the internet",
+    ),
+    "exposure-map" : (
+        "week 7 - Security Auditing/exposure_map.py",
+        "Map every public IP:port that is reachable from the internet",
+    ),
+    "iam-roles" : (
+        "week 7 - Security Auditing/iam-roles.py",
+        "Report IAM roles created in the last 90 days",
+    ),
+    "vpc-ha" : (
+        "week 7 - Security Auditing/student-choice.py",
+        "Report VPCs that lack High Availability",
+    ),
+    "s3-audit" : (
+        "week 7 - Security Auditing/s3_audit.py",
+        "Report how exposed every S3 bucket is",
+    ),
+    "monitor-security" : (
+        "Final/monitor-security/monitor_security.py",
+        "Remove port 22 access open to the internet from active instances",
+    ),
+    "health-probe" : (
+        "Final/health-probe/health_probe.py",
+        "Check that web servers and S3 websites are serving",
+    ),
+    "list-buckets" : (
+        "week 2 - S3/listbuckets.py",
+        "List the buckets and their objects, or total up an inventory",
+    ),
+    "s3-bulk" : (
+        "week 2 - S3/s3bulk.py",
+        "Delete, copy, tag or change the metadata of many S3 objects",
+    ),
+    "s3-website" : (
+        "week 6 - Error Handling/s3website.py",
+        "Deploy a static website to a new S3 bucket",
+    ),
+    "ec2-report" : (
+        "week 4 - Reporting/ec2_report.py",
+        "Write export.csv of all running EC2 instances",
+    ),
+    "alarms" : (
+        "week 5 - SNS/alarms.py",
+        "Sync the CPU alarms of a fleet of instances",
+    ),
+    "rightsizing" : (
+        "week 5 - SNS/metrics.py",
+        "Write rightsizing.csv of all running EC2 instances",
+    ),
+    "rules" : (
+        "week 5 - SNS/rules.py",
+        "Reboot busy and stop idle instances from local rules",
+    ),
+    "notify" : (
+        "week 5 - SNS/notify.py",
+        "Publish findings and firing alarms to a topic as digests",
+    ),
+    "launch" : (
+        "week 5 - SNS/launcher.py",
+        "Launch instances from the first instance types and zones with capacity",
+    ),
+    "teardown" : (
+        "week 5 - SNS/teardown.py",
+        "Terminate a fleet of instances in batches and wait for all of it",
+    ),
+    "subscribe" : (
+        "week 5 - SNS/sns.py",
+        "Subscribe emails to a topic, skipping existing ones",
+    ),
+}
+
+
+
+
+def main():
+
+    # Let's create a parser that only knows the names of the subcommands.
+    # Everything after the name is handed to the subcommand's own parser.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="Run any of the course scripts",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="commands:\n" + "\n".join(
+            f"  {command:<18}{description}"
+            for command, (_, description) in COMMANDS.items()
+        ),
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print a table of every API call the script made, at exit",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="Write every API call the script made to this JSON file",
+    )
+    parser.add_argument(
+        "--trace-format",
+        choices=["json", "spans"],
+        default="json",
+        help="Totals per operation (json), or a span per call (spans)",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Answer repeated read only API calls from a cache on disk",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        help="Seconds a cached answer stays fresh. Defaults to 300",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Drop everything cached before running",
+    )
+    parser.add_argument(
+        "command",
+        choices=list(COMMANDS),
+        metavar="command",
+        help="The script to run, see below",
+    )
+    parser.add_argument(
+        "args",
+        nargs=argparse.REMAINDER,
+        help="Arguments for the script. Use '<command> --help' to see them",
+    )
+    args = parser.parse_args()
+
+    # The instrumentation and the cache pick these up when the first client is made.
+    if args.stats:
+        os.environ["SCRIPTS_STATS"] = "1"
+    if args.trace:
+        os.environ["SCRIPTS_TRACE"] = args.trace
+        os.environ["SCRIPTS_TRACE_FORMAT"] = args.trace_format
+    if args.cache:
+        os.environ.setdefault("SCRIPTS_CACHE", "1")
+    if args.cache_ttl is not None:
+        os.environ["SCRIPTS_CACHE_TTL"] = str(args.cache_ttl)
+    if args.refresh:
+        os.environ["SCRIPTS_CACHE_REFRESH"] = "1"
+
+    # Only now do we pay for loading the script, and only the one we need.
+    from common import loader
+
+    path, _ = COMMANDS[args.command]
+    script = loader.load_script(path)
+
+    # The script parses sys.argv itself, so let's make it look like it was
+    # run on its own.
+    sys.argv = [f"cli.py {args.command}", *args.args]
+    script.main()
+
+
+
+
+if __name__ == "__main__":
+    main()
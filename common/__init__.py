@@ -0,0 +1,4 @@
+'''
+Author: Joseph Hopwood
+Description: Code shared by the scripts of every week.
+'''
@@ -0,0 +1,506 @@
+'''
+Author: Joseph Hopwood
+Description: Module containing a response cache for read only API calls. Runs
+of the same script minutes apart make the same `describe_*` and `list_*` calls
+over and over; with the cache on, a rerun answers them locally instead. It
+hooks into botocore's events like common/instrument.py does, so scripts don't
+have to change to use it.
+
+Only calls that read are cached: Describe*, List*, Get* and Head* operations
+that don't stream their output. Any other call is taken to be a write, and
+drops everything cached for that service, region and account (a revoke in EC2
+drops every cached EC2 answer), so a script never reads back stale state of
+its own making.
+
+The cache is off unless asked for, with environment variables (or the matching
+flags of cli.py):
+
+SCRIPTS_CACHE=1                 cache on disk, under ~/.cache/aws-scripts
+SCRIPTS_CACHE=/path/cache.db    cache on disk, in this SQLite file
+SCRIPTS_CACHE=memory            cache in memory, for this run only
+SCRIPTS_CACHE_TTL=300           seconds an answer stays fresh
+SCRIPTS_CACHE_REFRESH=1         drop everything cached before starting
+
+Answers are kept as JSON, never pickled, so that a cache file can't make us
+run anything. The file only ever gets read and written by its owner.
+'''
+
+import base64
+import collections
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# How long an answer stays fresh, in seconds, unless told otherwise.
+DEFAULT_TTL: float = 300.0
+
+# The most answers kept before the least recently used ones are dropped.
+DEFAULT_MAX_ENTRIES: int = 10000
+
+# Operations that start with one of these only read.
+READ_PREFIXES: tuple[str] = ("Describe", "List", "Get", "Head")
+
+# Services whose answers are secrets, or are never the same twice. These are
+# never cached, on disk or otherwise.
+NEVER_CACHE: frozenset[str] = frozenset({
+    "sts",
+    "kms",
+    "secretsmanager",
+    "ssm",
+    "sso",
+    "cognito-identity",
+})
+
+# Where in the request context a call keeps its cache key while in flight.
+_CONTEXT_KEY: str = "cache"
+
+# How the values JSON has no type for are tagged in a stored answer.
+_DATETIME_TAG: str = "__cache_datetime__"
+_BYTES_TAG: str = "__cache_bytes__"
+
+
+
+
+def default_path() -> str:
+    """_Where the cache is kept on disk, unless told otherwise._
+
+    Returns:
+        str: _Path of the SQLite file._
+    """
+    root: str = os.environ.get("XDG_CACHE_HOME") \
+        or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(root, "aws-scripts", "responses.db")
+
+
+
+
+def _encode(value):
+    """_Turn what JSON can't store (timestamps and blobs) into what it can._"""
+    if isinstance(value, datetime.datetime):
+        return {_DATETIME_TAG : value.isoformat()}
+    if isinstance(value, (bytes, bytearray)):
+        return {_BYTES_TAG : base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"Can't cache a {type(value).__name__}")
+
+
+
+
+def _decode(obj: dict):
+    """_Turn what `_encode()` made back into timestamps and blobs._"""
+    if len(obj) == 1:
+        if _DATETIME_TAG in obj:
+            return datetime.datetime.fromisoformat(obj[_DATETIME_TAG])
+        if _BYTES_TAG in obj:
+            return base64.b64decode(obj[_BYTES_TAG])
+    return obj
+
+
+
+
+def _dumps(parsed: dict) -> bytes:
+    """_An answer, as botocore parsed it, as JSON._"""
+    return json.dumps(parsed, default=_encode, separators=(",", ":")).encode()
+
+
+
+
+def _loads(value: bytes) -> dict:
+    """_An answer back from JSON. Raises ValueError if it isn't, like the
+    pickles older versions kept._"""
+    return json.loads(value, object_hook=_decode)
+
+
+
+
+class MemoryBackend:
+    """
+    Keeps answers in memory, for as long as the script runs.
+    """
+
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """Initialize an empty backend.
+
+        Args:
+            max_entries (int, optional): The most answers kept. Defaults to
+                DEFAULT_MAX_ENTRIES.
+        """
+        self.max_entries: int = max_entries
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+
+    def get(self, key: str) -> bytes:
+        """The answer stored under a key, or None if there is no fresh one."""
+        with self._lock:
+            entry: tuple = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return entry[2]
+
+
+    def set(self, key: str, scope: str, value: bytes, ttl: float):
+        """Store an answer, dropping the least recently used if full."""
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, scope, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+    def invalidate(self, scope: str = None):
+        """Drop every answer of a scope, or every answer there is."""
+        with self._lock:
+            if scope is None:
+                self._entries.clear()
+                return
+            for key in [key for key, entry in self._entries.items()
+                    if entry[1] == scope]:
+                del self._entries[key]
+
+
+    def close(self):
+        pass
+
+
+
+
+class SqliteBackend:
+    """
+    Keeps answers in a SQLite file, so that they outlive the script.
+    """
+
+    # Eviction costs a query, so it only runs once every this many writes.
+    PRUNE_EVERY: int = 64
+
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """Open, or create, the cache file.
+
+        Args:
+            path (str): Path of the SQLite file.
+            max_entries (int, optional): The most answers kept. Defaults to
+                DEFAULT_MAX_ENTRIES.
+        """
+        self.path: str = path
+        self.max_entries: int = max_entries
+        self._writes: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+        # The cache holds what the account looks like, IAM included, so only
+        # its owner gets to read it. SQLite gives its -wal and -shm files the
+        # same mode as the database.
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700,
+            exist_ok=True)
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        os.chmod(path, 0o600)
+
+        # Threads share the one connection, one at a time, behind the lock.
+        self._db: sqlite3.Connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, scope TEXT, expires REAL, used REAL, "
+            "value BLOB)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_used ON responses (used)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_scope ON responses (scope)"
+        )
+        self._prune()
+
+
+    def get(self, key: str) -> bytes:
+        """The answer stored under a key, or None if there is no fresh one."""
+        now: float = time.time()
+        with self._lock:
+            row: tuple = self._db.execute(
+                "SELECT value FROM responses WHERE key = ? AND expires > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+
+            self._db.execute(
+                "UPDATE responses SET used = ? WHERE key = ?", (now, key)
+            )
+            return row[0]
+
+
+    def set(self, key: str, scope: str, value: bytes, ttl: float):
+        """Store an answer, dropping the least recently used if full."""
+        now: float = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, scope, now + ttl, now, value),
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune()
+
+
+    def invalidate(self, scope: str = None):
+        """Drop every answer of a scope, or every answer there is."""
+        with self._lock:
+            if scope is None:
+                self._db.execute("DELETE FROM responses")
+            else:
+                self._db.execute(
+                    "DELETE FROM responses WHERE scope = ?", (scope,)
+                )
+
+
+    def close(self):
+        with self._lock:
+            self._prune()
+            self._db.close()
+
+
+    def _prune(self):
+        """Drop stale answers, and the least recently used past the limit."""
+        self._db.execute(
+            "DELETE FROM responses WHERE expires <= ?", (time.time(),)
+        )
+        self._db.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+            "ORDER BY used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+
+
+
+class ResponseCache:
+    """
+    Answers read only calls from a backend, and stores what AWS answers.
+    """
+
+
+    def __init__(self, backend, ttl: float = DEFAULT_TTL):
+        """Initialize the cache.
+
+        Args:
+            backend: Where answers are kept, a MemoryBackend or SqliteBackend.
+            ttl (float, optional): Seconds an answer stays fresh. Defaults to
+                DEFAULT_TTL.
+        """
+        self.backend = backend
+        self.ttl: float = ttl
+        self.hits: int = 0
+        self.misses: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+
+    def register(self, events):
+        """Hook the cache into an event emitter. Clients made from a session
+        afterwards use the cache too.
+
+        Args:
+            events: The event emitter of a botocore session or client.
+        """
+        events.register("before-parameter-build", self._before_parameter_build)
+        events.register("before-call", self._before_call)
+        events.register("after-call", self._after_call)
+        events.register("after-call-error", self._after_call_error)
+
+
+    def invalidate(self, service: str = None, region: str = None,
+            account: str = None):
+        """Drop cached answers. With no arguments, drop every one of them.
+
+        Args:
+            service (str, optional): Only answers of this service, e.g. "ec2".
+                Needs `region` and `account` too.
+            region (str, optional): Only answers from this region.
+            account (str, optional): Only answers for this account, as the
+                hash `_account()` makes of its access key.
+        """
+        if service is None:
+            self.backend.invalidate()
+        else:
+            self.backend.invalidate(f"{service}/{region}/{account}")
+
+
+    def _before_parameter_build(self, params: dict, model, context: dict,
+            **kwargs):
+        # The parameters are only in their plain form here; by before-call
+        # they've been turned into a request. Let's remember them for later.
+        if not _is_read(model):
+            context[_CONTEXT_KEY] = {"read" : False}
+            return
+
+        context[_CONTEXT_KEY] = {
+            "read" : True,
+            "params" : json.dumps(params, sort_keys=True, default=str),
+        }
+
+
+    def _before_call(self, model, params: dict, request_signer, context: dict,
+            **kwargs):
+        call: dict = context.get(_CONTEXT_KEY)
+        if call is None:
+            return None
+
+        service: str = model.service_model.service_name
+        call["scope"] = (
+            f"{service}/{context.get('client_region')}/{_account(request_signer)}"
+        )
+        if not call["read"]:
+            return None
+
+        call["key"] = hashlib.sha256(
+            f"{call['scope']}/{model.name}/{call['params']}".encode()
+        ).hexdigest()
+
+        value: bytes = self.backend.get(call["key"])
+        parsed: dict = None
+        if value is not None:
+            try:
+                parsed = _loads(value)
+            except ValueError:
+                # Not ours to read, so it's as good as not there. The answer
+                # from AWS will take its place.
+                pass
+
+        if parsed is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+
+        # Let's let everything after this (the instrumentation, for one) know
+        # this answer never went over the wire.
+        call["hit"] = True
+        context["cached"] = True
+
+        import botocore.awsrequest
+        return (
+            botocore.awsrequest.AWSResponse(params.get("url"), 200, {}, None),
+            parsed,
+        )
+
+
+    def _after_call(self, http_response, parsed: dict, context: dict,
+            **kwargs):
+        call: dict = context.pop(_CONTEXT_KEY, None)
+        if call is None or call.get("hit"):
+            return
+
+        if not call["read"]:
+            self.backend.invalidate(call["scope"])
+            return
+
+        # Errors are never cached, the next run should try again.
+        if http_response.status_code >= 300 or "Error" in parsed:
+            return
+
+        # Serialized, so that a caller changing its answer never changes ours.
+        try:
+            value: bytes = _dumps(parsed)
+        except (TypeError, ValueError):
+            return
+        self.backend.set(call["key"], call["scope"], value, self.ttl)
+
+
+    def _after_call_error(self, context: dict, **kwargs):
+        # A write that failed on the way may still have gone through.
+        call: dict = context.pop(_CONTEXT_KEY, None)
+        if call is not None and not call["read"] and "scope" in call:
+            self.backend.invalidate(call["scope"])
+
+
+
+
+def _is_read(model) -> bool:
+    """_Whether an operation only reads, and its answer can be cached._"""
+    return (
+        model.name.startswith(READ_PREFIXES)
+        and not model.has_streaming_output
+        and model.service_model.service_name not in NEVER_CACHE
+    )
+
+
+
+
+def _account(request_signer) -> str:
+    """_Tell accounts apart without an API call. An access key only ever
+    belongs to one account, so a hash of it stands in for the account._"""
+    credentials = getattr(request_signer, "_credentials", None)
+    if credentials is None:
+        return "anonymous"
+
+    access_key: str = credentials.get_frozen_credentials().access_key
+    return hashlib.sha256(access_key.encode()).hexdigest()[:16]
+
+
+
+
+# The cache every client made through common/clients.py uses, if it is on.
+cache: ResponseCache = None
+_installed: bool = False
+_install_lock: threading.Lock = threading.Lock()
+
+
+
+
+def install(session=None) -> ResponseCache:
+    """_Turn the cache on for a boto3 session, once, if the environment asks
+    for it (see the description at the top)._
+
+    Args:
+        session (optional): _The boto3 session. Defaults to boto3's default
+            session._
+
+    Returns:
+        ResponseCache: _The shared cache, or None if it is off._
+    """
+    global cache, _installed
+
+    with _install_lock:
+        if _installed:
+            return cache
+        _installed = True
+
+        setting: str = os.environ.get("SCRIPTS_CACHE")
+        if not setting:
+            return None
+
+        if setting == "memory":
+            backend = MemoryBackend()
+        elif setting == "1":
+            backend = SqliteBackend(default_path())
+        else:
+            backend = SqliteBackend(setting)
+
+        new_cache: ResponseCache = ResponseCache(
+            backend, float(os.environ.get("SCRIPTS_CACHE_TTL", DEFAULT_TTL))
+        )
+        if os.environ.get("SCRIPTS_CACHE_REFRESH"):
+            new_cache.invalidate()
+
+        import boto3
+        if session is None:
+            if boto3.DEFAULT_SESSION is None:
+                boto3.setup_default_session()
+            session = boto3.DEFAULT_SESSION
+        new_cache.register(session.events)
+
+        cache = new_cache
+        return cache
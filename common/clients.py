@@ -0,0 +1,67 @@
+'''
+Author: Joseph Hopwood
+Description: Module containing the shared boto3 client factory. boto3 and
+botocore take a few hundred milliseconds to import, so they are only imported
+the first time a client is actually asked for, not when a script is loaded.
+That keeps `--help` and anything else that never talks to AWS fast.
+'''
+
+import threading
+
+# How many times a call is tried before giving up, when AWS throttles us.
+MAX_ATTEMPTS: int = 10
+
+# Clients are safe to share between threads, but creating them is not, so they
+# are created one at a time.
+_lock: threading.Lock = threading.Lock()
+
+
+
+
+def client(service_name: str, max_pool_connections: int = 10, **kwargs):
+    """_Create a low level boto3 client that backs off adaptively when AWS
+    throttles it._
+
+    Args:
+        service_name (str): _Name of the service, e.g. "ec2"._
+        max_pool_connections (int, optional): _How many connections the client
+            keeps open. Should be at least the number of threads sharing it.
+            Defaults to 10._
+        **kwargs: _Passed on to `boto3.client()`._
+
+    Returns:
+        _A low level boto3 client._
+    """
+    # Deferred on purpose, see the description at the top.
+    import boto3
+    import botocore.config
+
+    from common import cache, instrument
+
+    # Every client is instrumented, and uses the response cache if it is on.
+    # Both only hook in the first time.
+    instrument.install()
+    cache.install()
+
+    config = botocore.config.Config(
+        retries={'mode': 'adaptive', 'max_attempts': MAX_ATTEMPTS},
+        max_pool_connections=max_pool_connections,
+    )
+    if "config" in kwargs:
+        config = config.merge(kwargs.pop("config"))
+
+    with _lock:
+        return boto3.client(service_name, config=config, **kwargs)
+
+
+
+
+def client_error():
+    """_Get botocore's `ClientError`, for `except` clauses in code that doesn't
+    want to import botocore up front._
+
+    Returns:
+        type: _`botocore.exceptions.ClientError`._
+    """
+    import botocore.exceptions
+    return botocore.exceptions.ClientError
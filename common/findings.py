@@ -0,0 +1,29 @@
+'''
+Author: Joseph Hopwood
+Description: Module containing the shape of a finding. The audit scripts make
+them, and the digest notifier (see notify.py) publishes them, so they all
+share this one definition. It imports nothing, so a report never has to pay
+for boto3 to make one.
+'''
+
+
+
+
+def finding(check: str, resource: str, message: str, severity: str = "WARNING") -> dict:
+    """_Make a finding._
+
+    Args:
+        check (str): _Name of the check that found it._
+        resource (str): _ID or name of the resource it is about._
+        message (str): _What is wrong._
+        severity (str, optional): _How bad it is. Defaults to "WARNING"._
+
+    Returns:
+        dict: _The finding._
+    """
+    return {
+        "check" : check,
+        "resource" : resource,
+        "severity" : severity,
+        "message" : message,
+    }
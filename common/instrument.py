@@ -0,0 +1,394 @@
+'''
+Author: Joseph Hopwood
+Description: Module containing per API call instrumentation for every boto3
+client. A handful of botocore event hooks record how long each operation
+takes, how often it was retried or throttled, and how many bytes went over the
+wire. The hooks only do a few dictionary updates per call, so they can be left
+on all the time.
+
+What happens at exit is controlled with environment variables (or the matching
+flags of cli.py):
+
+SCRIPTS_STATS=1              print a summary table of every operation
+SCRIPTS_TRACE=trace.json     write the recorded calls out to a file...
+SCRIPTS_TRACE_FORMAT=spans   ...as OpenTelemetry style spans instead of stats
+'''
+
+import atexit
+import json
+import os
+import random
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in milliseconds.
+LATENCY_BUCKETS_MS: tuple[float] = (
+    1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf")
+)
+
+# Error codes AWS uses to tell us to slow down.
+THROTTLE_CODES: frozenset[str] = frozenset({
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+    "SlowDown",
+    "PriorRequestNotComplete",
+})
+
+# Where in the request context a call keeps its measurements while in flight.
+_CONTEXT_KEY: str = "instrument"
+
+
+
+
+class OperationStats:
+    """
+    Everything recorded about one operation of one service.
+    """
+
+
+    def __init__(self):
+        self.calls: int = 0
+        self.errors: int = 0
+        self.cached: int = 0
+        self.retries: int = 0
+        self.throttles: int = 0
+        self.bytes_sent: int = 0
+        self.bytes_received: int = 0
+        self.total_ms: float = 0.0
+        self.max_ms: float = 0.0
+        self.histogram: list[int] = [0] * len(LATENCY_BUCKETS_MS)
+
+
+    def add(self, duration_ms: float, call: dict, error: bool, cached: bool):
+        """Record one finished call."""
+        self.calls += 1
+        self.errors += error
+        self.cached += cached
+        self.retries += max(call["attempts"] - 1, 0)
+        self.throttles += call["throttles"]
+        self.bytes_sent += call["bytes_sent"]
+        self.bytes_received += call["bytes_received"]
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+
+        for bucket, bound in enumerate(LATENCY_BUCKETS_MS):
+            if duration_ms <= bound:
+                self.histogram[bucket] += 1
+                break
+
+
+    def percentile(self, percentile: float) -> float:
+        """Estimate a latency percentile from the histogram, in milliseconds.
+        The answer is the upper bound of the bucket it falls in."""
+        target: float = self.calls * percentile / 100
+        seen: int = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.histogram):
+            seen += count
+            if count and seen >= target:
+                return round(min(bound, self.max_ms), 3)
+        return round(self.max_ms, 3)
+
+
+    def to_dict(self) -> dict:
+        return {
+            "calls" : self.calls,
+            "errors" : self.errors,
+            "cached" : self.cached,
+            "retries" : self.retries,
+            "throttles" : self.throttles,
+            "bytes_sent" : self.bytes_sent,
+            "bytes_received" : self.bytes_received,
+            "total_ms" : round(self.total_ms, 3),
+            "mean_ms" : round(self.total_ms / self.calls, 3) if self.calls else 0,
+            "p50_ms" : self.percentile(50),
+            "p95_ms" : self.percentile(95),
+            "p99_ms" : self.percentile(99),
+            "max_ms" : round(self.max_ms, 3),
+            "histogram" : {
+                f"le_{bound:g}" : count
+                for bound, count in zip(LATENCY_BUCKETS_MS, self.histogram)
+            },
+        }
+
+
+
+
+class Recorder:
+    """
+    Collects the measurements of every instrumented client.
+    """
+
+
+    def __init__(self, keep_spans: bool = False):
+        """Initialize an empty recorder.
+
+        Args:
+            keep_spans (bool, optional): Also keep a span per call, not only the
+                totals per operation. Defaults to False.
+        """
+        self.keep_spans: bool = keep_spans
+        self.stats: dict[str, OperationStats] = {}
+        self.spans: list[dict] = []
+        self.trace_id: str = f"{random.getrandbits(128):032x}"
+        self._lock: threading.Lock = threading.Lock()
+
+
+    def register(self, events):
+        """Hook the recorder into an event emitter. Clients made from a
+        session afterwards are instrumented too.
+
+        Args:
+            events: The event emitter of a botocore session or client.
+        """
+        events.register("before-call", self._before_call)
+        events.register("request-created", self._request_created)
+        events.register("response-received", self._response_received)
+        events.register("after-call", self._after_call)
+        events.register("after-call-error", self._after_call_error)
+
+
+    def _before_call(self, context: dict, **kwargs):
+        context[_CONTEXT_KEY] = {
+            "start" : time.perf_counter(),
+            "start_ns" : time.time_ns(),
+            "attempts" : 0,
+            "throttles" : 0,
+            "bytes_sent" : 0,
+            "bytes_received" : 0,
+        }
+
+
+    def _request_created(self, request, **kwargs):
+        call: dict = getattr(request, "context", {}).get(_CONTEXT_KEY)
+        if call is None:
+            return
+
+        # `request.body` would serialize the whole request again, so let's
+        # size up the raw data instead. Query APIs (EC2, IAM) keep it as a
+        # dict until it is sent, which we count as "key=value&".
+        data = request.data
+        if isinstance(data, (bytes, str)):
+            call["bytes_sent"] += len(data)
+        elif isinstance(data, dict):
+            call["bytes_sent"] += sum(
+                len(key) + len(str(value)) + 2 for key, value in data.items()
+            )
+
+
+    def _response_received(
+            self,
+            context: dict,
+            response_dict: dict,
+            parsed_response: dict,
+            **kwargs
+    ):
+        # Once per attempt, so this is where retries and throttles show up.
+        call: dict = context.get(_CONTEXT_KEY)
+        if call is None:
+            return
+
+        call["attempts"] += 1
+
+        if parsed_response and parsed_response.get("Error", {}).get("Code") \
+                in THROTTLE_CODES:
+            call["throttles"] += 1
+
+        if response_dict:
+            body = response_dict.get("body")
+            if isinstance(body, bytes):
+                call["bytes_received"] += len(body)
+            else:
+                # Streamed bodies (S3 downloads) haven't been read yet.
+                call["bytes_received"] += int(
+                    response_dict.get("headers", {}).get("content-length", 0)
+                )
+
+
+    def _after_call(self, event_name: str, context: dict, http_response,
+            parsed: dict, **kwargs):
+        self._finish(
+            event_name,
+            context,
+            http_response.status_code,
+            parsed.get("Error", {}).get("Code"),
+            parsed.get("ResponseMetadata", {}).get("RequestId"),
+        )
+
+
+    def _after_call_error(self, event_name: str, context: dict, exception,
+            **kwargs):
+        self._finish(event_name, context, None, type(exception).__name__, None)
+
+
+    def _finish(
+            self,
+            event_name: str,
+            context: dict,
+            status_code: int,
+            error_code: str,
+            request_id: str
+    ):
+        """Record a call that is done, one way or the other."""
+        call: dict = context.pop(_CONTEXT_KEY, None)
+        if call is None:
+            return
+
+        duration_ms: float = (time.perf_counter() - call["start"]) * 1000
+        error: bool = error_code is not None or (status_code or 0) >= 300
+
+        # Answered by common/cache.py, without going over the wire.
+        cached: bool = context.get("cached", False)
+
+        # "after-call.ec2.DescribeInstances" -> "ec2.DescribeInstances"
+        operation: str = event_name.split(".", 1)[1]
+
+        with self._lock:
+            if operation not in self.stats:
+                self.stats[operation] = OperationStats()
+            self.stats[operation].add(duration_ms, call, error, cached)
+
+            if self.keep_spans:
+                service, method = operation.split(".", 1)
+                self.spans.append({
+                    "trace_id" : self.trace_id,
+                    "span_id" : f"{random.getrandbits(64):016x}",
+                    "name" : operation,
+                    "kind" : "CLIENT",
+                    "start_time_unix_nano" : call["start_ns"],
+                    "end_time_unix_nano" : call["start_ns"]
+                        + int(duration_ms * 1_000_000),
+                    "attributes" : {
+                        "rpc.system" : "aws-api",
+                        "rpc.service" : service,
+                        "rpc.method" : method,
+                        "aws.request_id" : request_id,
+                        "http.status_code" : status_code,
+                        "aws.cached" : cached,
+                        "aws.retries" : max(call["attempts"] - 1, 0),
+                        "aws.throttles" : call["throttles"],
+                        "aws.bytes_sent" : call["bytes_sent"],
+                        "aws.bytes_received" : call["bytes_received"],
+                    },
+                    "status" : {
+                        "code" : "ERROR" if error else "OK",
+                        "message" : error_code or "",
+                    },
+                })
+
+
+    def to_dict(self) -> dict:
+        """The totals of every operation, keyed by "service.Operation"."""
+        with self._lock:
+            return {
+                operation: stats.to_dict()
+                for operation, stats in sorted(self.stats.items())
+            }
+
+
+    def export(self, path: str, format: str = "json"):
+        """Write the recorded calls out to a file.
+
+        Args:
+            path (str): Path of the file. It is overwritten.
+            format (str, optional): "json" for the totals per operation, or
+                "spans" for a span per call. Defaults to "json".
+        """
+        with open(path, "w") as file:
+            if format == "spans":
+                with self._lock:
+                    json.dump({"spans" : self.spans}, file, indent=2)
+            else:
+                json.dump(self.to_dict(), file, indent=2)
+
+
+    def summary(self) -> str:
+        """A table of the totals of every operation, slowest first."""
+        rows: list[tuple[str, dict]] = sorted(
+            self.to_dict().items(), key=lambda row: -row[1]["total_ms"]
+        )
+
+        lines: list[str] = [
+            f"{'operation':<44}{'calls':>7}{'errors':>7}{'cached':>7}"
+            f"{'retries':>8}{'throttled':>10}{'mean ms':>9}{'p95 ms':>9}{'max ms':>9}"
+            f"{'sent KiB':>10}{'recv KiB':>10}{'total s':>9}"
+        ]
+        for operation, stats in rows:
+            lines.append(
+                f"{operation:<44}{stats['calls']:>7}{stats['errors']:>7}"
+                f"{stats['cached']:>7}"
+                f"{stats['retries']:>8}{stats['throttles']:>10}"
+                f"{stats['mean_ms']:>9.1f}{stats['p95_ms']:>9.1f}"
+                f"{stats['max_ms']:>9.1f}{stats['bytes_sent'] / 1024:>10.1f}"
+                f"{stats['bytes_received'] / 1024:>10.1f}"
+                f"{stats['total_ms'] / 1000:>9.2f}"
+            )
+
+        return "\n".join(lines)
+
+
+
+
+# The recorder every client made through common/clients.py reports to.
+recorder: Recorder = None
+_install_lock: threading.Lock = threading.Lock()
+
+
+
+
+def install(session=None) -> Recorder:
+    """_Instrument a boto3 session, once. Every client made from it afterwards
+    reports to the shared recorder._
+
+    Args:
+        session (optional): _The boto3 session. Defaults to boto3's default
+            session._
+
+    Returns:
+        Recorder: _The shared recorder._
+    """
+    global recorder
+
+    with _install_lock:
+        if recorder is not None:
+            return recorder
+
+        import boto3
+        if session is None:
+            if boto3.DEFAULT_SESSION is None:
+                boto3.setup_default_session()
+            session = boto3.DEFAULT_SESSION
+
+        stats: bool = bool(os.environ.get("SCRIPTS_STATS"))
+        trace_path: str = os.environ.get("SCRIPTS_TRACE")
+        trace_format: str = os.environ.get("SCRIPTS_TRACE_FORMAT", "json")
+
+        new_recorder: Recorder = Recorder(
+            keep_spans=bool(trace_path) and trace_format == "spans"
+        )
+        new_recorder.register(session.events)
+
+        if stats or trace_path:
+            atexit.register(_report, new_recorder, stats, trace_path, trace_format)
+
+        recorder = new_recorder
+        return recorder
+
+
+
+
+def _report(
+        exit_recorder: Recorder,
+        stats: bool,
+        trace_path: str,
+        trace_format: str
+):
+    """_Print and write out what was recorded, at exit._"""
+    if trace_path:
+        exit_recorder.export(trace_path, trace_format)
+    if stats and exit_recorder.stats:
+        print("\n" + exit_recorder.summary())
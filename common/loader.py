@@ -0,0 +1,58 @@
+'''
+Author: Joseph Hopwood
+Description: Module for loading the scripts of the other weeks as modules. The
+folders have spaces in their names and some scripts have dashes in theirs, so a
+plain `import` can't reach them.
+'''
+
+import importlib.util
+import os
+import sys
+import threading
+
+# The root of the repository, which every script path is relative to.
+ROOT: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Scripts we have already loaded, by their full path. A few weeks have scripts
+# with the same name (ec2.py), so the module name alone isn't enough.
+_loaded: dict = {}
+
+# Checks run in threads and can load scripts at the same time. A script can
+# also load another script while it is being loaded, hence the re-entrant lock.
+_lock: threading.RLock = threading.RLock()
+
+
+
+
+def load_script(path: str):
+    """_Load a script as a module, once. Its folder is put on the path first,
+    so that the script can import its neighbours like it does when it is run
+    on its own._
+
+    Args:
+        path (str): _Path of the script, relative to the root of the
+            repository. E.g. "week 7 - Security Auditing/ec2-sg.py"._
+
+    Returns:
+        module: _The loaded script. Its `main()` is not run._
+    """
+    full_path: str = os.path.join(ROOT, path)
+    folder: str = os.path.dirname(full_path)
+
+    # Dashes and spaces aren't allowed in module names, so let's swap them out.
+    name: str = os.path.splitext(os.path.basename(full_path))[0]
+    name = name.replace("-", "_").replace(" ", "_")
+
+    with _lock:
+        if full_path in _loaded:
+            return _loaded[full_path]
+
+        if folder not in sys.path:
+            sys.path.insert(0, folder)
+
+        spec = importlib.util.spec_from_file_location(name, full_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _loaded[full_path] = module
+
+    return module
@@ -0,0 +1,172 @@
+'''
+Author: Joseph Hopwood
+Description: Module containing the shared paginator. While the caller works
+through one page, a background thread is already fetching the next, so on a
+long listing the wait for the network hides behind the work done on each page.
+Results that fit on one page never start a thread.
+'''
+
+import queue
+import threading
+
+# How many pages are fetched ahead of the caller, unless told otherwise.
+DEFAULT_PREFETCH: int = 2
+
+# Keys AWS uses to say that there are more pages to come, across services.
+MORE_PAGES_KEYS: tuple[str] = (
+    "NextToken",
+    "Marker",
+    "NextMarker",
+    "NextContinuationToken",
+    "IsTruncated",
+)
+
+# Marks the end of the pages in the queue.
+_END: object = object()
+
+
+
+
+class _Failure:
+    """
+    Carries an exception from the prefetching thread back to the caller.
+    """
+
+
+    def __init__(self, error: BaseException):
+        self.error: BaseException = error
+
+
+
+
+def pages(
+        client,
+        operation: str,
+        prefetch: int = DEFAULT_PREFETCH,
+        page_size: int = None,
+        **kwargs
+):
+    """_Go through every page of a call, fetching ahead in the background._
+
+    Args:
+        client: _A low level boto3 client._
+        operation (str): _Name of the call, e.g. "describe_instances"._
+        prefetch (int, optional): _How many pages may be fetched ahead of the
+            caller. 0 fetches every page only when it is asked for. Defaults
+            to DEFAULT_PREFETCH._
+        page_size (int, optional): _How many results to ask for per page, for
+            calls that take one. Defaults to what AWS picks._
+        **kwargs: _Passed on to the call._
+
+    Yields:
+        dict: _Every page, in order._
+    """
+    if page_size:
+        kwargs["PaginationConfig"] = {
+            **kwargs.get("PaginationConfig", {}),
+            "PageSize" : page_size,
+        }
+
+    page_iterator = iter(client.get_paginator(operation).paginate(**kwargs))
+
+    # The first page we wait for no matter what. If it's the only one, a
+    # thread would only cost us.
+    first: dict = next(page_iterator, _END)
+    if first is _END:
+        return
+    if prefetch < 1 or not _has_more(first):
+        yield first
+        yield from page_iterator
+        return
+
+    fetched: queue.Queue = queue.Queue(maxsize=prefetch)
+    stop: threading.Event = threading.Event()
+    threading.Thread(
+        target=_prefetch,
+        args=(page_iterator, fetched, stop),
+        name=f"prefetch-{operation}",
+        daemon=True,
+    ).start()
+
+    try:
+        yield first
+        while True:
+            page = fetched.get()
+            if page is _END:
+                return
+            if isinstance(page, _Failure):
+                raise page.error
+            yield page
+
+    # The caller may stop early, let's not keep fetching for nobody.
+    finally:
+        stop.set()
+
+
+
+
+def items(
+        client,
+        operation: str,
+        result_key: str,
+        prefetch: int = DEFAULT_PREFETCH,
+        page_size: int = None,
+        **kwargs
+):
+    """_Go through every result of a call, across its pages, fetching ahead in
+    the background (see `pages()`)._
+
+    Args:
+        client: _A low level boto3 client._
+        operation (str): _Name of the call, e.g. "describe_instances"._
+        result_key (str): _The key its results come back under, e.g.
+            "Reservations"._
+        prefetch (int, optional): _How many pages may be fetched ahead.
+            Defaults to DEFAULT_PREFETCH._
+        page_size (int, optional): _How many results to ask for per page.
+            Defaults to what AWS picks._
+        **kwargs: _Passed on to the call._
+
+    Yields:
+        Every result, in order.
+    """
+    for page in pages(client, operation, prefetch, page_size, **kwargs):
+        yield from page.get(result_key, [])
+
+
+
+
+def _has_more(page: dict) -> bool:
+    """_Whether a page says there are more to come._"""
+    return any(page.get(key) for key in MORE_PAGES_KEYS)
+
+
+
+
+def _prefetch(page_iterator, fetched: queue.Queue, stop: threading.Event):
+    """_Fetch pages into a queue until there are none left, or the caller stops
+    asking. Runs in its own thread._"""
+    try:
+        for page in page_iterator:
+            if not _put(fetched, page, stop):
+                return
+    except Exception as error:
+        _put(fetched, _Failure(error), stop)
+        return
+
+    _put(fetched, _END, stop)
+
+
+
+
+def _put(fetched: queue.Queue, item, stop: threading.Event) -> bool:
+    """_Put an item in the queue once there is room. Gives up, and returns
+    False, if the caller stops asking in the meantime._"""
+    while not stop.is_set():
+        try:
+            fetched.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+
+    return False
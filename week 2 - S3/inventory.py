@@ -0,0 +1,329 @@
+'''
+Author: Joseph Hopwood
+Description: Module for reading S3 Inventory reports instead of listing
+buckets. Listing a bucket with hundreds of millions of objects takes hundreds
+of thousands of calls; its daily inventory is a handful of files. Every data
+file of a report is streamed through its own process, and only the totals of
+each file come back, so memory stays flat no matter how many objects there
+are.
+
+A report can be read from S3 ("s3://bucket/path/manifest.json") or from a local
+copy of it. Locally, the data files are looked up under the folders above the
+manifest, so a copy made with `aws s3 sync` of the destination bucket works as
+is. CSV reports only need the standard library. ORC and Parquet reports need
+pyarrow.
+'''
+
+import csv
+import io
+import json
+import os
+import urllib.parse
+
+from common import clients
+
+import storage_stats
+
+# How many rows of an ORC or Parquet file are read at a time.
+BATCH_ROWS: int = 65536
+
+# The columns we read, as they're called in a CSV schema, and as they're
+# called in ORC and Parquet files.
+COLUMNS: dict[str, str] = {
+    "Bucket" : "bucket",
+    "Key" : "key",
+    "Size" : "size",
+    "LastModifiedDate" : "last_modified_date",
+    "StorageClass" : "storage_class",
+    "IsLatest" : "is_latest",
+    "IsDeleteMarker" : "is_delete_marker",
+}
+
+# Every process keeps its own S3 client, made the first time it needs one.
+_s3_client = None
+
+
+
+
+def load_manifest(location: str) -> dict:
+    """_Read the manifest of an inventory report._
+
+    Args:
+        location (str): _Path of a local manifest.json, or its S3 URL._
+
+    Returns:
+        dict: _The manifest, with a "location" added so the data files can be
+            found from it._
+    """
+    if location.startswith("s3://"):
+        bucket, key = _split_url(location)
+        body: bytes = _client().get_object(Bucket=bucket, Key=key)["Body"].read()
+        manifest: dict = json.loads(body)
+    else:
+        with open(location, "r") as file:
+            manifest = json.load(file)
+
+    manifest["location"] = location
+    return manifest
+
+
+
+
+def read_objects(manifest: dict, data_file: dict):
+    """_Stream the objects out of one data file of a report. Old versions and
+    delete markers are skipped, so the objects match what a live listing
+    would show._
+
+    Args:
+        manifest (dict): _See `load_manifest()`._
+        data_file (dict): _One entry of `manifest["files"]`._
+
+    Yields:
+        dict: _Object metadata, in the same shape as `response["Contents"]` of
+            a `S3.client.list_objects_v2()` call, plus its "Bucket".
+            "LastModified" is left as the inventory has it._
+    """
+    file_format: str = manifest["fileFormat"].upper()
+
+    with _open_data_file(manifest, data_file["key"]) as file:
+        if file_format == "CSV":
+            yield from _read_csv(file, manifest["fileSchema"])
+        elif file_format in ("ORC", "PARQUET"):
+            yield from _read_columnar(file, file_format)
+        else:
+            raise ValueError(f"Unknown inventory format {file_format}")
+
+
+
+
+def ingest(
+        location: str,
+        make_stats=storage_stats.StorageStats,
+        processes: int = None
+) -> dict:
+    """_Total up every object of an inventory report, one process per data
+    file at a time._
+
+    Args:
+        location (str): _Path of a local manifest.json, or its S3 URL._
+        make_stats (optional): _Makes an empty set of totals. It is handed to
+            other processes, so it has to be picklable, like a class or a
+            `functools.partial` of one. Defaults to `StorageStats`._
+        processes (int, optional): _How many processes to use. Defaults to
+            one per CPU._
+
+    Returns:
+        dict: _The manifest (see `load_manifest()`) under "manifest", and
+            the merged totals of every source bucket under "buckets"._
+    """
+    # Imported here, so that --help never pays for it.
+    import multiprocessing
+
+    manifest: dict = load_manifest(location)
+    jobs: list[tuple] = [
+        (manifest, data_file, make_stats) for data_file in manifest["files"]
+    ]
+
+    totals: dict = {}
+
+    # A report with one file isn't worth starting processes for.
+    if len(jobs) == 1 or processes == 1:
+        _merge_all(totals, map(_ingest_file, jobs))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            _merge_all(totals, pool.imap_unordered(_ingest_file, jobs))
+
+    return {"manifest" : manifest, "buckets" : totals}
+
+
+
+
+def _ingest_file(job: tuple) -> dict:
+    """_Total up one data file. Runs in a worker process._"""
+    manifest, data_file, make_stats = job
+
+    totals: dict = {}
+    for s3_object in read_objects(manifest, data_file):
+        bucket: str = s3_object["Bucket"]
+        if bucket not in totals:
+            totals[bucket] = make_stats()
+        totals[bucket].add(s3_object)
+
+    return totals
+
+
+
+
+def _merge_all(totals: dict, results):
+    """_Merge the totals of every data file into one set per bucket._"""
+    for file_totals in results:
+        for bucket, stats in file_totals.items():
+            if bucket in totals:
+                totals[bucket].merge(stats)
+            else:
+                totals[bucket] = stats
+
+
+
+
+def _read_csv(file, file_schema: str):
+    """_Stream objects out of a CSV data file. CSV inventories have no header,
+    the manifest says what the columns are, and keys are URL encoded._"""
+    schema: list[str] = [column.strip() for column in file_schema.split(",")]
+    index: dict[str, int] = {
+        column: schema.index(column) for column in COLUMNS if column in schema
+    }
+
+    bucket_at: int = index["Bucket"]
+    key_at: int = index["Key"]
+    size_at: int = index.get("Size")
+    modified_at: int = index.get("LastModifiedDate")
+    class_at: int = index.get("StorageClass")
+    latest_at: int = index.get("IsLatest")
+    marker_at: int = index.get("IsDeleteMarker")
+
+    unquote = urllib.parse.unquote_plus
+
+    for row in csv.reader(io.TextIOWrapper(file, encoding="utf-8", newline="")):
+        if latest_at is not None and row[latest_at] == "false":
+            continue
+        if marker_at is not None and row[marker_at] == "true":
+            continue
+
+        yield {
+            "Bucket" : row[bucket_at],
+            "Key" : unquote(row[key_at]),
+            "Size" : int(row[size_at] or 0) if size_at is not None else 0,
+            "LastModified" : row[modified_at] if modified_at is not None else None,
+            "StorageClass" : row[class_at] if class_at is not None else "STANDARD",
+        }
+
+
+
+
+def _read_columnar(file, file_format: str):
+    """_Stream objects out of an ORC or Parquet data file, a batch of rows at
+    a time._"""
+    try:
+        if file_format == "ORC":
+            import pyarrow.orc
+        else:
+            import pyarrow.parquet
+    except ImportError:
+        raise ImportError(
+            f"Reading {file_format} inventories needs pyarrow "
+            "(pip install pyarrow)"
+        ) from None
+
+    if file_format == "ORC":
+        orc_file = pyarrow.orc.ORCFile(file)
+        columns: list[str] = [
+            column for column in COLUMNS.values()
+            if column in orc_file.schema.names
+        ]
+        batches = (
+            orc_file.read_stripe(stripe, columns)
+            for stripe in range(orc_file.nstripes)
+        )
+    else:
+        parquet_file = pyarrow.parquet.ParquetFile(file)
+        columns = [
+            column for column in COLUMNS.values()
+            if column in parquet_file.schema_arrow.names
+        ]
+        batches = parquet_file.iter_batches(BATCH_ROWS, columns=columns)
+
+    for batch in batches:
+        data: dict[str, list] = batch.to_pydict()
+        rows: int = batch.num_rows
+        latest: list = data.get("is_latest", [True] * rows)
+        markers: list = data.get("is_delete_marker", [False] * rows)
+        sizes: list = data.get("size", [0] * rows)
+        modified: list = data.get("last_modified_date", [None] * rows)
+        classes: list = data.get("storage_class", ["STANDARD"] * rows)
+
+        for i in range(rows):
+            if latest[i] is False or markers[i]:
+                continue
+
+            yield {
+                "Bucket" : data["bucket"][i],
+                "Key" : data["key"][i],
+                "Size" : sizes[i] or 0,
+                "LastModified" : modified[i],
+                "StorageClass" : classes[i],
+            }
+
+
+
+
+def _open_data_file(manifest: dict, key: str):
+    """_Open a data file of a report for reading, wherever the report is.
+    Data files are always gzipped when they are CSV._"""
+    # Imported here, so that --help never pays for it.
+    import gzip
+
+    if manifest["location"].startswith("s3://"):
+        body = _client().get_object(
+            Bucket=manifest["destinationBucket"].split(":::")[-1],
+            Key=key,
+        )["Body"]
+
+        # ORC and Parquet readers need to jump around the file, so those are
+        # spooled to disk first. CSV can stream straight off the wire.
+        if manifest["fileFormat"].upper() != "CSV":
+            import tempfile
+            spool = tempfile.TemporaryFile()
+            for chunk in body.iter_chunks(1024 * 1024):
+                spool.write(chunk)
+            spool.seek(0)
+            return spool
+
+        return gzip.GzipFile(fileobj=body)
+
+    path: str = _local_path(manifest["location"], key)
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+
+
+def _local_path(manifest_path: str, key: str) -> str:
+    """_Find a data file of a local copy of a report. The key is relative to
+    the root of the destination bucket, which may be any of the folders above
+    the manifest._"""
+    folder: str = os.path.dirname(os.path.abspath(manifest_path))
+
+    while True:
+        candidate: str = os.path.join(folder, key)
+        if os.path.exists(candidate):
+            return candidate
+
+        parent: str = os.path.dirname(folder)
+        if parent == folder:
+            break
+        folder = parent
+
+    # Maybe the data files were just copied next to the manifest.
+    return os.path.join(
+        os.path.dirname(os.path.abspath(manifest_path)), os.path.basename(key)
+    )
+
+
+
+
+def _split_url(url: str) -> tuple[str, str]:
+    """_Split "s3://bucket/key" into its bucket and key._"""
+    bucket, _, key = url[len("s3://"):].partition("/")
+    return bucket, key
+
+
+
+
+def _client():
+    """_The S3 client of this process._"""
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = clients.client('s3')
+    return _s3_client
@@ -1,6 +1,6 @@
 '''
 Author: Joseph Hopwood
-Description: This is a script that will print out the first 100 buckets on 
+Description: This is a script that will print out the first 100 buckets on
 the user's AWS account along with their contents.
 Example Format:
 
@@ -9,41 +9,323 @@ Object(s):
  - error.html,
  - index.html,
 },
+2 object(s), 1.2 KiB
 ...
 
+With --details, the totals are broken down by prefix and storage class,
+along with a histogram of object sizes and the largest objects. All of it is
+worked out in the one pass over the listing (see storage_stats.py).
+
+Buckets with hundreds of millions of objects are far too big to list. For
+those, point it at an S3 Inventory report with --inventory, and it totals up
+the report instead (see inventory.py). Or, when a rough idea is enough, have it
+estimated with --estimate, from tens of thousands of calls instead of
+millions (see estimate.py).
+
+Example:
+
+python3 cli.py list-buckets
+python3 cli.py list-buckets --bucket example-bucket --quiet --details --top 20
+python3 cli.py list-buckets --inventory s3://inventory-bucket/path/manifest.json
+python3 cli.py list-buckets --bucket huge-bucket --estimate --error 5
 '''
 
-import boto3
+import argparse
+import datetime
+import functools
+import json
 
-# Let's start off by getting a low level client so that we can interact with
-# the s3 service.
-client = boto3.client('s3')
+from common import clients, paginate
 
-# Let's request a list of information on the first 100 buckets in our account.
-list_buckets_response = client.list_buckets(
-    MaxBuckets = 100,
-)
+import estimate
+import inventory
+import storage_stats
+
+# How many buckets we list, unless told otherwise.
+MAX_BUCKETS: int = 100
 
-# Now that we have the information for each bucket, we can print out what we
-# want from them. We want just the name and the contents
-for bucket in list_buckets_response['Buckets']:
 
-    # First, let's get that name.
-    bucket_name = bucket['Name']
 
-    # Now, we can print it out.
-    print('Bucket Name: ' + bucket_name + ' {\nObject(s):')
 
-    # We can use the bucket name, then, to obtain a list of the objects within 
-    # it with this API call.
-    list_objects_response = client.list_objects_v2(
-        Bucket = bucket_name
+def get_buckets(s3_client, max_buckets: int = MAX_BUCKETS) -> list[dict]:
+    """_Get the first few buckets on the account._
+
+    Args:
+        s3_client: _A low level boto3 client for S3._
+        max_buckets (int, optional): _How many buckets. Defaults to
+            MAX_BUCKETS._
+
+    Returns:
+        list[dict]: _Bucket metadata, as found in `response["Buckets"]` of a
+            `S3.client.list_buckets()` call._
+    """
+    # Let's request a list of information on the first 100 buckets in our
+    # account.
+    response: dict = s3_client.list_buckets(
+        MaxBuckets = max_buckets,
     )
+    return response['Buckets']
+
+
 
-    # From that previous response, let's print the names of each object
-    for object in list_objects_response['Contents']:
-        object_name = object['Key']
-        print(' - ' + object_name + ',')
+
+def list_objects(s3_client, bucket_name: str):
+    """_Go through every object in a bucket._
+
+    Args:
+        s3_client: _A low level boto3 client for S3._
+        bucket_name (str): _Name of the bucket._
+
+    Yields:
+        dict: _Object metadata, as found in `response["Contents"]` of a
+            `S3.client.list_objects_v2()` call._
+    """
+    # It only hands back 1000 objects at a time, so let's go through every
+    # page (the next one is fetched while we look at this one). An empty
+    # bucket has no 'Contents' at all, which is fine here too.
+    yield from paginate.items(s3_client, 'list_objects_v2', 'Contents',
+        Bucket = bucket_name)
+
+
+
+
+def print_bucket(
+        bucket_name: str,
+        objects,
+        stats: storage_stats.StorageStats,
+        quiet: bool = False,
+        details: bool = False
+):
+    """_Print the contents of a bucket as they stream past, and total them up
+    along the way._
+
+    Args:
+        bucket_name (str): _Name of the bucket._
+        objects: _Its objects, from `list_objects()`._
+        stats (storage_stats.StorageStats): _The totals to add them to._
+        quiet (bool, optional): _Only total them up, don't print the names.
+            Defaults to False._
+        details (bool, optional): _Also print the breakdowns of the totals.
+            Defaults to False._
+    """
+    # First, let's print the name.
+    print('Bucket Name: ' + bucket_name + ' {\nObject(s):')
+
+    # From the objects, let's print the names of each object
+    for s3_object in objects:
+        stats.add(s3_object)
+        if not quiet:
+            print(' - ' + s3_object['Key'] + ',')
 
     print('},')
-    
+    print_totals(stats, details)
+
+
+
+
+def print_totals(stats: storage_stats.StorageStats, details: bool = False):
+    """_Print the totals of a bucket._
+
+    Args:
+        stats (storage_stats.StorageStats): _The totals._
+        details (bool, optional): _Also print the breakdowns of the totals.
+            Defaults to False._
+    """
+    human = storage_stats.human_bytes
+    print(f"{stats.objects} object(s), {human(stats.bytes)}")
+
+    if not details:
+        return
+
+    if stats.prefixes:
+        print("By prefix:")
+        for prefix, (objects, size) in sorted(
+                stats.prefixes.items(), key=lambda item: -item[1][1]):
+            print(f"  {prefix or '(top level)':<40}{objects:>12} "
+                f"{human(size):>12}")
+
+    print("By storage class:")
+    for storage_class, (objects, size) in sorted(stats.storage_classes.items()):
+        print(f"  {storage_class:<40}{objects:>12} {human(size):>12}")
+
+    print("By size:")
+    for low, high, objects in stats.histogram_ranges():
+        print(f"  {human(low):>10} - {human(high):<27}{objects:>12}")
+
+    if stats.largest:
+        print("Largest:")
+        for size, key in stats.largest_objects():
+            print(f"  {human(size):>12}  {key}")
+
+
+
+
+def print_estimate(bucket_name: str, result: dict):
+    """_Print the estimated totals of a bucket.
+
+    Args:
+        bucket_name (str): _Name of the bucket._
+        result (dict): _The estimate, from `estimate.estimate_bucket()`._
+    """
+    human = storage_stats.human_bytes
+    if result["exact"]:
+        print(f"Bucket Name: {bucket_name} (counted, {result['calls']} calls)")
+        print(f"{result['objects']} object(s), {human(result['bytes'])}")
+        return
+
+    print(f"Bucket Name: {bucket_name} (estimated, {result['walks']} walks, "
+        f"{result['calls']} calls)")
+    print(f"~{result['objects']} object(s) ±{result['objects_margin']:.1%}, "
+        f"~{human(result['bytes'])} ±{result['bytes_margin']:.1%}")
+
+
+
+
+def taken_at(manifest: dict) -> str:
+    """_When an inventory report was taken, as UTC. The manifest has it in
+    milliseconds since the epoch._"""
+    if "creationTimestamp" not in manifest:
+        return "unknown"
+
+    return datetime.datetime.fromtimestamp(
+        int(manifest["creationTimestamp"]) / 1000, datetime.timezone.utc
+    ).strftime("%Y-%m-%d %H:%M UTC")
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Bucket Lister",
+        description="Print the buckets on the account and what is in them",
+    )
+    parser.add_argument(
+        "-b", "--bucket",
+        action="append",
+        help="Only list this bucket. Can be repeated. Defaults to the first "
+            f"{MAX_BUCKETS} buckets",
+        dest="buckets",
+    )
+    parser.add_argument(
+        "-q", "--quiet",
+        action="store_true",
+        help="Only print the totals of each bucket, not every object",
+    )
+    parser.add_argument(
+        "-d", "--details",
+        action="store_true",
+        help="Break the totals down by prefix, storage class and size",
+    )
+    parser.add_argument(
+        "-t", "--top",
+        type=int,
+        default=storage_stats.DEFAULT_TOP,
+        help="How many of the largest objects to show with --details. "
+            f"Defaults to {storage_stats.DEFAULT_TOP}",
+    )
+    parser.add_argument(
+        "--prefix-depth",
+        type=int,
+        default=storage_stats.DEFAULT_PREFIX_DEPTH,
+        help="How many levels of the keys make up a prefix. Defaults to "
+            f"{storage_stats.DEFAULT_PREFIX_DEPTH}",
+    )
+    parser.add_argument(
+        "-j", "--json",
+        type=str,
+        help="Also write the totals of every bucket to this JSON file",
+    )
+    parser.add_argument(
+        "-i", "--inventory",
+        type=str,
+        help="Total up this S3 Inventory manifest (a path, or an s3:// URL) "
+            "instead of listing",
+    )
+    parser.add_argument(
+        "-p", "--processes",
+        type=int,
+        help="Processes reading the inventory. Defaults to one per CPU",
+    )
+    parser.add_argument(
+        "-e", "--estimate",
+        action="store_true",
+        help="Estimate how many objects and bytes there are instead of "
+            "listing every object",
+    )
+    parser.add_argument(
+        "--error",
+        type=float,
+        default=estimate.DEFAULT_ERROR * 100,
+        help="How close the estimates have to be, in percent, at 95%% "
+            f"confidence. Defaults to {estimate.DEFAULT_ERROR * 100:g}",
+    )
+    parser.add_argument(
+        "--max-calls",
+        type=int,
+        default=estimate.DEFAULT_MAX_CALLS,
+        help="Calls an estimate may take at most, however close it is. "
+            f"Defaults to {estimate.DEFAULT_MAX_CALLS}",
+    )
+    args = parser.parse_args()
+
+    # Every bucket gets its own totals. This makes empty ones, and can be
+    # handed to the inventory processes too.
+    make_stats = functools.partial(
+        storage_stats.StorageStats, args.top, args.prefix_depth
+    )
+    totals: dict[str, dict] = {}
+
+    # INVENTORY - read the report, not the buckets
+    if args.inventory:
+        report: dict = inventory.ingest(
+            args.inventory, make_stats, args.processes
+        )
+        for bucket_name, stats in sorted(report["buckets"].items()):
+            if args.buckets and bucket_name not in args.buckets:
+                continue
+            print(f"Bucket Name: {bucket_name} (inventory of "
+                f"{taken_at(report['manifest'])})")
+            print_totals(stats, args.details)
+            totals[bucket_name] = stats.to_dict()
+
+    # LIVE - list every object. Let's start off by getting a low level client
+    # so that we can interact with the s3 service.
+    else:
+        client = clients.client('s3')
+
+        bucket_names: list[str] = args.buckets or [
+            bucket['Name'] for bucket in get_buckets(client)
+        ]
+
+        # Now that we have the names of the buckets, we can print out what we
+        # want from them. We want just the name and the contents, or roughly
+        # how much there is.
+        for bucket_name in bucket_names:
+            if args.estimate:
+                totals[bucket_name] = estimate.estimate_bucket(
+                    client, bucket_name, args.error / 100, args.max_calls
+                )
+                print_estimate(bucket_name, totals[bucket_name])
+                continue
+
+            stats: storage_stats.StorageStats = make_stats()
+            print_bucket(
+                bucket_name,
+                list_objects(client, bucket_name),
+                stats,
+                args.quiet,
+                args.details,
+            )
+            totals[bucket_name] = stats.to_dict()
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(totals, file, indent=2)
+
+
+
+
+if __name__ == "__main__":
+    main()
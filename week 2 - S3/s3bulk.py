@@ -0,0 +1,744 @@
+'''
+Author: Joseph Hopwood
+Description: This is a script that runs one operation over a lot of S3
+objects: deleting them, copying them to another bucket, tagging them, or
+changing their metadata (headers like Cache-Control). Deletes go 1000 keys to
+a call with `delete_objects`; everything else is one call per key, so those
+calls are spread over a pool of threads. Either way, emptying a bucket with
+millions of objects is bounded by how fast S3 takes the calls, not by waiting
+on one round trip after another.
+
+The keys come from a manifest: a listing of the bucket (under a prefix if you
+like), a file with one key per line, a CSV file of "bucket,key" rows like S3
+Batch Operations takes, or an S3 Inventory report. Keys that fail for a reason
+that may pass, like being throttled, are tried again with backoff. Keys that
+still fail are counted by error code, and can be written to a file to be run
+again later as a manifest.
+
+With a checkpoint file, how far the run has got is saved every few seconds.
+Run it again with the same file, and it picks up where it left off.
+
+Example:
+
+python3 cli.py s3-bulk delete -b example-bucket --remove-bucket
+python3 cli.py s3-bulk copy -b example-bucket -p assets/ --to backup-bucket --to-prefix 2024/
+python3 cli.py s3-bulk tag -b example-bucket -m keys.txt --tag team=web --tag env=prod
+python3 cli.py s3-bulk metadata -b example-bucket --cache-control "max-age=86400"
+python3 cli.py s3-bulk delete -b huge-bucket -c teardown.json --failed failed.txt
+'''
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+import urllib.parse
+
+from common import clients, paginate
+
+# delete_objects takes at most 1000 keys per call.
+DELETE_BATCH_SIZE: int = 1000
+
+# How many calls we make at the same time.
+MAX_WORKERS: int = 32
+
+# How many times a key that failed is tried again before we give up on it, and
+# how long we wait before the first of those. The wait doubles every time.
+MAX_RETRIES: int = 4
+RETRY_DELAY: float = 0.5
+
+# Error codes that may well pass if we try again. Anything else, like
+# AccessDenied, is there to stay.
+RETRYABLE_CODES: frozenset = frozenset({
+    "InternalError",
+    "OperationAborted",
+    "RequestTimeout",
+    "ServiceUnavailable",
+    "SlowDown",
+    "Throttling",
+})
+
+# The header of every permission an object ACL can grant, as `copy_object()`
+# takes them.
+GRANT_HEADERS: dict[str, str] = {
+    "FULL_CONTROL" : "GrantFullControl",
+    "READ" : "GrantRead",
+    "READ_ACP" : "GrantReadACP",
+    "WRITE_ACP" : "GrantWriteACP",
+}
+
+# How often the checkpoint is saved, in seconds.
+CHECKPOINT_SECONDS: float = 5.0
+
+# The operations, and how many keys go to a call of each.
+OPERATIONS: dict[str, int] = {
+    "delete" : DELETE_BATCH_SIZE,
+    "copy" : 1,
+    "tag" : 1,
+    "metadata" : 1,
+}
+
+
+
+
+class Progress:
+    """
+    How far a run has got, and how it went. Keys finish out of order, so what
+    the checkpoint saves is how many keys from the start of the manifest have
+    all finished, and the last of them. A run picking up from it starts right
+    after that, and at worst does again what was in flight when the last one
+    stopped. That is harmless for every operation here.
+    """
+
+
+    def __init__(
+            self,
+            operation: str,
+            bucket_name: str,
+            path: str = None,
+            failed_path: str = None
+    ):
+        """Initialize the progress of a run, from its checkpoint if it has
+        one.
+
+        Args:
+            operation (str): Name of the operation, see `OPERATIONS`.
+            bucket_name (str): Name of the bucket.
+            path (str, optional): Checkpoint file. Defaults to none.
+            failed_path (str, optional): File to add every key that failed for
+                good to. Defaults to none.
+        """
+        self.operation: str = operation
+        self.bucket_name: str = bucket_name
+        self.path: str = path
+
+        # Keys from the start of the manifest that have all finished.
+        self.done: int = 0
+        self.last_key: str = None
+
+        self.succeeded: int = 0
+        self.failed: dict[str, int] = {}
+
+        if path and os.path.exists(path):
+            with open(path, 'r') as file:
+                state: dict = json.load(file)
+            if (state["operation"], state["bucket"]) != (operation, bucket_name):
+                raise ValueError(
+                    f"{path} is a checkpoint of {state['operation']} on "
+                    f"{state['bucket']}, not of {operation} on {bucket_name}"
+                )
+            self.done = state["done"]
+            self.last_key = state["last_key"]
+            self.succeeded = state["succeeded"]
+            self.failed = state["failed"]
+
+        # Keys that finished ahead of `done`, by their place in the manifest.
+        self._finished: dict[int, str] = {}
+        self._saved: float = time.monotonic()
+        self._failed_file = open(failed_path, 'a') if failed_path else None
+
+
+    def finish(self, results: list[tuple[int, str, str]]):
+        """Count keys that finished, and save the checkpoint if it's due.
+
+        Args:
+            results (list[tuple[int, str, str]]): The place in the manifest,
+                key, and error code of every key, or None if it went through.
+        """
+        for index, key, code in results:
+            if code is None:
+                self.succeeded += 1
+            else:
+                self.failed[code] = self.failed.get(code, 0) + 1
+                if self._failed_file:
+                    self._failed_file.write(key + '\n')
+            self._finished[index] = key
+
+        while self.done in self._finished:
+            self.last_key = self._finished.pop(self.done)
+            self.done += 1
+
+        if self.path and time.monotonic() - self._saved >= CHECKPOINT_SECONDS:
+            self.save()
+
+
+    def save(self):
+        """Save the checkpoint. It's written next to the old one and then
+        swapped in, so it's never left half written."""
+        if self._failed_file:
+            self._failed_file.flush()
+        if not self.path:
+            return
+
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump({
+                "operation" : self.operation,
+                "bucket" : self.bucket_name,
+                "done" : self.done,
+                "last_key" : self.last_key,
+                "succeeded" : self.succeeded,
+                "failed" : self.failed,
+            }, file, indent=2)
+        os.replace(self.path + '.tmp', self.path)
+        self._saved = time.monotonic()
+
+
+    def close(self):
+        """Save the checkpoint one last time."""
+        self.save()
+        if self._failed_file:
+            self._failed_file.close()
+
+
+
+
+def list_keys(
+        s3_client,
+        bucket_name: str,
+        prefix: str = '',
+        start_after: str = None
+):
+    """_Go through the keys of a bucket, in order._
+
+    Args:
+        s3_client: _A low level boto3 client for S3._
+        bucket_name (str): _Name of the bucket._
+        prefix (str, optional): _Only keys that start with this. Defaults to
+            every key._
+        start_after (str, optional): _Only keys after this one. Defaults to
+            the first key._
+
+    Yields:
+        str: _Every key._
+    """
+    kwargs: dict = {'Bucket' : bucket_name, 'Prefix' : prefix}
+    if start_after:
+        kwargs['StartAfter'] = start_after
+
+    for s3_object in paginate.items(s3_client, 'list_objects_v2', 'Contents',
+            **kwargs):
+        yield s3_object['Key']
+
+
+
+
+def read_manifest(path: str, bucket_name: str):
+    """_Go through the keys of a manifest file. A ".csv" file has "bucket,key"
+    rows with URL encoded keys, like S3 Batch Operations takes, and only the
+    rows of the bucket count. Any other file has one key per line, as is._
+
+    Args:
+        path (str): _Path of the manifest._
+        bucket_name (str): _Name of the bucket._
+
+    Yields:
+        str: _Every key._
+    """
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        if path.lower().endswith('.csv'):
+            for row in csv.reader(file):
+                if len(row) >= 2 and row[0] == bucket_name:
+                    yield urllib.parse.unquote_plus(row[1])
+        else:
+            for line in file:
+                key: str = line.rstrip('\r\n')
+                if key:
+                    yield key
+
+
+
+
+def inventory_keys(location: str, bucket_name: str):
+    """_Go through the keys of an S3 Inventory report (see inventory.py)._
+
+    Args:
+        location (str): _Path of a local manifest.json, or its S3 URL._
+        bucket_name (str): _Name of the bucket._
+
+    Yields:
+        str: _Every key of the bucket in the report._
+    """
+    # Imported here, so that every other run never pays for it.
+    import inventory
+
+    manifest: dict = inventory.load_manifest(location)
+    for data_file in manifest["files"]:
+        for s3_object in inventory.read_objects(manifest, data_file):
+            if s3_object["Bucket"] == bucket_name:
+                yield s3_object["Key"]
+
+
+
+
+def delete_objects(s3_client, bucket_name: str, keys: list[str]) -> dict[str, str]:
+    """_Delete up to 1000 objects in one call._
+
+    Args:
+        s3_client: _A low level boto3 client for S3._
+        bucket_name (str): _Name of the bucket._
+        keys (list[str]): _Keys of the objects._
+
+    Returns:
+        dict[str, str]: _Error code of every key that failed._
+    """
+    # Quiet, so only the keys that failed come back.
+    response: dict = s3_client.delete_objects(
+        Bucket = bucket_name,
+        Delete = {
+            'Objects' : [{'Key' : key} for key in keys],
+            'Quiet' : True,
+        },
+    )
+    return {error['Key'] : error['Code'] for error in response.get('Errors', [])}
+
+
+
+
+def copy_object(
+        s3_client,
+        bucket_name: str,
+        key: str,
+        destination: str,
+        destination_prefix: str = ''
+):
+    """_Copy an object to another bucket, or another prefix. Objects over
+    5 GiB can't be copied in one call, and fail with "InvalidRequest"._
+
+    Args:
+        s3_client: _A low level boto3 client for S3._
+        bucket_name (str): _Name of the bucket._
+        key (str): _Key of the object._
+        destination (str): _Name of the bucket to copy to._
+        destination_prefix (str, optional): _Put in front of the key of the
+            copy. Defaults to nothing._
+    """
+    s3_client.copy_object(
+        Bucket = destination,
+        Key = destination_prefix + key,
+        CopySource = {'Bucket' : bucket_name, 'Key' : key},
+    )
+
+
+
+
+def tag_object(s3_client, bucket_name: str, key: str, tags: dict[str, str]):
+    """_Set the tags of an object. Any tags it had are replaced._
+
+    Args:
+        s3_client: _A low level boto3 client for S3._
+        bucket_name (str): _Name of the bucket._
+        key (str): _Key of the object._
+        tags (dict[str, str]): _The tags._
+    """
+    s3_client.put_object_tagging(
+        Bucket = bucket_name,
+        Key = key,
+        Tagging = {
+            'TagSet' : [{'Key' : name, 'Value' : value}
+                for name, value in tags.items()],
+        },
+    )
+
+
+
+
+def update_metadata(
+        s3_client,
+        bucket_name: str,
+        key: str,
+        headers: dict[str, str],
+        metadata: dict[str, str]
+):
+    """_Change the headers or user metadata of an object. Objects can't be
+    changed in place, so it's copied onto itself. That replaces all of its
+    metadata, so we read what it has first and only change what we're asked
+    to. Its tags carry over, and so does its encryption (SSE-S3 or SSE-KMS,
+    with the same key), its redirect and its Expires header, which the copy
+    would otherwise drop. So does its ACL, which the copy would reset to
+    private. That takes reading it, so an object whose ACL we may not read
+    is left as it is, with an error._
+
+    Args:
+        s3_client: _A low level boto3 client for S3._
+        bucket_name (str): _Name of the bucket._
+        key (str): _Key of the object._
+        headers (dict[str, str]): _New values of headers, by the name
+            `copy_object()` gives them, e.g. "CacheControl"._
+        metadata (dict[str, str]): _User metadata to add or change._
+    """
+    head: dict = s3_client.head_object(Bucket = bucket_name, Key = key)
+    acl: dict = s3_client.get_object_acl(Bucket = bucket_name, Key = key)
+
+    kwargs: dict = {
+        name: head[name]
+        for name in ('CacheControl', 'ContentDisposition', 'ContentEncoding',
+            'ContentLanguage', 'ContentType', 'Expires', 'StorageClass',
+            'WebsiteRedirectLocation', 'ServerSideEncryption', 'SSEKMSKeyId',
+            'BucketKeyEnabled')
+        if name in head
+    }
+    kwargs.update(_grants(acl))
+    kwargs.update(headers)
+
+    s3_client.copy_object(
+        Bucket = bucket_name,
+        Key = key,
+        CopySource = {'Bucket' : bucket_name, 'Key' : key},
+        MetadataDirective = 'REPLACE',
+        Metadata = {**head.get('Metadata', {}), **metadata},
+        **kwargs,
+    )
+
+
+
+
+def _grants(acl: dict) -> dict[str, str]:
+    """_The grants of an ACL, as the headers `copy_object()` takes them, so the
+    copy gets them at once instead of being private until they're put back.
+    An ACL that only gives the owner full control is what the copy gets
+    anyway, and the only one a bucket with ACLs turned off takes, so that one
+    needs none._
+
+    Args:
+        acl (dict): _The ACL, as `get_object_acl()` returns it._
+
+    Returns:
+        dict[str, str]: _Grantees by header, e.g. "GrantRead", in the form
+            `id="..."`, `uri="..."` or `emailAddress="..."`._
+    """
+    owner: str = acl.get('Owner', {}).get('ID')
+    grants: list[dict] = acl.get('Grants', [])
+    if all(
+        grant['Grantee'].get('ID') == owner
+        and grant['Permission'] == 'FULL_CONTROL'
+        for grant in grants
+    ):
+        return {}
+
+    headers: dict[str, list[str]] = {}
+    for grant in grants:
+        grantee: dict = grant['Grantee']
+        if 'ID' in grantee:
+            value: str = f'id="{grantee["ID"]}"'
+        elif 'URI' in grantee:
+            value = f'uri="{grantee["URI"]}"'
+        else:
+            value = f'emailAddress="{grantee["EmailAddress"]}"'
+        headers.setdefault(GRANT_HEADERS[grant['Permission']], []).append(value)
+
+    return {header: ", ".join(values) for header, values in headers.items()}
+
+
+
+
+def run_batch(
+        s3_client,
+        bucket_name: str,
+        operation: str,
+        batch: list[tuple[int, str]],
+        options: dict
+) -> list[tuple[int, str, str]]:
+    """_Run an operation over a batch of keys, trying the ones that fail for a
+    reason that may pass again, with backoff._
+
+    Args:
+        s3_client: _A low level boto3 client for S3._
+        bucket_name (str): _Name of the bucket._
+        operation (str): _Name of the operation, see `OPERATIONS`._
+        batch (list[tuple[int, str]]): _The place in the manifest and key of
+            every object._
+        options (dict): _What the operation needs besides the key, see
+            `main()`._
+
+    Returns:
+        list[tuple[int, str, str]]: _The place in the manifest, key, and error
+            code of every object, or None if it went through._
+    """
+    client_error = clients.client_error()
+    pending: list[tuple[int, str]] = batch
+    results: list[tuple[int, str, str]] = []
+
+    for attempt in range(MAX_RETRIES + 1):
+        if operation == "delete":
+            try:
+                errors: dict[str, str] = delete_objects(
+                    s3_client, bucket_name, [key for _, key in pending]
+                )
+            except client_error as error:
+                code: str = error.response['Error']['Code']
+                errors = {key: code for _, key in pending}
+        else:
+            errors = {}
+            for _, key in pending:
+                try:
+                    if operation == "copy":
+                        copy_object(s3_client, bucket_name, key,
+                            options["destination"], options["destination_prefix"])
+                    elif operation == "tag":
+                        tag_object(s3_client, bucket_name, key, options["tags"])
+                    else:
+                        update_metadata(s3_client, bucket_name, key,
+                            options["headers"], options["metadata"])
+                except client_error as error:
+                    errors[key] = error.response['Error']['Code']
+
+        retry: list[tuple[int, str]] = []
+        for index, key in pending:
+            code = errors.get(key)
+            if code in RETRYABLE_CODES and attempt < MAX_RETRIES:
+                retry.append((index, key))
+            else:
+                results.append((index, key, code))
+
+        if not retry:
+            break
+        pending = retry
+        time.sleep(RETRY_DELAY * 2 ** attempt)
+
+    return results
+
+
+
+
+def run(
+        s3_client,
+        bucket_name: str,
+        operation: str,
+        keys,
+        progress: Progress,
+        options: dict = None,
+        max_workers: int = MAX_WORKERS
+):
+    """_Run an operation over every key of a manifest, on a pool of threads.
+    Only a few batches per thread are handed out ahead of time, so a manifest
+    of any size goes through in the same memory._
+
+    Args:
+        s3_client: _A low level boto3 client for S3. It should keep at least
+            `max_workers` connections open._
+        bucket_name (str): _Name of the bucket._
+        operation (str): _Name of the operation, see `OPERATIONS`._
+        keys: _The keys, in manifest order, from where `progress` is at._
+        progress (Progress): _Where the outcome of every key goes._
+        options (dict, optional): _What the operation needs besides the key,
+            see `main()`. Defaults to nothing._
+        max_workers (int, optional): _How many calls to make at the same time.
+            Defaults to MAX_WORKERS._
+    """
+    # Imported here, so that --help never pays for it.
+    import concurrent.futures
+
+    batch_size: int = OPERATIONS[operation]
+    numbered = enumerate(keys, start=progress.done)
+    in_flight: set = set()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        while True:
+            batch: list[tuple[int, str]] = list(
+                itertools.islice(numbered, batch_size)
+            )
+            if not batch:
+                break
+
+            # Let's wait for a batch to finish before handing out more, once
+            # every thread has a couple lined up.
+            if len(in_flight) >= 2 * max_workers:
+                finished, in_flight = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in finished:
+                    progress.finish(future.result())
+
+            in_flight.add(executor.submit(
+                run_batch, s3_client, bucket_name, operation, batch,
+                options or {},
+            ))
+
+        for future in concurrent.futures.as_completed(in_flight):
+            progress.finish(future.result())
+
+
+
+
+def key_values(pairs: list[str]) -> dict[str, str]:
+    """_Turn "name=value" arguments into a dict._"""
+    values: dict[str, str] = {}
+    for pair in pairs or []:
+        name, separator, value = pair.partition('=')
+        if not separator:
+            raise argparse.ArgumentTypeError(f"Expected name=value, got {pair}")
+        values[name] = value
+    return values
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="S3 Bulk Operations",
+        description="Delete, copy, tag, or change the metadata of a lot of "
+            "S3 objects at once",
+    )
+    parser.add_argument(
+        "operation",
+        choices=list(OPERATIONS),
+        help="What to do to every object",
+    )
+    parser.add_argument(
+        "-b", "--bucket",
+        required=True,
+        help="Bucket the objects are in",
+    )
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument(
+        "-p", "--prefix",
+        default="",
+        help="Every object under this prefix. Defaults to every object in "
+            "the bucket",
+    )
+    source.add_argument(
+        "-m", "--manifest",
+        help="File of keys, one per line, or a .csv of bucket,key rows",
+    )
+    source.add_argument(
+        "-i", "--inventory",
+        help="S3 Inventory manifest (a path, or an s3:// URL) to take the "
+            "keys from",
+    )
+    parser.add_argument(
+        "--to",
+        help="copy: bucket to copy to. Defaults to the same bucket",
+    )
+    parser.add_argument(
+        "--to-prefix",
+        default="",
+        help="copy: put this in front of the key of every copy",
+    )
+    parser.add_argument(
+        "--tag",
+        action="append",
+        help="tag: a tag, as name=value. Can be repeated",
+    )
+    parser.add_argument(
+        "--cache-control",
+        help="metadata: new Cache-Control header",
+    )
+    parser.add_argument(
+        "--content-type",
+        help="metadata: new Content-Type header",
+    )
+    parser.add_argument(
+        "--meta",
+        action="append",
+        help="metadata: user metadata to set, as name=value. Can be repeated",
+    )
+    parser.add_argument(
+        "--remove-bucket",
+        action="store_true",
+        help="delete: remove the bucket too, once nothing failed",
+    )
+    parser.add_argument(
+        "-c", "--checkpoint",
+        help="Save progress to this file, and pick up from it if it exists",
+    )
+    parser.add_argument(
+        "--failed",
+        help="Add every key that failed for good to this file",
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=MAX_WORKERS,
+        help=f"Calls made at the same time. Defaults to {MAX_WORKERS}",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only count the objects the operation would go through",
+    )
+    args = parser.parse_args()
+
+    options: dict = {
+        "destination" : args.to or args.bucket,
+        "destination_prefix" : args.to_prefix,
+        "tags" : key_values(args.tag),
+        "headers" : {
+            name: value for name, value in (
+                ("CacheControl", args.cache_control),
+                ("ContentType", args.content_type),
+            ) if value is not None
+        },
+        "metadata" : key_values(args.meta),
+    }
+    if args.operation == "copy" and options["destination"] == args.bucket \
+            and not args.to_prefix:
+        parser.error("copy needs --to or --to-prefix, or it copies objects "
+            "onto themselves")
+    if args.operation == "tag" and not options["tags"]:
+        parser.error("tag needs at least one --tag")
+    if args.operation == "metadata" and not (options["headers"]
+            or options["metadata"]):
+        parser.error("metadata needs --cache-control, --content-type or --meta")
+
+    # Let's start off by getting a low level client, with a connection for
+    # every thread.
+    s3_client = clients.client('s3', max_pool_connections=args.workers)
+
+    progress: Progress = Progress(
+        args.operation, args.bucket, args.checkpoint, args.failed
+    )
+    if progress.done:
+        print(f"Picking up after {progress.done} object(s) "
+            f"({progress.last_key})")
+
+    # A listing can start right after the last key done. A file has to be
+    # read up to there.
+    if args.manifest:
+        keys = itertools.islice(
+            read_manifest(args.manifest, args.bucket), progress.done, None
+        )
+    elif args.inventory:
+        keys = itertools.islice(
+            inventory_keys(args.inventory, args.bucket), progress.done, None
+        )
+    else:
+        keys = list_keys(s3_client, args.bucket, args.prefix, progress.last_key)
+
+        # Copies into the prefix we're listing show up in the listing later
+        # on, and would be copied again, and again. Anything already under
+        # the destination prefix is left alone.
+        if args.operation == "copy" and options["destination"] == args.bucket \
+                and args.to_prefix.startswith(args.prefix):
+            keys = (key for key in keys if not key.startswith(args.to_prefix))
+
+    if args.dry_run:
+        print(f"Would {args.operation} {sum(1 for _ in keys)} object(s)")
+        return
+
+    start: float = time.perf_counter()
+    try:
+        run(s3_client, args.bucket, args.operation, keys, progress, options,
+            args.workers)
+    finally:
+        progress.close()
+    elapsed: float = time.perf_counter() - start
+
+    failed: int = sum(progress.failed.values())
+    print(f"{args.operation}: {progress.succeeded} object(s) went through, "
+        f"{failed} failed, in {elapsed:.1f}s")
+    for code, count in sorted(progress.failed.items()):
+        print(f"  {code}: {count}")
+
+    # Now that the bucket is empty, it can go too.
+    if args.remove_bucket and args.operation == "delete" and not failed:
+        s3_client.delete_bucket(Bucket = args.bucket)
+        print(f"Removed bucket {args.bucket}")
+
+
+
+
+if __name__ == "__main__":
+    main()
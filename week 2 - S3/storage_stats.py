@@ -0,0 +1,178 @@
+'''
+Author: Joseph Hopwood
+Description: Module containing the running totals of the objects of a bucket.
+Objects are added one at a time as they stream past, from a live listing or
+from an inventory, and are never kept around. Besides the grand totals, it
+keeps totals per prefix and per storage class, a histogram of object sizes,
+and the largest objects. All of that takes memory for the prefixes and the
+largest objects only, no matter how many objects go past. Totals of separate
+streams (one per inventory file, say) merge into one.
+'''
+
+import heapq
+
+# How many of the largest objects are kept, unless told otherwise.
+DEFAULT_TOP: int = 10
+
+# How many levels of "folders" prefixes are totaled at, unless told otherwise.
+DEFAULT_PREFIX_DEPTH: int = 1
+
+
+
+
+class StorageStats:
+    """
+    How many objects a bucket holds and how many bytes they add up to, broken
+    down by prefix, storage class and size.
+    """
+
+
+    def __init__(self, top: int = DEFAULT_TOP,
+            prefix_depth: int = DEFAULT_PREFIX_DEPTH):
+        """Initialize empty totals.
+
+        Args:
+            top (int, optional): How many of the largest objects to keep.
+                Defaults to DEFAULT_TOP.
+            prefix_depth (int, optional): How many levels of the keys make up
+                a prefix, e.g. 2 totals "logs/2024/" separately from
+                "logs/2023/". 0 turns the prefix totals off. Defaults to
+                DEFAULT_PREFIX_DEPTH.
+        """
+        self.top: int = top
+        self.prefix_depth: int = prefix_depth
+
+        self.objects: int = 0
+        self.bytes: int = 0
+
+        # [objects, bytes], keyed by prefix and by storage class.
+        self.prefixes: dict[str, list[int]] = {}
+        self.storage_classes: dict[str, list[int]] = {}
+
+        # Objects, keyed by the number of bits of their size. Bucket k holds
+        # sizes from 2^(k-1) up to just under 2^k, and bucket 0 empty ones.
+        self.histogram: dict[int, int] = {}
+
+        # A min-heap of (size, key), so the smallest of the largest objects is
+        # always the one on top, ready to be pushed out.
+        self.largest: list[tuple[int, str]] = []
+
+
+    def add(self, s3_object: dict):
+        """Count one object.
+
+        Args:
+            s3_object (dict): Object metadata, as found in
+                `response["Contents"]` of a `S3.client.list_objects_v2()` call.
+        """
+        size: int = s3_object["Size"]
+        key: str = s3_object["Key"]
+
+        self.objects += 1
+        self.bytes += size
+
+        if self.prefix_depth:
+            parts: list[str] = key.split("/", self.prefix_depth)
+            prefix: str = "/".join(parts[:-1]) + "/" if len(parts) > 1 else ""
+            totals: list[int] = self.prefixes.get(prefix)
+            if totals is None:
+                totals = self.prefixes[prefix] = [0, 0]
+            totals[0] += 1
+            totals[1] += size
+
+        storage_class: str = s3_object.get("StorageClass") or "STANDARD"
+        totals = self.storage_classes.get(storage_class)
+        if totals is None:
+            totals = self.storage_classes[storage_class] = [0, 0]
+        totals[0] += 1
+        totals[1] += size
+
+        bits: int = size.bit_length()
+        self.histogram[bits] = self.histogram.get(bits, 0) + 1
+
+        if len(self.largest) < self.top:
+            heapq.heappush(self.largest, (size, key))
+        elif self.top and size > self.largest[0][0]:
+            heapq.heapreplace(self.largest, (size, key))
+
+
+    def merge(self, other: "StorageStats") -> "StorageStats":
+        """Add the totals of another stream of objects to these.
+
+        Args:
+            other (StorageStats): Totals of the other stream.
+
+        Returns:
+            StorageStats: These totals, for chaining.
+        """
+        self.objects += other.objects
+        self.bytes += other.bytes
+
+        for mine, theirs in (
+                (self.prefixes, other.prefixes),
+                (self.storage_classes, other.storage_classes)
+        ):
+            for name, (objects, size) in theirs.items():
+                totals: list[int] = mine.setdefault(name, [0, 0])
+                totals[0] += objects
+                totals[1] += size
+
+        for bits, objects in other.histogram.items():
+            self.histogram[bits] = self.histogram.get(bits, 0) + objects
+
+        for entry in other.largest:
+            if len(self.largest) < self.top:
+                heapq.heappush(self.largest, entry)
+            elif self.top and entry > self.largest[0]:
+                heapq.heapreplace(self.largest, entry)
+
+        return self
+
+
+    def largest_objects(self) -> list[tuple[int, str]]:
+        """The largest objects, as (size, key), largest first."""
+        return sorted(self.largest, reverse=True)
+
+
+    def histogram_ranges(self) -> list[tuple[int, int, int]]:
+        """The size histogram, as (from bytes, up to bytes, objects), smallest
+        sizes first. Only ranges that hold objects show up."""
+        return [
+            (0 if bits == 0 else 2 ** (bits - 1), 2 ** bits, objects)
+            for bits, objects in sorted(self.histogram.items())
+        ]
+
+
+    def to_dict(self) -> dict:
+        return {
+            "objects" : self.objects,
+            "bytes" : self.bytes,
+            "prefixes" : {
+                prefix: {"objects" : objects, "bytes" : size}
+                for prefix, (objects, size) in sorted(self.prefixes.items())
+            },
+            "storage_classes" : {
+                name: {"objects" : objects, "bytes" : size}
+                for name, (objects, size) in sorted(self.storage_classes.items())
+            },
+            "histogram" : [
+                {"from" : low, "to" : high, "objects" : objects}
+                for low, high, objects in self.histogram_ranges()
+            ],
+            "largest" : [
+                {"key" : key, "size" : size}
+                for size, key in self.largest_objects()
+            ],
+        }
+
+
+
+
+def human_bytes(size: float) -> str:
+    """_Put a number of bytes in a form people can read, e.g. "1.5 GiB"._"""
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if size < 1024 or unit == "TiB":
+            break
+        size /= 1024
+
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
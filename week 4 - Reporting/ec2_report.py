@@ -5,7 +5,10 @@ Instances. Report includes InstanceId, InstanceType, State, PublicIpAddress,
 Monitoring, and Name.
 '''
 
-import boto3, csv
+import argparse
+import csv
+
+from common import clients, paginate
 
 
 
@@ -29,12 +32,7 @@ def get_instances(name: str, value: str) -> list:
     assert isinstance(value, str), 'value should be a str!'
 
     # Let's create a client to interface with the EC2 service.
-    client = boto3.client('ec2')
-
-    # we want to call EC2.client.describe_instances(), but there is going to
-    # be too much data; we are going to invoke that through a paginator to 
-    # get it in chunks.
-    paginator = client.get_paginator('describe_instances')
+    client = clients.client('ec2')
 
     # Let's construct the filter for our response from AWS.
     pag_filter: list = [
@@ -46,19 +44,19 @@ def get_instances(name: str, value: str) -> list:
         },
     ]
 
-    # Now we can filter the data that we have to only show matching instances.
-    page_list = paginator.paginate(
-        Filters = pag_filter
+    # we want to call EC2.client.describe_instances(), but there is going to
+    # be too much data; we are going to get it in chunks. The next chunk is
+    # already on its way while we look at this one. We only want the
+    # reservation data --not group data.
+    instance_data: list = list(
+        paginate.items(
+            client,
+            'describe_instances',
+            'Reservations',
+            Filters = pag_filter,
+        )
     )
 
-    instance_data: list = []
-
-    # We can take all the pages of filtered instance data and add them to our
-    # output. We also only want to reservation data --not group data.
-    for page in page_list:
-        for reservation in page['Reservations']:
-            instance_data.append(reservation)
-
     return instance_data
 
 
@@ -138,6 +136,14 @@ def get_name(instance_metadata: dict) -> str:
 
 def main():
 
+    # Let's create a parser to handle the arguments passed ot the script. There
+    # aren't any, but it means --help explains what we do instead of doing it.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="EC2 Report",
+        description="Write export.csv of all running EC2 instances",
+    )
+    parser.parse_args()
+
     # Let's get a list of all the metadata of only running instances
     response: list = get_instances('instance-state-name', 'running')
 
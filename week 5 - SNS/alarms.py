@@ -0,0 +1,515 @@
+'''
+Author: Joseph Hopwood
+Description: Module containing CloudWatch alarm functions for whole fleets of
+EC2 instances. Every instance gets its own alarm (named after the instance), and
+syncing only creates, updates or deletes the alarms that actually changed.
+
+Other fleets can share a template, so pruning is opt-in, and only ever deletes
+per-instance alarms: by default those of instances that are gone, or with
+--fleet, those of any instance that has left this fleet.
+
+Example:
+
+python3 cli.py alarms --alarm high --tag env=web
+python3 cli.py alarms --alarm low --tag env=batch --fleet batch --prune
+'''
+
+import argparse
+import concurrent.futures
+
+from common import clients, paginate
+
+# CloudWatch lets us delete at most 100 alarms per call.
+DELETE_BATCH_SIZE: int = 100
+
+# PutMetricAlarm has a low rate limit, so we keep the pool small and let the
+# adaptive retries in botocore smooth things out.
+MAX_WORKERS: int = 4
+
+# The settings of an alarm that we manage. If any of these differ from what
+# we want, the alarm gets updated.
+ALARM_FIELDS: tuple[str, ...] = (
+    'ComparisonOperator',
+    'EvaluationPeriods',
+    'MetricName',
+    'Namespace',
+    'Period',
+    'Statistic',
+    'Threshold',
+    'ActionsEnabled',
+    'AlarmActions',
+    'AlarmDescription',
+    'Dimensions',
+)
+
+
+
+
+def reboot_high_cpu(account_id: str, topic_name: str, region: str) -> dict:
+    """_Alarm template that reboots an instance when the average CPU Util is
+    >= 70% for two data points within 10 minutes, and notifies a topic._
+
+    Args:
+        account_id (str): _ID of the AWS account._
+        topic_name (str): _Name of the SNS topic to notify._
+        region (str): _Region the instances and topic are in._
+
+    Returns:
+        dict: _Alarm settings without a name or dimensions._
+    """
+    return {
+        'ComparisonOperator' : 'GreaterThanOrEqualToThreshold',
+        'EvaluationPeriods' : 2,
+        'MetricName' : 'CPUUtilization',
+        'Namespace' : 'AWS/EC2',
+        'Period' : 300,
+        'Statistic' : 'Average',
+        'Threshold' : 70.0,
+        'ActionsEnabled' : True,
+        'AlarmActions' : [
+            f"arn:aws:swf:{region}:{account_id}:action/actions/AWS_EC2.Insta" \
+            f"nceId.Reboot/1.0",
+            f"arn:aws:sns:{region}:{account_id}:{topic_name}",
+        ],
+        'AlarmDescription' : 'Alarm when server CPU is greater than 70%',
+    }
+
+
+
+
+def stop_low_cpu(account_id: str, topic_name: str, region: str) -> dict:
+    """_Alarm template that stops an instance when the average CPU Util is
+    <= 10% for one data point within 10 minutes, and notifies a topic._
+
+    Args:
+        account_id (str): _ID of the AWS account._
+        topic_name (str): _Name of the SNS topic to notify._
+        region (str): _Region the instances and topic are in._
+
+    Returns:
+        dict: _Alarm settings without a name or dimensions._
+    """
+    return {
+        'ComparisonOperator' : 'LessThanOrEqualToThreshold',
+        'EvaluationPeriods' : 1,
+        'MetricName' : 'CPUUtilization',
+        'Namespace' : 'AWS/EC2',
+        'Period' : 300,
+        'Statistic' : 'Average',
+        'Threshold' : 10.0,
+        'ActionsEnabled' : True,
+        'AlarmActions' : [
+            f"arn:aws:swf:{region}:{account_id}:action/actions/AWS_EC2.Insta" \
+            f"nceId.Stop/1.0",
+            f"arn:aws:sns:{region}:{account_id}:{topic_name}",
+        ],
+        'AlarmDescription' : 'Alarm when server CPU is lower than 10%',
+    }
+
+
+# The templates the command line knows about, and the alarm name prefix of each.
+TEMPLATES: dict[str, tuple] = {
+    'high' : (reboot_high_cpu, 'Web_server_HIGH_CPU_Utilization'),
+    'low' : (stop_low_cpu, 'Web_server_LOW_CPU_Utilization'),
+}
+
+
+
+
+def get_fleet_instance_ids(
+        ec2_client,
+        instance_ids: list[str] = None,
+        tags: dict[str, str] = None
+) -> list[str]:
+    """_Resolve a fleet of instances, either by ID or by tags. Terminated
+    instances are left out._
+
+    Args:
+        ec2_client: _A low level boto3 client for the EC2 service._
+        instance_ids (list[str], optional): _IDs of the instances._
+        tags (dict[str, str], optional): _Tags the instances must all have._
+
+    Returns:
+        list[str]: _IDs of the instances in the fleet._
+    """
+    filters: list[dict] = [
+        {
+            'Name' : 'instance-state-name',
+            'Values' : ['pending', 'running', 'stopping', 'stopped'],
+        },
+    ]
+    for key, value in (tags or {}).items():
+        filters.append({'Name' : f'tag:{key}', 'Values' : [value]})
+
+    kwargs: dict = {'Filters' : filters}
+    if instance_ids:
+        kwargs['InstanceIds'] = instance_ids
+
+    fleet: list[str] = []
+    for reservation in paginate.items(
+        ec2_client, 'describe_instances', 'Reservations', **kwargs
+    ):
+        for instance in reservation['Instances']:
+            fleet.append(instance['InstanceId'])
+
+    return fleet
+
+
+
+
+def alarm_name(prefix: str, instance_id: str) -> str:
+    """_Name of the alarm of a single instance. Each instance gets its own, so
+    a second run never overwrites the alarm of the first._"""
+    return f"{prefix}_{instance_id}"
+
+
+
+
+def desired_alarms(
+        instance_ids: list[str],
+        prefix: str,
+        template: dict
+) -> dict[str, dict]:
+    """_Work out every alarm a fleet should have._
+
+    Args:
+        instance_ids (list[str]): _IDs of the instances in the fleet._
+        prefix (str): _Alarm name prefix of this kind of alarm._
+        template (dict): _Alarm settings, see `reboot_high_cpu()`._
+
+    Returns:
+        dict[str, dict]: _Full `put_metric_alarm()` arguments, keyed by the
+            alarm name._
+    """
+    alarms: dict[str, dict] = {}
+
+    for instance_id in instance_ids:
+        name: str = alarm_name(prefix, instance_id)
+        alarms[name] = dict(
+            template,
+            AlarmName=name,
+            Dimensions=[
+                {
+                    'Name' : 'InstanceId',
+                    'Value' : instance_id
+                },
+            ],
+        )
+
+    return alarms
+
+
+
+
+def alarm_instance_id(alarm: dict) -> str:
+    """_The instance an alarm watches, or None if it doesn't watch one._"""
+    return next(
+        (
+            dimension['Value'] for dimension in alarm.get('Dimensions', [])
+            if dimension['Name'] == 'InstanceId'
+        ),
+        None,
+    )
+
+
+
+
+def get_existing_alarms(cloudwatch_client, prefix: str) -> dict[str, dict]:
+    """_Get every metric alarm that starts with a prefix._
+
+    Args:
+        cloudwatch_client: _A low level boto3 client for CloudWatch._
+        prefix (str): _Alarm name prefix._
+
+    Returns:
+        dict[str, dict]: _Alarm metadata, keyed by the alarm name._
+    """
+    existing: dict[str, dict] = {}
+
+    for alarm in paginate.items(
+        cloudwatch_client,
+        'describe_alarms',
+        'MetricAlarms',
+        AlarmNamePrefix=prefix,
+        AlarmTypes=['MetricAlarm'],
+    ):
+        existing[alarm['AlarmName']] = alarm
+
+    return existing
+
+
+
+
+def _comparable(field: str, value):
+    """_Put a setting in a form where the order of lists doesn't matter._"""
+    if field == 'Dimensions':
+        return sorted((dim['Name'], dim['Value']) for dim in value or [])
+    if field == 'AlarmActions':
+        return sorted(value or [])
+    if field == 'Threshold':
+        return float(value)
+    return value
+
+
+
+
+def prunable_alarms(
+        desired: dict[str, dict],
+        existing: dict[str, dict],
+        prefix: str,
+        ec2_client=None
+) -> list[str]:
+    """_Work out which existing alarms can be deleted. Only the per-instance
+    alarms of this prefix are looked at, so an alarm that merely shares the
+    prefix (like the single alarm reboot_high_ec2.py used to make) is never
+    touched._
+
+    Args:
+        desired (dict[str, dict]): _See `desired_alarms()`._
+        existing (dict[str, dict]): _See `get_existing_alarms()`._
+        prefix (str): _Alarm name prefix of this kind of alarm._
+        ec2_client (optional): _A low level boto3 client for the EC2 service.
+            When given, the alarms of instances that are still up are kept,
+            as they may belong to another fleet with the same template. Leave
+            it out when the prefix belongs to this fleet alone._
+
+    Returns:
+        list[str]: _Names of the alarms that can be deleted._
+    """
+    stale: dict[str, str] = {}
+
+    for name, alarm in existing.items():
+        instance_id: str = alarm_instance_id(alarm)
+        if name not in desired and instance_id is not None \
+                and name == alarm_name(prefix, instance_id):
+            stale[name] = instance_id
+
+    if ec2_client is not None and stale:
+        # Imported here, as teardown.py imports this module.
+        import teardown
+
+        live: set[str] = teardown.get_live_instance_ids(
+            ec2_client, sorted(set(stale.values()))
+        )
+        stale = {
+            name : instance_id for name, instance_id in stale.items()
+            if instance_id not in live
+        }
+
+    return sorted(stale)
+
+
+
+
+def plan_alarm_changes(
+        desired: dict[str, dict],
+        existing: dict[str, dict],
+        prune: list[str] = None
+) -> dict[str, list]:
+    """_Diff the alarms we want against the alarms we have._
+
+    Args:
+        desired (dict[str, dict]): _See `desired_alarms()`._
+        existing (dict[str, dict]): _See `get_existing_alarms()`._
+        prune (list[str], optional): _Names of the alarms that may be
+            deleted, see `prunable_alarms()`. Defaults to deleting none._
+
+    Returns:
+        dict[str, list]: _The changes to make._
+        `
+        {  `<br>`
+            "create" : list[dict],  `<br>`
+            "update" : list[dict],  `<br>`
+            "delete" : list[str],  `<br>`
+        }
+        `
+    """
+    plan: dict[str, list] = {"create" : [], "update" : [], "delete" : []}
+
+    for name, alarm in desired.items():
+        current: dict = existing.get(name)
+
+        if current is None:
+            plan["create"].append(alarm)
+
+        elif any(
+            _comparable(field, alarm.get(field))
+                != _comparable(field, current.get(field))
+            for field in ALARM_FIELDS
+        ):
+            plan["update"].append(alarm)
+
+    plan["delete"] = [
+        name for name in prune or [] if name in existing and name not in desired
+    ]
+
+    return plan
+
+
+
+
+def apply_alarm_changes(
+        cloudwatch_client,
+        plan: dict[str, list],
+        max_workers: int = MAX_WORKERS
+):
+    """_Make the changes of a plan. Alarms are put and deleted concurrently._
+
+    Args:
+        cloudwatch_client: _A low level boto3 client for CloudWatch._
+        plan (dict[str, list]): _See `plan_alarm_changes()`._
+        max_workers (int, optional): _How many calls can be in flight at once.
+            Defaults to `MAX_WORKERS`._
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures: list = []
+
+        # Creating and updating an alarm is the same call.
+        for alarm in plan["create"] + plan["update"]:
+            futures.append(
+                executor.submit(cloudwatch_client.put_metric_alarm, **alarm)
+            )
+
+        for i in range(0, len(plan["delete"]), DELETE_BATCH_SIZE):
+            futures.append(
+                executor.submit(
+                    cloudwatch_client.delete_alarms,
+                    AlarmNames=plan["delete"][i:i + DELETE_BATCH_SIZE],
+                )
+            )
+
+        # Let's make any errors surface here.
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+
+
+
+
+def sync_fleet_alarms(
+        cloudwatch_client,
+        instance_ids: list[str],
+        prefix: str,
+        template: dict,
+        prune: bool = False,
+        ec2_client=None,
+        max_workers: int = MAX_WORKERS
+) -> dict[str, list]:
+    """_Make the alarms of a fleet match a template, touching only the alarms
+    that need it._
+
+    Args:
+        cloudwatch_client: _A low level boto3 client for CloudWatch._
+        instance_ids (list[str]): _IDs of the instances in the fleet._
+        prefix (str): _Alarm name prefix of this kind of alarm._
+        template (dict): _Alarm settings, see `reboot_high_cpu()`._
+        prune (bool, optional): _Delete the alarms of instances that aren't in
+            the fleet anymore, see `prunable_alarms()`. Defaults to False._
+        ec2_client (optional): _A low level boto3 client for the EC2 service.
+            When given, only the alarms of instances that are gone are
+            deleted. Defaults to deleting every alarm under the prefix that
+            isn't desired, for prefixes that belong to this fleet alone._
+        max_workers (int, optional): _How many calls can be in flight at once.
+            Defaults to `MAX_WORKERS`._
+
+    Returns:
+        dict[str, list]: _The changes that were made, see
+            `plan_alarm_changes()`._
+    """
+    desired: dict[str, dict] = desired_alarms(instance_ids, prefix, template)
+    existing: dict[str, dict] = get_existing_alarms(cloudwatch_client, prefix)
+
+    plan: dict[str, list] = plan_alarm_changes(
+        desired,
+        existing,
+        prunable_alarms(desired, existing, prefix, ec2_client) if prune else [],
+    )
+    apply_alarm_changes(cloudwatch_client, plan, max_workers)
+
+    return plan
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Fleet Alarm Manager",
+        description="Sync per-instance CPU alarms for a fleet of instances",
+    )
+    parser.add_argument(
+        "-a", "--alarm",
+        choices=TEMPLATES.keys(),
+        required=True,
+        help="Which alarm the fleet should have",
+    )
+    parser.add_argument(
+        "-i", "--instance-ids",
+        nargs="+",
+        help="IDs of the instances in the fleet",
+    )
+    parser.add_argument(
+        "-t", "--tag",
+        action="append",
+        default=[],
+        help="Key=Value tag the instances in the fleet have. Can be repeated",
+    )
+    parser.add_argument(
+        "-n", "--topic-name",
+        default="ExampleTopic",
+        help="Name of the SNS topic to notify",
+    )
+    parser.add_argument(
+        "-f", "--fleet",
+        help="Name of the fleet, put in its alarm names. Its alarms then "
+            "belong to it alone",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Delete the alarms of instances that have left the fleet. "
+            "Without --fleet, only those of instances that are gone",
+    )
+    args = parser.parse_args()
+
+    if not args.instance_ids and not args.tag:
+        parser.error("Give the fleet with --instance-ids and/or --tag")
+
+    tags: dict[str, str] = dict(tag.split("=", 1) for tag in args.tag)
+
+    # Let's get our account ID and region for the alarm actions.
+    account_id: str = clients.client('sts').get_caller_identity()['Account']
+    ec2_client = clients.client('ec2')
+    cloudwatch_client = clients.client('cloudwatch')
+    region: str = cloudwatch_client.meta.region_name
+
+    template_function, prefix = TEMPLATES[args.alarm]
+
+    # A fleet with a name of its own gets a prefix of its own, so every alarm
+    # under it is ours to prune. Otherwise, other fleets may share the prefix.
+    if args.fleet:
+        prefix = alarm_name(prefix, args.fleet)
+
+    instance_ids: list[str] = get_fleet_instance_ids(
+        ec2_client, args.instance_ids, tags
+    )
+
+    plan: dict[str, list] = sync_fleet_alarms(
+        cloudwatch_client,
+        instance_ids,
+        prefix,
+        template_function(account_id, args.topic_name, region),
+        prune=args.prune,
+        ec2_client=None if args.fleet else ec2_client,
+    )
+
+    print(f"Fleet of {len(instance_ids)} instance(s):")
+    print(f" - created: {len(plan['create'])}")
+    print(f" - updated: {len(plan['update'])}")
+    print(f" - deleted: {len(plan['delete'])}")
+
+
+
+
+if __name__ == "__main__":
+    main()
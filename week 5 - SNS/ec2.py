@@ -3,8 +3,6 @@ Author: Joseph Hopwood
 Description: Module containing EC2 functions
 '''
 
-import boto3, botocore, botocore.exceptions
-
 
 
 
@@ -53,28 +51,45 @@ def get_image(ec2_client) -> str:
 
 
 
-def create_ec2(
+def create_ec2_fleet(
         ec2_client,
         ami_id: str,
+        instance_type: str = 't2.micro',
+        count: int = 1,
+        min_count: int = None,
+        availability_zone: str = None,
         dryrun: bool = True
-) -> str:
-    """_Create a t2.micro EC2 instance. Hardcoded SG,SSH,userdata values._
+) -> list[dict]:
+    """_Create EC2 instances of any type, in one call. Hardcoded SG,SSH,
+    userdata values._
 
     Args:
         ec2_client: _An established client interface with AWS EC2 Service._
-        ami_id (str): _The ID of the AMI that the instance will run._
+        ami_id (str): _The ID of the AMI that the instances will run._
+        instance_type (str, optional): _Type of the instances. Defaults to
+            t2.micro._
+        count (int, optional): _How many instances we want. Defaults to 1._
+        min_count (int, optional): _How many instances we take at least. If
+            EC2 doesn't have the capacity for that many, none are created.
+            Defaults to all of them._
+        availability_zone (str, optional): _Availability zone to create them
+            in. Defaults to wherever EC2 likes._
         dryrun (bool, optional): _Dry run switch for testing. Defaults to True._
 
     Returns:
-        str: _The ID of the EC2 Instance that was created._
+        list[dict]: _Instance metadata, as found in `response["Instances"]` of
+            a `EC2.client.run_instances()` call._
     """
+    kwargs: dict = {}
+    if availability_zone:
+        kwargs['Placement'] = {'AvailabilityZone' : availability_zone}
 
-    # Let's create a (single) t2.micro instance and store the response.
+    # Let's create the instances and store the response.
     response: dict = ec2_client.run_instances(
         ImageId = ami_id,
-        InstanceType = 't2.micro',
-        MaxCount = 1,
-        MinCount = 1,
+        InstanceType = instance_type,
+        MaxCount = count,
+        MinCount = count if min_count is None else min_count,
         DryRun = dryrun,
         SecurityGroups=['WebSG'],
         KeyName='vockey',
@@ -89,11 +104,42 @@ def create_ec2(
             wget https://aws-tc-largeobjects.s3-us-west-2.amazonaws.com/CUR-TF-100-ACCLFO-2/lab6-scaling/lab-app.zip
             unzip lab-app.zip -d /var/www/html/
             chown apache:root /var/www/html/rds.conf.php''',
+        **kwargs,
+    )
+
+    return response['Instances']
+
+
+
+
+def create_ec2(
+        ec2_client,
+        ami_id: str,
+        dryrun: bool = True,
+        instance_type: str = 't2.micro'
+) -> str:
+    """_Create an EC2 instance, a t2.micro unless told otherwise. Hardcoded
+    SG,SSH,userdata values._
+
+    Args:
+        ec2_client: _An established client interface with AWS EC2 Service._
+        ami_id (str): _The ID of the AMI that the instance will run._
+        dryrun (bool, optional): _Dry run switch for testing. Defaults to True._
+        instance_type (str, optional): _Type of the instance. Defaults to
+            t2.micro._
+
+    Returns:
+        str: _The ID of the EC2 Instance that was created._
+    """
+
+    # Let's create a (single) instance.
+    instances: list[dict] = create_ec2_fleet(
+        ec2_client, ami_id, instance_type, dryrun=dryrun
     )
 
     # Okay, hopefully it was created successfully, now we are going to extract
     # the ID of it from the response. 
-    instance_id: str = response['Instances'][0]['InstanceId']
+    instance_id: str = instances[0]['InstanceId']
 
     return instance_id
 
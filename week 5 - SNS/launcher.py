@@ -0,0 +1,475 @@
+'''
+Author: Joseph Hopwood
+Description: Module for launching EC2 instances when capacity is tight.
+Instead of one hardcoded instance type that fails outright when EC2 is out of
+it, the launcher takes instance types and availability zones ranked best
+first, and moves on to the next candidate the moment one is out of capacity.
+Each candidate is asked for whatever is still missing, and takes what it can
+give, so a big launch can be spread over a few of them. With --parallel, every
+candidate is tried at once: the first to come back with capacity wins, the
+candidates that haven't started yet are cancelled, and any instances past the
+count we asked for are terminated straight away. A candidate that fails for
+any other reason (say, an arm64 type for an x86 AMI) is recorded and skipped,
+so what the others launched is never lost. Every attempt is timed, as is the
+time until the whole launch is running.
+
+Example:
+
+python3 cli.py launch --types m5.large m5a.large c5.large --count 50
+python3 cli.py launch --types t3.micro t3a.micro --zones us-east-1a us-east-1b --parallel
+'''
+
+import argparse
+import concurrent.futures
+import json
+import time
+
+from common import clients
+
+import ec2
+import teardown
+
+# Errors that only mean this candidate can't be had right now, so we move on
+# to the next one. Anything else is wrong with the request itself.
+CAPACITY_CODES: frozenset = frozenset({
+    "InsufficientInstanceCapacity",
+    "InsufficientHostCapacity",
+    "InsufficientReservedInstanceCapacity",
+    "InstanceLimitExceeded",
+    "Unsupported",
+    "VcpuLimitExceeded",
+})
+
+# How many candidates are tried at once with --parallel.
+MAX_WORKERS: int = 8
+
+# How long we wait for the launch to be running, and between polls, in
+# seconds. The poll matches the instance_running waiter of boto3.
+POLL_SECONDS: float = 15.0
+DEFAULT_TIMEOUT: float = 600.0
+
+# Right after a launch, EC2 may not know about the new instances yet, and
+# won't terminate them. How many times we try, and how long we wait before
+# the first retry (doubling every time).
+TERMINATE_ATTEMPTS: int = 4
+TERMINATE_RETRY_SECONDS: float = 2.0
+
+
+
+
+def rank_candidates(
+        instance_types: list[str],
+        zones: list[str] = None
+) -> list[tuple[str, str]]:
+    """_Put every instance type in every zone, best first. The instance type
+    matters more than the zone, so all zones of the best type come first._
+
+    Args:
+        instance_types (list[str]): _Instance types, best first._
+        zones (list[str], optional): _Availability zones, best first. Defaults
+            to wherever EC2 likes._
+
+    Returns:
+        list[tuple[str, str]]: _(instance type, zone) of every candidate. The
+            zone is None when EC2 picks it._
+    """
+    return [
+        (instance_type, zone)
+        for instance_type in instance_types
+        for zone in zones or [None]
+    ]
+
+
+
+
+def try_candidate(
+        ec2_client,
+        ami_id: str,
+        candidate: tuple[str, str],
+        count: int,
+        dryrun: bool = False
+) -> dict:
+    """_Try to launch instances of one candidate. Whatever capacity it has, up
+    to the count, is taken. Nothing it runs into is raised: the error is
+    recorded in the attempt, and the launch moves on to the next candidate._
+
+    Args:
+        ec2_client: _A low level boto3 client for the EC2 service._
+        ami_id (str): _The ID of the AMI that the instances will run._
+        candidate (tuple[str, str]): _(instance type, zone), see
+            `rank_candidates()`._
+        count (int): _How many instances we want at most._
+        dryrun (bool, optional): _Dry run switch for testing. Defaults to
+            False._
+
+    Returns:
+        dict: _How it went._
+        `
+        {  `<br>`
+            "instance_type" : str,  `<br>`
+            "zone" : str,  `<br>`
+            "instance_ids" : list[str],  `<br>`
+            "code" : str, the error code, or None  `<br>`
+            "error" : str, the error message, or None  `<br>`
+            "seconds" : float,  `<br>`
+        }
+        `
+    """
+    instance_type, zone = candidate
+    attempt: dict = {
+        "instance_type" : instance_type,
+        "zone" : zone,
+        "instance_ids" : [],
+        "code" : None,
+        "error" : None,
+        "seconds" : 0.0,
+    }
+
+    start: float = time.monotonic()
+    try:
+        instances: list[dict] = ec2.create_ec2_fleet(
+            ec2_client, ami_id, instance_type, count, 1, zone, dryrun
+        )
+        attempt["instance_ids"] = [
+            instance["InstanceId"] for instance in instances
+        ]
+    except Exception as error:
+        # A successful dry run still comes back as an "error", with the code
+        # "DryRunOperation". Anything that isn't a ClientError (a dropped
+        # connection, say) goes by its type.
+        if isinstance(error, clients.client_error()):
+            attempt["code"] = error.response["Error"]["Code"]
+            attempt["error"] = error.response["Error"].get("Message")
+        else:
+            attempt["code"] = type(error).__name__
+            attempt["error"] = str(error)
+
+    attempt["seconds"] = time.monotonic() - start
+    return attempt
+
+
+
+
+def terminate_extras(
+        ec2_client,
+        instance_ids: list[str],
+        attempts: int = TERMINATE_ATTEMPTS,
+        retry_seconds: float = TERMINATE_RETRY_SECONDS
+) -> list[str]:
+    """_Terminate instances we only just launched. EC2 is eventually
+    consistent, so it can answer that they don't exist yet
+    (InvalidInstanceID.NotFound). Those are tried again, with backoff._
+
+    Args:
+        ec2_client: _A low level boto3 client for the EC2 service._
+        instance_ids (list[str]): _IDs of the instances._
+        attempts (int, optional): _How many times to try. Defaults to
+            TERMINATE_ATTEMPTS._
+        retry_seconds (float, optional): _Seconds before the first retry.
+            Defaults to TERMINATE_RETRY_SECONDS._
+
+    Returns:
+        list[str]: _IDs of the instances that are still left, and need to be
+            terminated by hand. Empty if all of them are terminating._
+    """
+    remaining: list[str] = list(instance_ids)
+    protected: list[str] = []
+
+    for number in range(attempts):
+        if not remaining:
+            break
+        if number:
+            time.sleep(retry_seconds * 2 ** (number - 1))
+
+        result: dict[str, list] = teardown.terminate_fleet(ec2_client, remaining)
+        protected.extend(result["protected"])
+        remaining = result["missing"]
+
+    return sorted(protected + remaining)
+
+
+
+
+def launch(
+        ec2_client,
+        ami_id: str,
+        candidates: list[tuple[str, str]],
+        count: int = 1,
+        parallel: bool = False,
+        max_workers: int = MAX_WORKERS,
+        dryrun: bool = False
+) -> dict:
+    """_Launch instances from the first candidates that have the capacity._
+
+    Args:
+        ec2_client: _A low level boto3 client for the EC2 service._
+        ami_id (str): _The ID of the AMI that the instances will run._
+        candidates (list[tuple[str, str]]): _See `rank_candidates()`._
+        count (int, optional): _How many instances we want. Defaults to 1._
+        parallel (bool, optional): _Try every candidate at once, instead of one
+            after another. Defaults to False._
+        max_workers (int, optional): _How many candidates are tried at once
+            when in parallel. Defaults to `MAX_WORKERS`._
+        dryrun (bool, optional): _Dry run switch for testing. The first
+            candidate that passes the dry run wins. Defaults to False._
+
+    Returns:
+        dict: _How it went._
+        `
+        {  `<br>`
+            "instances" : list[dict], the ID, type and zone of every instance  `<br>`
+            "attempts" : list[dict], see `try_candidate()`  `<br>`
+            "cancelled" : list[str], IDs of the instances we had too many of  `<br>`
+            "leftover" : list[str], of those, the ones we couldn't terminate  `<br>`
+            "first_seconds" : float, until the first instance was launched  `<br>`
+            "seconds" : float, until the last one was  `<br>`
+        }
+        `
+    """
+    result: dict = {
+        "instances" : [],
+        "attempts" : [],
+        "cancelled" : [],
+        "leftover" : [],
+        "first_seconds" : None,
+        "seconds" : None,
+    }
+    start: float = time.monotonic()
+
+    def take(attempt: dict) -> bool:
+        """Keep what an attempt launched, up to the count. Returns whether the
+        launch is done."""
+        result["attempts"].append(attempt)
+        wanted: int = count - len(result["instances"])
+
+        for instance_id in attempt["instance_ids"][:wanted]:
+            result["instances"].append({
+                "InstanceId" : instance_id,
+                "InstanceType" : attempt["instance_type"],
+                "AvailabilityZone" : attempt["zone"],
+            })
+        result["cancelled"].extend(attempt["instance_ids"][wanted:])
+
+        if attempt["instance_ids"] and result["first_seconds"] is None:
+            result["first_seconds"] = time.monotonic() - start
+
+        return len(result["instances"]) == count or (
+            dryrun and attempt["code"] == "DryRunOperation"
+        )
+
+    # FAST SUCCESSION - every candidate gets asked for what's still missing.
+    if not parallel:
+        for candidate in candidates:
+            wanted: int = count - len(result["instances"])
+            if take(try_candidate(ec2_client, ami_id, candidate, wanted, dryrun)):
+                break
+
+    # PARALLEL - every candidate gets asked for the whole count at once.
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures: list = [
+                executor.submit(
+                    try_candidate, ec2_client, ami_id, candidate, count, dryrun
+                )
+                for candidate in candidates
+            ]
+            done: bool = False
+
+            for future in concurrent.futures.as_completed(futures):
+                if future.cancelled():
+                    continue
+
+                # Once we have them all, any candidate that hasn't started
+                # yet doesn't need to. Ones that already did may still launch
+                # some, and those are cancelled too when they come back. A
+                # candidate never raises, so every one of them comes back.
+                if take(future.result()) and not done:
+                    done = True
+                    for pending in futures:
+                        pending.cancel()
+
+    if result["instances"]:
+        result["seconds"] = time.monotonic() - start
+
+    # Let's not pay for the instances we had too many of.
+    if result["cancelled"] and not dryrun:
+        result["leftover"] = terminate_extras(ec2_client, result["cancelled"])
+
+    return result
+
+
+
+
+def wait_until_running(
+        ec2_client,
+        instance_ids: list[str],
+        timeout: float = DEFAULT_TIMEOUT,
+        poll_seconds: float = POLL_SECONDS
+) -> dict[str, list]:
+    """_Wait for a whole launch to be running, with one poll loop. Every poll
+    only asks about the instances that weren't running yet the last time.
+    An instance EC2 doesn't know about yet is still pending, and one that
+    went anywhere but running (like pending to terminated) has failed._
+
+    Args:
+        ec2_client: _A low level boto3 client for the EC2 service._
+        instance_ids (list[str]): _IDs of the instances._
+        timeout (float, optional): _Seconds to wait at most. Defaults to
+            DEFAULT_TIMEOUT._
+        poll_seconds (float, optional): _Seconds between polls. Defaults to
+            POLL_SECONDS._
+
+    Returns:
+        dict[str, list]: _IDs of the instances still pending when we stopped
+            waiting under "pending", and of the ones that failed under
+            "failed". Both empty if the whole launch is running._
+    """
+    deadline: float = time.monotonic() + timeout
+    remaining: list[str] = sorted(instance_ids)
+    failed: list[str] = []
+
+    while remaining:
+        states: dict[str, str] = teardown.get_instance_states(
+            ec2_client, remaining
+        )
+        failed.extend(
+            instance_id for instance_id in remaining
+            if states.get(instance_id, 'pending') not in ('pending', 'running')
+        )
+        remaining = [
+            instance_id for instance_id in remaining
+            if states.get(instance_id, 'pending') == 'pending'
+        ]
+        if not remaining or time.monotonic() + poll_seconds > deadline:
+            break
+        time.sleep(poll_seconds)
+
+    return {"pending" : remaining, "failed" : sorted(failed)}
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Capacity Aware Launcher",
+        description="Launch instances from the first instance types and zones "
+            "that have the capacity",
+    )
+    parser.add_argument(
+        "-t", "--types",
+        nargs="+",
+        default=["t2.micro"],
+        help="Instance types to try, best first. Defaults to t2.micro",
+    )
+    parser.add_argument(
+        "-z", "--zones",
+        nargs="+",
+        help="Availability zones to try, best first. Defaults to any",
+    )
+    parser.add_argument(
+        "-n", "--count",
+        type=int,
+        default=1,
+        help="How many instances to launch. Defaults to 1",
+    )
+    parser.add_argument(
+        "-p", "--parallel",
+        action="store_true",
+        help="Try every candidate at once instead of one after another",
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=MAX_WORKERS,
+        help=f"Candidates tried at once with --parallel. Defaults to {MAX_WORKERS}",
+    )
+    parser.add_argument(
+        "--no-wait",
+        action="store_true",
+        help="Don't wait for the instances to be running",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help=f"Seconds to wait at most. Defaults to {DEFAULT_TIMEOUT:g}",
+    )
+    parser.add_argument(
+        "-j", "--json",
+        type=str,
+        help="Also write the instances and timings to this JSON file",
+    )
+    parser.add_argument(
+        "--dryrun",
+        action="store_true",
+        help="Only dry run the launch",
+    )
+    args = parser.parse_args()
+
+    ec2_client = clients.client('ec2')
+
+    # Let's retrieve the latest Amzon Linux 2 AMI version's ID.
+    ami_id: str = ec2.get_image(ec2_client)
+
+    start: float = time.monotonic()
+    result: dict = launch(
+        ec2_client,
+        ami_id,
+        rank_candidates(args.types, args.zones),
+        args.count,
+        args.parallel,
+        args.workers,
+        args.dryrun,
+    )
+
+    instance_ids: list[str] = [
+        instance["InstanceId"] for instance in result["instances"]
+    ]
+    result["pending"] = []
+    result["failed"] = []
+    result["running_seconds"] = None
+    if instance_ids and not args.no_wait:
+        result.update(wait_until_running(ec2_client, instance_ids, args.timeout))
+        if not result["pending"] and not result["failed"]:
+            result["running_seconds"] = time.monotonic() - start
+
+    print("Attempts:")
+    for attempt in result["attempts"]:
+        print(f"  {attempt['instance_type']:<16}{attempt['zone'] or 'any':<16}"
+            f"{attempt['code'] or 'ok':<38}{len(attempt['instance_ids']):>6} "
+            f"{attempt['seconds']:>7.2f}s")
+        if attempt["code"] not in (None, "DryRunOperation") \
+                and attempt["code"] not in CAPACITY_CODES:
+            print(f"    {attempt['error']}")
+
+    print(f"Launched {len(instance_ids)} of {args.count} instance(s), "
+        f"cancelled {len(result['cancelled'])}")
+    for name, label in (
+        ("first_seconds", "first instance"),
+        ("seconds", "all instances"),
+        ("running_seconds", "all running"),
+    ):
+        if result[name] is not None:
+            print(f" - {label}: {result[name]:.2f}s")
+    if result["pending"]:
+        print(f" - still pending: {len(result['pending'])}")
+    for name, label in (
+        ("failed", "failed to start"),
+        ("leftover", "extra, but not terminated, terminate these by hand"),
+    ):
+        if result[name]:
+            print(f" - {label}: {len(result[name])}")
+            for instance_id in result[name]:
+                print(f"   {instance_id}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(result, file, indent=2)
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+'''
+Author: Joseph Hopwood
+Description: Module containing CloudWatch metric functions for whole fleets of
+EC2 instances. Metrics are pulled with `get_metric_data`, up to 500 metrics per
+call, and summarized per instance with NumPy. Run on its own, it writes out a
+right-sizing report 'rightsizing.csv' of all running EC2 instances, to go along
+with the 'export.csv' of the reporting script.
+'''
+
+import argparse
+import concurrent.futures
+import csv
+import datetime
+import warnings
+
+# NumPy is imported in the functions that use it, so that --help never pays
+# for it.
+
+from common import clients, paginate
+
+# get_metric_data accepts at most 500 metric queries per call.
+MAX_QUERIES_PER_CALL: int = 500
+
+# How many get_metric_data calls we make at the same time.
+MAX_WORKERS: int = 4
+
+# The metrics we collect by default, and the statistic of each.
+DEFAULT_METRICS: dict[str, str] = {
+    'CPUUtilization' : 'Average',
+    'NetworkIn' : 'Sum',
+    'NetworkOut' : 'Sum',
+    'DiskReadBytes' : 'Sum',
+    'DiskWriteBytes' : 'Sum',
+}
+
+# The percentiles we summarize every metric with.
+PERCENTILES: tuple[int, ...] = (50, 95, 99)
+
+# Thresholds of the right-sizing recommendations.
+IDLE_CPU_P95: float = 5.0
+IDLE_NETWORK_P95: float = 1024 * 1024
+OVERSIZED_CPU_P95: float = 20.0
+UNDERSIZED_CPU_P99: float = 90.0
+
+
+
+
+class FleetMetrics:
+    """
+    Metric data of a fleet of instances, lined up on a shared time grid. Every
+    metric is a 2D array with one row per instance and one column per period.
+    Periods without data are NaN. When each datapoint was actually taken is
+    kept alongside, since the grid starts wherever the time range does.
+    """
+
+
+    def __init__(
+            self,
+            instance_ids: list[str],
+            start: datetime.datetime,
+            end: datetime.datetime,
+            period: int
+    ):
+        """Initialize an empty set of metrics.
+
+        Args:
+            instance_ids (list[str]): IDs of the instances, in row order.
+            start (datetime.datetime): Start of the first period.
+            end (datetime.datetime): End of the last period.
+            period (int): Length of a period, in seconds.
+        """
+        self.instance_ids: list[str] = list(instance_ids)
+        self.rows: dict[str, int] = {
+            instance_id: row for row, instance_id in enumerate(self.instance_ids)
+        }
+        self.start: datetime.datetime = start
+        self.period: int = period
+        self.periods: int = max(int((end - start).total_seconds()) // period, 1)
+        self.values: dict[str, numpy.ndarray] = {}
+        self.times: dict[str, numpy.ndarray] = {}
+
+
+    def metric(self, metric_name: str) -> "numpy.ndarray":
+        """Get the array of a metric, creating it if it is new."""
+        import numpy
+
+        if metric_name not in self.values:
+            self.values[metric_name] = numpy.full(
+                (len(self.instance_ids), self.periods), numpy.nan
+            )
+        return self.values[metric_name]
+
+
+    def taken(self, metric_name: str) -> "numpy.ndarray":
+        """Get when every datapoint of a metric was taken, in seconds since
+        the epoch, in the same shape as its array. NaN where there is none."""
+        import numpy
+
+        if metric_name not in self.times:
+            self.times[metric_name] = numpy.full(
+                (len(self.instance_ids), self.periods), numpy.nan
+            )
+        return self.times[metric_name]
+
+
+    def add(
+            self,
+            instance_id: str,
+            metric_name: str,
+            timestamps: list[datetime.datetime],
+            values: list[float]
+    ):
+        """Drop a series of datapoints into the grid."""
+        import numpy
+
+        if not timestamps:
+            return
+
+        seconds: numpy.ndarray = numpy.fromiter(
+            (timestamp.timestamp() for timestamp in timestamps),
+            dtype=float,
+            count=len(timestamps),
+        )
+        columns: numpy.ndarray = (
+            (seconds - self.start.timestamp()) // self.period
+        ).astype(int)
+
+        # Anything that lands outside of the grid is dropped.
+        inside: numpy.ndarray = (columns >= 0) & (columns < self.periods)
+        row: int = self.rows[instance_id]
+        self.metric(metric_name)[row, columns[inside]] = (
+            numpy.asarray(values, dtype=float)[inside]
+        )
+        self.taken(metric_name)[row, columns[inside]] = seconds[inside]
+
+
+    def percentiles(self, metric_name: str) -> "dict[str, numpy.ndarray]":
+        """Summarize a metric per instance, for the whole fleet at once.
+
+        Args:
+            metric_name (str): Name of the metric.
+
+        Returns:
+            dict[str, numpy.ndarray]: Arrays with one value per instance, keyed
+                by "p50", "p95", "p99", "max" and "mean". Instances without any
+                data get NaN.
+        """
+        import numpy
+
+        values: numpy.ndarray = self.metric(metric_name)
+
+        # Instances without data would make NumPy complain about empty slices.
+        # NaN is exactly the answer we want for them, so let's keep it quiet.
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            summary: dict[str, numpy.ndarray] = {
+                f"p{percentile}" : result
+                for percentile, result in zip(
+                    PERCENTILES,
+                    numpy.nanpercentile(values, PERCENTILES, axis=1),
+                )
+            }
+            summary["max"] = numpy.nanmax(values, axis=1)
+            summary["mean"] = numpy.nanmean(values, axis=1)
+
+        return summary
+
+
+
+
+def build_queries(
+        instance_ids: list[str],
+        metrics: dict[str, str],
+        period: int
+) -> tuple[list[dict], dict[str, tuple[str, str]]]:
+    """_Build a metric query for every metric of every instance._
+
+    Args:
+        instance_ids (list[str]): _IDs of the instances._
+        metrics (dict[str, str]): _Metric names and their statistics._
+        period (int): _Length of a period, in seconds._
+
+    Returns:
+        tuple[list[dict], dict[str, tuple[str, str]]]: _The queries, and which
+            (instance ID, metric name) each query ID stands for._
+    """
+    queries: list[dict] = []
+    lookup: dict[str, tuple[str, str]] = {}
+
+    for instance_id in instance_ids:
+        for metric_name, statistic in metrics.items():
+
+            # Query IDs have to start with a lowercase letter.
+            query_id: str = f"q{len(queries)}"
+            lookup[query_id] = (instance_id, metric_name)
+
+            queries.append({
+                'Id' : query_id,
+                'MetricStat' : {
+                    'Metric' : {
+                        'Namespace' : 'AWS/EC2',
+                        'MetricName' : metric_name,
+                        'Dimensions' : [
+                            {
+                                'Name' : 'InstanceId',
+                                'Value' : instance_id
+                            },
+                        ],
+                    },
+                    'Period' : period,
+                    'Stat' : statistic,
+                },
+                'ReturnData' : True,
+            })
+
+    return queries, lookup
+
+
+
+
+def _fetch_chunk(
+        cloudwatch_client,
+        queries: list[dict],
+        start: datetime.datetime,
+        end: datetime.datetime
+) -> list[dict]:
+    """_Run up to 500 metric queries, through every page of results._"""
+    results: list[dict] = []
+
+    results.extend(
+        paginate.items(
+            cloudwatch_client,
+            'get_metric_data',
+            'MetricDataResults',
+            MetricDataQueries=queries,
+            StartTime=start,
+            EndTime=end,
+            ScanBy='TimestampAscending',
+        )
+    )
+
+    return results
+
+
+
+
+def collect_fleet_metrics(
+        cloudwatch_client,
+        instance_ids: list[str],
+        start: datetime.datetime,
+        end: datetime.datetime,
+        period: int = 300,
+        metrics: dict[str, str] = None,
+        max_workers: int = MAX_WORKERS
+) -> FleetMetrics:
+    """_Collect metrics for a whole fleet, 500 metrics per call._
+
+    Args:
+        cloudwatch_client: _A low level boto3 client for CloudWatch._
+        instance_ids (list[str]): _IDs of the instances._
+        start (datetime.datetime): _Start of the time range (timezone aware)._
+        end (datetime.datetime): _End of the time range (timezone aware)._
+        period (int, optional): _Length of a period, in seconds. Defaults to
+            300._
+        metrics (dict[str, str], optional): _Metric names and their statistics.
+            Defaults to `DEFAULT_METRICS`._
+        max_workers (int, optional): _How many calls can be in flight at once.
+            Defaults to `MAX_WORKERS`._
+
+    Returns:
+        FleetMetrics: _The collected metrics._
+    """
+    queries, lookup = build_queries(
+        instance_ids, metrics or DEFAULT_METRICS, period
+    )
+    fleet_metrics: FleetMetrics = FleetMetrics(instance_ids, start, end, period)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures: list = [
+            executor.submit(
+                _fetch_chunk,
+                cloudwatch_client,
+                queries[i:i + MAX_QUERIES_PER_CALL],
+                start,
+                end,
+            )
+            for i in range(0, len(queries), MAX_QUERIES_PER_CALL)
+        ]
+
+        for future in concurrent.futures.as_completed(futures):
+            for result in future.result():
+                instance_id, metric_name = lookup[result['Id']]
+                fleet_metrics.add(
+                    instance_id,
+                    metric_name,
+                    result['Timestamps'],
+                    result['Values'],
+                )
+
+    return fleet_metrics
+
+
+
+
+def recommend(fleet_metrics: FleetMetrics) -> "numpy.ndarray":
+    """_Work out a right-sizing recommendation for every instance at once._
+
+    Args:
+        fleet_metrics (FleetMetrics): _Metrics that include CPUUtilization,
+            NetworkIn and NetworkOut._
+
+    Returns:
+        numpy.ndarray: _One of "idle", "oversized", "undersized", "ok" or
+            "no data" per instance._
+    """
+    import numpy
+
+    cpu: dict[str, numpy.ndarray] = fleet_metrics.percentiles('CPUUtilization')
+
+    # Network traffic in both directions, added up per period.
+    network: numpy.ndarray = numpy.nan_to_num(
+        fleet_metrics.metric('NetworkIn')
+    ) + numpy.nan_to_num(fleet_metrics.metric('NetworkOut'))
+    network_p95: numpy.ndarray = numpy.percentile(network, 95, axis=1)
+
+    # The first condition that matches wins, so the order matters here.
+    return numpy.select(
+        [
+            numpy.isnan(cpu["p95"]),
+            (cpu["p95"] < IDLE_CPU_P95) & (network_p95 < IDLE_NETWORK_P95),
+            cpu["p99"] > UNDERSIZED_CPU_P99,
+            cpu["p95"] < OVERSIZED_CPU_P95,
+        ],
+        ["no data", "idle", "undersized", "oversized"],
+        default="ok",
+    )
+
+
+
+
+def get_running_instances(ec2_client) -> list[dict]:
+    """_Get the metadata of every running instance on the account._
+
+    Args:
+        ec2_client: _A low level boto3 client for the EC2 service._
+
+    Returns:
+        list[dict]: _Instance metadata, as found in the reservations of a
+            `EC2.client.describe_instances()` call._
+    """
+    instances: list[dict] = []
+
+    for reservation in paginate.items(
+        ec2_client,
+        'describe_instances',
+        'Reservations',
+        Filters=[
+            {
+                'Name' : 'instance-state-name',
+                'Values' : ['running'],
+            },
+        ],
+    ):
+        instances.extend(reservation['Instances'])
+
+    return instances
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Right-Sizing Report",
+        description="Write out rightsizing.csv for all running EC2 instances",
+    )
+    parser.add_argument(
+        "-d", "--days",
+        type=int,
+        default=14,
+        help="How many days of metrics to look at. Defaults to 14",
+    )
+    parser.add_argument(
+        "-p", "--period",
+        type=int,
+        default=300,
+        help="Length of a period in seconds. Defaults to 300",
+    )
+    args = parser.parse_args()
+
+    ec2_client = clients.client('ec2')
+    cloudwatch_client = clients.client(
+        'cloudwatch', max_pool_connections=MAX_WORKERS
+    )
+
+    instances: list[dict] = get_running_instances(ec2_client)
+
+    end: datetime.datetime = datetime.datetime.now(datetime.timezone.utc)
+    start: datetime.datetime = end - datetime.timedelta(days=args.days)
+
+    fleet_metrics: FleetMetrics = collect_fleet_metrics(
+        cloudwatch_client,
+        [instance['InstanceId'] for instance in instances],
+        start,
+        end,
+        args.period,
+    )
+
+    cpu: dict[str, numpy.ndarray] = fleet_metrics.percentiles('CPUUtilization')
+    recommendations: numpy.ndarray = recommend(fleet_metrics)
+
+    # Let's define the titles of the columns in the csv
+    header: list = [
+        'InstanceId',
+        'InstanceType',
+        'CpuP50',
+        'CpuP95',
+        'CpuP99',
+        'CpuMax',
+        'Recommendation',
+    ]
+
+    with open('rightsizing.csv', 'w') as file:
+        writer = csv.DictWriter(file, fieldnames=header)
+        writer.writeheader()
+
+        for row, instance in enumerate(instances):
+            writer.writerow({
+                'InstanceId' : instance['InstanceId'],
+                'InstanceType' : instance['InstanceType'],
+                'CpuP50' : round(float(cpu['p50'][row]), 2),
+                'CpuP95' : round(float(cpu['p95'][row]), 2),
+                'CpuP99' : round(float(cpu['p99'][row]), 2),
+                'CpuMax' : round(float(cpu['max'][row]), 2),
+                'Recommendation' : recommendations[row],
+            })
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+'''
+Author: Joseph Hopwood
+Description: Module containing a digest notifier for SNS. Findings from the
+audit scripts and alarms are deduplicated, rolled up into digest messages, and
+published 10 at a time with `publish_batch`, instead of one message per finding.
+'''
+
+import argparse
+import concurrent.futures
+import json
+import os
+import time
+
+from common import clients, paginate
+from common.findings import finding
+
+import sns
+
+# publish_batch takes at most 10 messages per call...
+PUBLISH_BATCH_SIZE: int = 10
+
+# ...and at most 256 KiB for all of them together. Let's keep each message well
+# under a tenth of that.
+MAX_MESSAGE_BYTES: int = 24 * 1024
+
+# Email subjects are cut off at 100 characters. We count bytes, which is never
+# more than that.
+MAX_SUBJECT_BYTES: int = 100
+
+# How many publish_batch calls we make at the same time.
+MAX_WORKERS: int = 4
+
+# The same finding isn't sent again within this many seconds.
+DEFAULT_DEDUP_WINDOW: int = 60 * 60
+
+
+
+
+
+def findings_from_alarms(cloudwatch_client, prefix: str = None) -> list[dict]:
+    """_Turn every alarm that is currently firing into a finding._
+
+    Args:
+        cloudwatch_client: _A low level boto3 client for CloudWatch._
+        prefix (str, optional): _Only alarms whose name starts with this._
+
+    Returns:
+        list[dict]: _A finding per alarm in the ALARM state._
+    """
+    kwargs: dict = {'StateValue' : 'ALARM', 'AlarmTypes' : ['MetricAlarm']}
+    if prefix:
+        kwargs['AlarmNamePrefix'] = prefix
+
+    findings: list[dict] = []
+    for alarm in paginate.items(
+        cloudwatch_client, 'describe_alarms', 'MetricAlarms', **kwargs
+    ):
+        resource: str = ", ".join(
+            dim['Value'] for dim in alarm.get('Dimensions', [])
+        ) or alarm['AlarmName']
+        findings.append(
+            finding(
+                alarm['AlarmName'],
+                resource,
+                alarm.get('StateReason', 'In ALARM'),
+                "ALARM",
+            )
+        )
+
+    return findings
+
+
+
+
+def _truncate(text: str, max_bytes: int) -> str:
+    """_Cut text down to at most a number of bytes of UTF-8, without splitting
+    a character in two. SNS counts its limits in bytes, not characters._"""
+    encoded: bytes = text.encode('utf-8')
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode('utf-8', errors='ignore')
+
+
+
+
+class Notifier:
+    """
+    Collects findings, drops the ones that were already sent recently, and
+    publishes the rest to a topic as digests.
+    """
+
+
+    def __init__(
+            self,
+            sns_client,
+            topic_arn: str,
+            window: int = DEFAULT_DEDUP_WINDOW,
+            state_path: str = None,
+            max_workers: int = MAX_WORKERS
+    ):
+        """Initialize a new notifier.
+
+        Args:
+            sns_client: A low level boto3 client for SNS.
+            topic_arn (str): ARN of the topic to publish to.
+            window (int, optional): Seconds within which a repeated finding is
+                dropped. Defaults to `DEFAULT_DEDUP_WINDOW`.
+            state_path (str, optional): File to remember sent findings in
+                between runs. Defaults to only remembering them in memory.
+            max_workers (int, optional): How many calls can be in flight at
+                once. Defaults to `MAX_WORKERS`.
+        """
+        self.sns_client = sns_client
+        self.topic_arn: str = topic_arn
+        self.window: int = window
+        self.state_path: str = state_path
+        self.max_workers: int = max_workers
+
+        # Findings waiting for the next flush, keyed so duplicates collapse.
+        self.pending: dict[str, dict] = {}
+        self.duplicates: int = 0
+
+        # When each finding was last sent.
+        self.last_sent: dict[str, float] = {}
+        if state_path and os.path.exists(state_path):
+            with open(state_path, 'r') as file:
+                self.last_sent = json.load(file)
+
+
+    @staticmethod
+    def key(finding: dict) -> str:
+        """The identity of a finding, for deduplication."""
+        return f"{finding['check']}|{finding['resource']}|{finding['message']}"
+
+
+    def add(self, findings: list[dict]):
+        """Queue findings to be sent on the next flush.
+
+        Args:
+            findings (list[dict]): Findings, see `common.findings.finding()`.
+        """
+        now: float = time.time()
+
+        for new_finding in findings:
+            key: str = self.key(new_finding)
+
+            if key in self.pending or now - self.last_sent.get(key, 0) < self.window:
+                self.duplicates += 1
+                continue
+
+            self.pending[key] = new_finding
+
+
+    def digests(self) -> list[dict]:
+        """Roll the pending findings up into digest messages.
+
+        Findings are grouped by severity and check, and each digest is kept
+        small enough that a full batch of them fits in one publish_batch call.
+
+        Returns:
+            list[dict]: Subject and message of each digest, and the keys of
+                the findings in it.
+        """
+        groups: dict[tuple[str, str], list[str]] = {}
+        for key, pending_finding in self.pending.items():
+            groups.setdefault(
+                (pending_finding["severity"], pending_finding["check"]), []
+            ).append(key)
+
+        digests: list[dict] = []
+
+        for (severity, check), keys in sorted(groups.items()):
+
+            # Pack the lines into as few messages as they fit in.
+            part: list[str] = []
+            part_keys: list[str] = []
+            size: int = 0
+            parts: list[tuple[list[str], list[str]]] = []
+            for key in keys:
+                group_finding: dict = self.pending[key]
+                line: str = _truncate(
+                    f" - {group_finding['resource']}: {group_finding['message']}",
+                    MAX_MESSAGE_BYTES - 1,
+                )
+                line_size: int = len(line.encode('utf-8')) + 1
+                if part and size + line_size > MAX_MESSAGE_BYTES:
+                    parts.append((part, part_keys))
+                    part, part_keys, size = [], [], 0
+                part.append(line)
+                part_keys.append(key)
+                size += line_size
+            parts.append((part, part_keys))
+
+            for number, (part, part_keys) in enumerate(parts, start=1):
+                subject: str = f"[{severity}] {check}: {len(keys)} finding(s)"
+                if len(parts) > 1:
+                    subject += f" ({number}/{len(parts)})"
+                digests.append({
+                    "subject" : _truncate(subject, MAX_SUBJECT_BYTES),
+                    "message" : "\n".join(part),
+                    "keys" : part_keys,
+                })
+
+        return digests
+
+
+    def _publish(self, batch: list[dict]) -> list[dict]:
+        """Publish one batch of digests, retrying the failed ones once. Failures
+        that are our own fault (SenderFault) would only fail again, so those
+        aren't retried. A call that fails outright (say, still throttled once
+        botocore is done retrying) fails whatever it was sending, without
+        taking the other batches down with it.
+
+        Returns:
+            list[dict]: The digests that were published.
+        """
+        failed: set[str] = set()
+        entries: list[dict] = [
+            {
+                'Id' : str(number),
+                'Subject' : digest["subject"],
+                'Message' : digest["message"],
+            }
+            for number, digest in enumerate(batch)
+        ]
+
+        for _ in range(2):
+            try:
+                response: dict = self.sns_client.publish_batch(
+                    TopicArn=self.topic_arn,
+                    PublishBatchRequestEntries=entries,
+                )
+            except clients.client_error():
+                break
+            retry_ids: set[str] = set()
+            for failure in response.get('Failed', []):
+                if failure.get('SenderFault'):
+                    failed.add(failure['Id'])
+                else:
+                    retry_ids.add(failure['Id'])
+            entries = [entry for entry in entries if entry['Id'] in retry_ids]
+            if not entries:
+                break
+
+        failed.update(entry['Id'] for entry in entries)
+
+        return [
+            digest for number, digest in enumerate(batch)
+            if str(number) not in failed
+        ]
+
+
+    def flush(self) -> dict[str, int]:
+        """Publish every pending finding as digests. Only findings whose digest
+        was published count as sent. The rest stay pending, for the next
+        flush to try again.
+
+        Returns:
+            dict[str, int]: How many findings were sent, failed and dropped as
+                duplicates, and how many messages and calls it took.
+        """
+        digests: list[dict] = self.digests()
+        batches: list[list[dict]] = [
+            digests[i:i + PUBLISH_BATCH_SIZE]
+            for i in range(0, len(digests), PUBLISH_BATCH_SIZE)
+        ]
+
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            published: list[dict] = [
+                digest
+                for batch_published in executor.map(self._publish, batches)
+                for digest in batch_published
+            ]
+
+        # Remember what we sent, and forget anything older than the window.
+        # Findings that didn't make it aren't stamped, so they aren't hidden
+        # as duplicates the next time around.
+        now: float = time.time()
+        sent_keys: set[str] = {key for digest in published for key in digest["keys"]}
+        for key in sent_keys:
+            self.last_sent[key] = now
+        self.last_sent = {
+            key: sent for key, sent in self.last_sent.items()
+            if now - sent < self.window
+        }
+        if self.state_path:
+            with open(self.state_path, 'w') as file:
+                json.dump(self.last_sent, file)
+
+        summary: dict[str, int] = {
+            "findings" : len(sent_keys),
+            "failed" : len(self.pending) - len(sent_keys),
+            "duplicates" : self.duplicates,
+            "messages" : len(published),
+            "calls" : len(batches),
+        }
+        self.pending = {
+            key: pending_finding for key, pending_finding in self.pending.items()
+            if key not in sent_keys
+        }
+        self.duplicates = 0
+
+        return summary
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Digest Notifier",
+        description="Publish findings and firing alarms to a topic as digests",
+    )
+    parser.add_argument(
+        "-f", "--findings",
+        type=str,
+        help="JSON file with a list of findings to publish",
+    )
+    parser.add_argument(
+        "-a", "--alarms",
+        action="store_true",
+        help="Also publish every alarm that is currently firing",
+    )
+    parser.add_argument(
+        "-n", "--topic-name",
+        default="ExampleTopic",
+        help="Name of the SNS topic to publish to",
+    )
+    parser.add_argument(
+        "-s", "--state",
+        default=".notify-state.json",
+        help="File that remembers recently sent findings",
+    )
+    args = parser.parse_args()
+
+    findings: list[dict] = []
+    if args.findings:
+        with open(args.findings, 'r') as file:
+            findings.extend(json.load(file))
+    if args.alarms:
+        findings.extend(findings_from_alarms(clients.client('cloudwatch')))
+
+    notifier: Notifier = Notifier(
+        clients.client('sns'),
+        sns.create_sns_topic(args.topic_name),
+        state_path=args.state,
+    )
+    notifier.add(findings)
+    summary: dict[str, int] = notifier.flush()
+
+    print(f"Sent {summary['findings']} finding(s) in {summary['messages']} "
+        f"message(s) over {summary['calls']} call(s). Dropped "
+        f"{summary['duplicates']} duplicate(s).")
+    if summary["failed"]:
+        print(f"Failed to send {summary['failed']} finding(s).")
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,657 @@
+'''
+Author: Joseph Hopwood
+Description: Module containing a local rules engine for fleets of EC2
+instances. Instead of one CloudWatch alarm per instance and action, the latest
+metrics of the whole fleet are kept in fixed size ring buffers, threshold and
+anomaly rules are evaluated for every instance at once, and the reboots and
+stops that come out of it are sent in batched calls. A datapoint is only taken
+once, no matter how many ticks fetch it, so "two periods in a row" really
+means two periods.
+'''
+
+import argparse
+import datetime
+import time
+import warnings
+
+# NumPy is imported in the functions that use it, so that --help never pays
+# for it.
+
+from common import clients
+
+import alarms
+import metrics
+
+# How many instance IDs we put in a single reboot/stop call.
+ACTION_BATCH_SIZE: int = 1000
+
+# How many datapoints of each metric we remember per instance.
+DEFAULT_WINDOW: int = 12
+
+# How many datapoints an anomaly rule needs before the newest, to have a
+# history to compare it to.
+MIN_HISTORY: int = 3
+
+
+
+
+class MetricWindow:
+    """
+    Ring buffer of the latest datapoints of a metric for a fleet of instances.
+    Every instance gets a row of fixed width, and the rows of instances that
+    have left the fleet are handed to new ones, so memory per instance never
+    grows, no matter how long the engine runs.
+    """
+
+
+    def __init__(self, width: int = DEFAULT_WINDOW):
+        """Initialize an empty window.
+
+        Args:
+            width (int, optional): How many datapoints to remember per instance.
+                Defaults to `DEFAULT_WINDOW`.
+        """
+        import numpy
+
+        self.width: int = width
+        self.rows: dict[str, int] = {}
+        self.buffer: numpy.ndarray = numpy.full((0, width), numpy.nan)
+
+        # The instance of every row (None if the row is free), and the free
+        # rows, lowest last.
+        self.ids: list[str] = []
+        self.free: list[int] = []
+
+        # Every row fills up on its own: where its next datapoint goes, and the
+        # timestamp of the newest datapoint it took.
+        self.heads: numpy.ndarray = numpy.zeros(0, dtype=int)
+        self.taken: numpy.ndarray = numpy.zeros(0)
+
+
+    def _grow(self, count: int):
+        """Add free rows to the end of the buffer."""
+        import numpy
+
+        size: int = len(self.ids)
+
+        self.buffer = numpy.vstack([
+            self.buffer, numpy.full((count, self.width), numpy.nan)
+        ])
+        self.heads = numpy.concatenate([self.heads, numpy.zeros(count, dtype=int)])
+        self.taken = numpy.concatenate([self.taken, numpy.full(count, -numpy.inf)])
+        self.ids.extend([None] * count)
+        self.free.extend(range(size + count - 1, size - 1, -1))
+
+
+    def ensure(self, instance_ids: list[str]) -> "numpy.ndarray":
+        """Make sure every instance has a row, and get their row numbers. New
+        instances get the rows of instances that left first. Only when there
+        are none left does the buffer grow, and then it doubles, so it is
+        copied a handful of times at most.
+
+        Args:
+            instance_ids (list[str]): IDs of the instances.
+
+        Returns:
+            numpy.ndarray: The row of each instance, in the same order.
+        """
+        import numpy
+
+        new_ids: list[str] = [
+            instance_id for instance_id in dict.fromkeys(instance_ids)
+            if instance_id not in self.rows
+        ]
+
+        if len(new_ids) > len(self.free):
+            self._grow(max(len(new_ids) - len(self.free), len(self.ids)))
+
+        for instance_id in new_ids:
+            row: int = self.free.pop()
+            self.rows[instance_id] = row
+            self.ids[row] = instance_id
+
+        return numpy.fromiter(
+            (self.rows[instance_id] for instance_id in instance_ids),
+            dtype=int,
+            count=len(instance_ids),
+        )
+
+
+    def retire(self, instance_ids: list[str]) -> "numpy.ndarray":
+        """Free the rows of instances that have left the fleet.
+
+        Args:
+            instance_ids (list[str]): IDs of the instances.
+
+        Returns:
+            numpy.ndarray: The rows that were freed.
+        """
+        import numpy
+
+        rows: numpy.ndarray = numpy.fromiter(
+            (
+                self.rows.pop(instance_id) for instance_id in instance_ids
+                if instance_id in self.rows
+            ),
+            dtype=int,
+        )
+
+        self.buffer[rows] = numpy.nan
+        self.heads[rows] = 0
+        self.taken[rows] = -numpy.inf
+        for row in rows:
+            self.ids[row] = None
+        self.free.extend(sorted(rows.tolist(), reverse=True))
+
+        return rows
+
+
+    def push(
+            self,
+            instance_ids: list[str],
+            values: "numpy.ndarray",
+            timestamps: "numpy.ndarray" = None
+    ) -> int:
+        """Add the newest datapoint of each instance. A datapoint that isn't
+        newer than the last one an instance took is the same one fetched
+        again, and is left out, as are NaNs. Instances that don't take a
+        datapoint keep the ones they have.
+
+        Args:
+            instance_ids (list[str]): IDs of the instances.
+            values (numpy.ndarray): The newest datapoint of each instance.
+            timestamps (numpy.ndarray, optional): When each datapoint is from,
+                in seconds since the epoch. Defaults to every datapoint being
+                new.
+
+        Returns:
+            int: How many instances took a datapoint.
+        """
+        import numpy
+
+        rows: numpy.ndarray = self.ensure(instance_ids)
+        values = numpy.asarray(values, dtype=float)
+
+        new: numpy.ndarray = ~numpy.isnan(values)
+        if timestamps is not None:
+            timestamps = numpy.asarray(timestamps, dtype=float)
+            new &= timestamps > self.taken[rows]
+            self.taken[rows[new]] = timestamps[new]
+
+        rows = rows[new]
+        self.buffer[rows, self.heads[rows]] = values[new]
+        self.heads[rows] = (self.heads[rows] + 1) % self.width
+
+        return len(rows)
+
+
+    def latest(self, count: int) -> "numpy.ndarray":
+        """Get the newest `count` datapoints of every row.
+
+        Returns:
+            numpy.ndarray: One row per row of the window, oldest datapoint
+                first. Rows with fewer datapoints than that are padded with
+                NaN at the front.
+        """
+        import numpy
+
+        columns: numpy.ndarray = (
+            self.heads[:, None] + numpy.arange(-count, 0)
+        ) % self.width
+        return numpy.take_along_axis(self.buffer, columns, axis=1)
+
+
+
+
+class ThresholdRule:
+    """
+    Fires for every instance whose metric has been past a threshold for a
+    number of datapoints in a row. After firing, it doesn't fire again for that
+    instance until the metric has come back past the clear threshold
+    (hysteresis), so an instance isn't rebooted over and over.
+    """
+
+
+    def __init__(
+            self,
+            name: str,
+            metric_name: str,
+            threshold: float,
+            periods: int,
+            clear: float,
+            above: bool = True,
+            action: str = None
+    ):
+        """Initialize a new rule.
+
+        Args:
+            name (str): Name of the rule, used in reports.
+            metric_name (str): The metric the rule watches.
+            threshold (float): The value the metric has to be past.
+            periods (int): For how many datapoints in a row.
+            clear (float): The value the metric has to come back past before
+                the rule can fire again.
+            above (bool, optional): Whether "past" means at or above (True),
+                or at or below (False). Defaults to True.
+            action (str, optional): "reboot", "stop", or None to only report.
+        """
+        import numpy
+
+        self.name: str = name
+        self.metric_name: str = metric_name
+        self.threshold: float = threshold
+        self.periods: int = periods
+        self.clear: float = clear
+        self.above: bool = above
+        self.action: str = action
+
+        # Whether the rule has fired for each row, and hasn't cleared since.
+        self.fired: numpy.ndarray = numpy.zeros(0, dtype=bool)
+
+
+    def check(
+            self,
+            window: MetricWindow
+    ) -> "tuple[numpy.ndarray, numpy.ndarray]":
+        """Work out which rows are past the threshold, and which are back
+        past the clear threshold.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray]: Whether each row is
+                breaching, and whether it has cleared.
+        """
+        recent: numpy.ndarray = window.latest(self.periods)
+        newest: numpy.ndarray = recent[:, -1]
+
+        # NaN is never past anything, so gaps in the data never fire a rule.
+        if self.above:
+            return (recent >= self.threshold).all(axis=1), newest < self.clear
+        return (recent <= self.threshold).all(axis=1), newest > self.clear
+
+
+    def reset(self, rows: "numpy.ndarray"):
+        """Forget that the rule fired for rows that now belong to someone else."""
+        self.fired[rows[rows < len(self.fired)]] = False
+
+
+    def evaluate(self, window: MetricWindow) -> "numpy.ndarray":
+        """Evaluate the rule for every instance in a window.
+
+        Returns:
+            numpy.ndarray: Whether the rule fires, per row of the window.
+        """
+        import numpy
+
+        # New rows start out not fired.
+        if len(self.fired) < len(window.ids):
+            self.fired = numpy.concatenate([
+                self.fired,
+                numpy.zeros(len(window.ids) - len(self.fired), dtype=bool),
+            ])
+
+        breaching, cleared = self.check(window)
+
+        self.fired &= ~cleared
+        firing: numpy.ndarray = breaching & ~self.fired
+        self.fired |= firing
+
+        return firing
+
+
+
+
+class AnomalyRule(ThresholdRule):
+    """
+    Fires for every instance whose newest datapoint is far off from its own
+    recent history, measured in standard deviations (z-score). Every instance
+    is compared to itself, so a server that always runs hot isn't an anomaly,
+    but one that suddenly does is. Hysteresis works the same as for
+    `ThresholdRule`, in z-scores.
+    """
+
+
+    def __init__(
+            self,
+            name: str,
+            metric_name: str,
+            threshold: float,
+            periods: int,
+            clear: float,
+            above: bool = True,
+            action: str = None,
+            min_deviation: float = 1.0
+    ):
+        """Initialize a new rule.
+
+        Args:
+            name (str): Name of the rule, used in reports.
+            metric_name (str): The metric the rule watches.
+            threshold (float): The z-score the newest datapoint has to be past.
+            periods (int): How many datapoints to look at, the newest one
+                included.
+            clear (float): The z-score the metric has to come back under
+                before the rule can fire again.
+            above (bool, optional): Whether to look for spikes (True), or
+                drops (False). Defaults to True.
+            action (str, optional): "reboot", "stop", or None to only report.
+            min_deviation (float, optional): The smallest standard deviation
+                we divide by, in the units of the metric, so that a metric
+                that was flat doesn't make an anomaly out of every wiggle.
+                Defaults to 1.0.
+        """
+        super().__init__(
+            name, metric_name, threshold, periods, clear, above, action
+        )
+        self.min_deviation: float = min_deviation
+
+
+    def check(
+            self,
+            window: MetricWindow
+    ) -> "tuple[numpy.ndarray, numpy.ndarray]":
+        """See `ThresholdRule.check()`. Rows without MIN_HISTORY datapoints
+        before the newest one never breach."""
+        import numpy
+
+        recent: numpy.ndarray = window.latest(self.periods)
+        history: numpy.ndarray = recent[:, :-1]
+        newest: numpy.ndarray = recent[:, -1]
+
+        # Rows without any history would make NumPy complain about empty
+        # slices. They can't breach anyway, so let's keep it quiet.
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            mean: numpy.ndarray = numpy.nanmean(history, axis=1)
+            deviation: numpy.ndarray = numpy.nanstd(history, axis=1)
+
+        scores: numpy.ndarray = (newest - mean) / numpy.maximum(
+            deviation, self.min_deviation
+        )
+        if not self.above:
+            scores = -scores
+
+        enough: numpy.ndarray = (~numpy.isnan(history)).sum(axis=1) >= MIN_HISTORY
+        return enough & (scores >= self.threshold), scores < self.clear
+
+
+
+
+def sustained_high_cpu() -> ThresholdRule:
+    """_Reboot when CPU is >= 70% for two datapoints, like the high CPU
+    alarm. Clears below 60%._"""
+    return ThresholdRule(
+        "sustained_high_cpu", "CPUUtilization", 70.0, 2, 60.0,
+        above=True, action="reboot",
+    )
+
+
+
+
+def idle_cpu() -> ThresholdRule:
+    """_Stop when CPU is <= 10% for one datapoint, like the low CPU alarm.
+    Clears above 15%._"""
+    return ThresholdRule(
+        "idle_cpu", "CPUUtilization", 10.0, 1, 15.0,
+        above=False, action="stop",
+    )
+
+
+
+
+def cpu_spike() -> AnomalyRule:
+    """_Report when CPU jumps 3 standard deviations over its own last hour.
+    Clears under 2._"""
+    return AnomalyRule(
+        "cpu_spike", "CPUUtilization", 3.0, DEFAULT_WINDOW, 2.0,
+        above=True, action=None,
+    )
+
+
+
+
+class RulesEngine:
+    """
+    Keeps the metric windows of a fleet and evaluates rules over them, one tick
+    at a time.
+    """
+
+
+    def __init__(self, rules: list[ThresholdRule], width: int = DEFAULT_WINDOW):
+        """Initialize a new engine.
+
+        Args:
+            rules (list[ThresholdRule]): The rules to evaluate every tick.
+            width (int, optional): How many datapoints to remember per instance.
+                Defaults to `DEFAULT_WINDOW`.
+        """
+        self.rules: list[ThresholdRule] = rules
+        self.windows: dict[str, MetricWindow] = {
+            rule.metric_name: MetricWindow(
+                max(width, max(r.periods for r in rules))
+            )
+            for rule in rules
+        }
+
+
+    def tick(
+            self,
+            instance_ids: list[str],
+            latest: "dict[str, numpy.ndarray]",
+            timestamps: "dict[str, numpy.ndarray]" = None
+    ) -> dict[str, dict[str, list[str]]]:
+        """Take in the newest datapoints and evaluate every rule. Instances
+        that aren't in the fleet anymore give up their rows.
+
+        Args:
+            instance_ids (list[str]): IDs of the instances in the fleet.
+            latest (dict[str, numpy.ndarray]): The newest datapoint of each
+                instance, keyed by metric name.
+            timestamps (dict[str, numpy.ndarray], optional): When each of
+                those datapoints is from, see `MetricWindow.push()`. Defaults
+                to every datapoint being new.
+
+        Returns:
+            dict[str, dict[str, list[str]]]: The instances each rule fired for,
+                keyed by action ("reboot", "stop" or None) and then rule name.
+        """
+        import numpy
+
+        fleet: set[str] = set(instance_ids)
+
+        for metric_name, window in self.windows.items():
+            freed: numpy.ndarray = window.retire(
+                [instance_id for instance_id in window.rows if instance_id not in fleet]
+            )
+            for rule in self.rules:
+                if rule.metric_name == metric_name:
+                    rule.reset(freed)
+
+            values: numpy.ndarray = latest.get(
+                metric_name, numpy.full(len(instance_ids), numpy.nan)
+            )
+            window.push(
+                instance_ids, values, (timestamps or {}).get(metric_name)
+            )
+
+        results: dict[str, dict[str, list[str]]] = {}
+
+        for rule in self.rules:
+            window: MetricWindow = self.windows[rule.metric_name]
+            firing: numpy.ndarray = rule.evaluate(window)
+
+            if firing.any():
+                results.setdefault(rule.action, {})[rule.name] = [
+                    window.ids[row] for row in numpy.flatnonzero(firing)
+                ]
+
+        return results
+
+
+
+
+def latest_datapoints(
+        fleet_metrics: metrics.FleetMetrics,
+        metric_name: str
+) -> "tuple[numpy.ndarray, numpy.ndarray]":
+    """_Get the newest datapoint of a metric for every instance at once, and
+    when it is from._
+
+    Args:
+        fleet_metrics (metrics.FleetMetrics): _Recently collected metrics._
+        metric_name (str): _Name of the metric._
+
+    Returns:
+        tuple[numpy.ndarray, numpy.ndarray]: _The newest value of each
+            instance, NaN if it has none, and when CloudWatch says it was
+            taken, in seconds since the epoch._
+    """
+    import numpy
+
+    values: numpy.ndarray = fleet_metrics.metric(metric_name)
+    has_data: numpy.ndarray = ~numpy.isnan(values)
+
+    # The last column with data in each row.
+    last: numpy.ndarray = values.shape[1] - 1 - numpy.argmax(
+        has_data[:, ::-1], axis=1
+    )
+    rows: numpy.ndarray = numpy.arange(values.shape[0])
+    newest: numpy.ndarray = values[rows, last]
+    newest[~has_data.any(axis=1)] = numpy.nan
+
+    # The grid moves with every tick, so it's the timestamp of the datapoint
+    # itself that tells a new one from one we fetched before.
+    timestamps: numpy.ndarray = fleet_metrics.taken(metric_name)[rows, last]
+
+    return newest, timestamps
+
+
+
+
+def dispatch(ec2_client, actions: dict, dryrun: bool = False) -> dict[str, int]:
+    """_Send the reboots and stops that came out of a tick, in batches._
+
+    Args:
+        ec2_client: _A low level boto3 client for the EC2 service._
+        actions (dict): _The results of `RulesEngine.tick()`._
+        dryrun (bool, optional): _Dry run switch for testing. Defaults to
+            False._
+
+    Returns:
+        dict[str, int]: _How many instances got each action._
+    """
+    calls: dict = {
+        "reboot" : ec2_client.reboot_instances,
+        "stop" : ec2_client.stop_instances,
+    }
+    sent: dict[str, int] = {}
+
+    for action, call in calls.items():
+
+        # An instance can be caught by more than one rule. It only needs the
+        # action once.
+        instance_ids: list[str] = sorted({
+            instance_id
+            for fired_ids in actions.get(action, {}).values()
+            for instance_id in fired_ids
+        })
+
+        for i in range(0, len(instance_ids), ACTION_BATCH_SIZE):
+            try:
+                call(
+                    InstanceIds=instance_ids[i:i + ACTION_BATCH_SIZE],
+                    DryRun=dryrun,
+                )
+            except clients.client_error() as error:
+                # A successful dry run still comes back as an "error".
+                if error.response["Error"]["Code"] != "DryRunOperation":
+                    raise
+
+        sent[action] = len(instance_ids)
+
+    return sent
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Fleet Rules Engine",
+        description="Reboot busy and stop idle instances from local rules",
+    )
+    parser.add_argument(
+        "-t", "--tag",
+        action="append",
+        default=[],
+        help="Key=Value tag the instances in the fleet have. Can be repeated",
+    )
+    parser.add_argument(
+        "-p", "--period",
+        type=int,
+        default=300,
+        help="Seconds between ticks, and the metric period. Defaults to 300",
+    )
+    parser.add_argument(
+        "--dryrun",
+        action="store_true",
+        help="Evaluate the rules, but only dry run the actions",
+    )
+    args = parser.parse_args()
+
+    tags: dict[str, str] = dict(tag.split("=", 1) for tag in args.tag)
+
+    ec2_client = clients.client('ec2')
+    cloudwatch_client = clients.client('cloudwatch')
+
+    engine: RulesEngine = RulesEngine(
+        [sustained_high_cpu(), idle_cpu(), cpu_spike()]
+    )
+    metric_names: dict[str, str] = {
+        metric_name: metrics.DEFAULT_METRICS[metric_name]
+        for metric_name in engine.windows
+    }
+
+    while True:
+        instance_ids: list[str] = alarms.get_fleet_instance_ids(
+            ec2_client, tags=tags
+        )
+
+        # Two periods back is enough to catch the newest complete datapoint.
+        # If CloudWatch hasn't published a new one yet, we get the one from
+        # last tick again, and the windows leave it out.
+        end: datetime.datetime = datetime.datetime.now(datetime.timezone.utc)
+        fleet_metrics = metrics.collect_fleet_metrics(
+            cloudwatch_client,
+            instance_ids,
+            end - datetime.timedelta(seconds=2 * args.period),
+            end,
+            args.period,
+            metric_names,
+        )
+
+        latest: dict[str, tuple] = {
+            metric_name: latest_datapoints(fleet_metrics, metric_name)
+            for metric_name in metric_names
+        }
+        actions: dict = engine.tick(
+            instance_ids,
+            {metric_name: values for metric_name, (values, _) in latest.items()},
+            {metric_name: times for metric_name, (_, times) in latest.items()},
+        )
+        sent: dict[str, int] = dispatch(ec2_client, actions, args.dryrun)
+
+        print(f"{end.isoformat()} | {len(instance_ids)} instance(s) | "
+            f"rebooted {sent['reboot']} | stopped {sent['stop']}")
+
+        # Rules without an action are only reported.
+        for rule_name, fired_ids in actions.get(None, {}).items():
+            print(f"  {rule_name}: {', '.join(fired_ids)}")
+
+        time.sleep(args.period)
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,171 @@
 
 
-import boto3
+import argparse
+import concurrent.futures
+
+from common import clients, paginate
+
+# How many subscribe calls we make at the same time.
+MAX_WORKERS: int = 8
+
+
+
+
+class SnsResolver:
+    """
+    Client side cache of topic ARNs and subscriptions. Topics are resolved once
+    per name, the subscriptions of a topic are listed once, and only endpoints
+    that aren't subscribed yet cost a subscribe call.
+    """
+
+
+    def __init__(self, sns_client=None, max_workers: int = MAX_WORKERS):
+        """Initialize a new resolver.
+
+        Args:
+            sns_client (optional): A low level boto3 client for SNS. Defaults to
+                a new one, with a connection for every worker.
+            max_workers (int, optional): How many subscribe calls can be in
+                flight at once. Defaults to `MAX_WORKERS`.
+        """
+        self.sns_client = sns_client or clients.client(
+            'sns', max_pool_connections=max_workers
+        )
+        self.max_workers: int = max_workers
+
+        # Topic name -> topic ARN.
+        self.topic_arns: dict[str, str] = {}
+
+        # Topic ARN -> (protocol, endpoint) -> subscription ARN.
+        self.subscriptions: dict[str, dict[tuple[str, str], str]] = {}
+
+
+    def topic_arn(self, topic_name: str) -> str:
+        """Get the ARN of a topic, creating the topic if it doesn't exist yet.
+
+        Args:
+            topic_name (str): Name of the topic.
+
+        Returns:
+            str: ARN of the topic.
+        """
+        if topic_name not in self.topic_arns:
+
+            # create_topic hands back the existing topic if there already is
+            # one by that name, so this is safe to do every time.
+            response: dict = self.sns_client.create_topic(Name=topic_name)
+            self.topic_arns[topic_name] = response['TopicArn']
+
+        return self.topic_arns[topic_name]
+
+
+    @staticmethod
+    def _key(protocol: str, endpoint: str) -> tuple[str, str]:
+        """How a subscription is looked up. Emails don't care about case."""
+        if protocol in ('email', 'email-json'):
+            endpoint = endpoint.lower()
+        return (protocol, endpoint)
+
+
+    def topic_subscriptions(self, topic_arn: str) -> dict[tuple[str, str], str]:
+        """Get the existing subscriptions of a topic, listing them only once.
+
+        Args:
+            topic_arn (str): ARN of the topic.
+
+        Returns:
+            dict[tuple[str, str], str]: Subscription ARNs (or
+                "PendingConfirmation"), keyed by (protocol, endpoint).
+        """
+        if topic_arn not in self.subscriptions:
+            existing: dict[tuple[str, str], str] = {}
+
+            for subscription in paginate.items(
+                self.sns_client,
+                'list_subscriptions_by_topic',
+                'Subscriptions',
+                TopicArn=topic_arn,
+            ):
+                existing[
+                    self._key(
+                        subscription['Protocol'], subscription['Endpoint']
+                    )
+                ] = subscription['SubscriptionArn']
+
+            self.subscriptions[topic_arn] = existing
+
+        return self.subscriptions[topic_arn]
+
+
+    def subscribe(
+            self,
+            topic_arn: str,
+            endpoints: list[str],
+            protocol: str = 'email'
+    ) -> dict[str, str]:
+        """Subscribe endpoints to a topic. Endpoints that are already
+        subscribed (or waiting on confirmation) are skipped, and the rest are
+        subscribed in parallel.
+
+        Args:
+            topic_arn (str): ARN of the topic.
+            endpoints (list[str]): Endpoints to subscribe, e.g. emails.
+            protocol (str, optional): Protocol of the endpoints. Defaults to
+                'email'.
+
+        Returns:
+            dict[str, str]: Subscription ARN of every endpoint.
+        """
+        existing: dict[tuple[str, str], str] = self.topic_subscriptions(topic_arn)
+
+        # Only the endpoints we haven't seen yet. Let's also drop repeats.
+        new_endpoints: dict[tuple[str, str], str] = {}
+        for endpoint in endpoints:
+            key: tuple[str, str] = self._key(protocol, endpoint)
+            if key not in existing:
+                new_endpoints.setdefault(key, endpoint)
+
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            futures: dict = {
+                key: executor.submit(
+                    self.sns_client.subscribe,
+                    TopicArn=topic_arn,
+                    Protocol=protocol,
+                    Endpoint=endpoint,
+                )
+                for key, endpoint in new_endpoints.items()
+            }
+
+            for key, future in futures.items():
+                existing[key] = future.result()['SubscriptionArn']
+
+        return {
+            endpoint: existing[self._key(protocol, endpoint)]
+            for endpoint in endpoints
+        }
+
+
+
+
+# The resolver the module level functions share, so they reuse one client and
+# one cache for the whole run.
+_default_resolver: SnsResolver = None
+
+
+def get_resolver() -> SnsResolver:
+    """_Get the resolver shared by the module level functions, creating it the
+    first time._"""
+    global _default_resolver
+    if _default_resolver is None:
+        _default_resolver = SnsResolver()
+    return _default_resolver
+
+
+
 
 def create_sns_topic(topic_name: str) -> str:
-    """_Create a new topic. Honestly a wrapper function._
+    """_Create a new topic, or get the existing one. Honestly a wrapper
+    function._
 
     Args:
         topic_name (str): _Desired name of new topic._
@@ -11,20 +173,13 @@ def create_sns_topic(topic_name: str) -> str:
     Returns:
         str: _ARN or created topic._
     """
-    
-    sns_client = boto3.client('sns')
-
-    response: dict = sns_client.create_topic(
-        Name=topic_name
-    )
-
-    return response['TopicArn']
+    return get_resolver().topic_arn(topic_name)
 
 
 
 
 def subscribe_email(topic_arn: str, email: str) -> str:
-    """_Subscribe an email to a topic._
+    """_Subscribe an email to a topic, unless it already is._
 
     Args:
         topic_arn (str): _ARN of topic._
@@ -33,14 +188,44 @@ def subscribe_email(topic_arn: str, email: str) -> str:
     Returns:
         str: _ARN of subscription._
     """
+    # Remeber to like, comment, and subscribe!
+    return get_resolver().subscribe(topic_arn, [email])[email]
 
-    sns_client = boto3.client('sns')
 
-    # Remeber to like, comment, and subscribe!
-    response: dict = sns_client.subscribe(
-        TopicArn=topic_arn,
-        Protocol='email',
-        Endpoint=email
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Bulk Subscriber",
+        description="Subscribe emails to a topic, skipping existing ones",
+    )
+    parser.add_argument(
+        "-n", "--topic-name",
+        default="ExampleTopic",
+        help="Name of the SNS topic",
+    )
+    parser.add_argument(
+        "-f", "--file",
+        required=True,
+        help="File with one email per line",
     )
+    args = parser.parse_args()
+
+    with open(args.file, 'r') as file:
+        emails: list[str] = [line.strip() for line in file if line.strip()]
+
+    resolver: SnsResolver = get_resolver()
+    topic_arn: str = resolver.topic_arn(args.topic_name)
+    already: int = len(resolver.topic_subscriptions(topic_arn))
+    resolver.subscribe(topic_arn, emails)
+
+    print(f"{topic_arn}: {len(resolver.topic_subscriptions(topic_arn)) - already}"
+        f" new subscription(s), {len(emails)} email(s) given.")
+
+
+
 
-    return response['SubscriptionArn']
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@ a new SNS topic, and subscribes inputted email to it. If the EC2 instance
 reaches low CPU usage, it will stop the instance, and send an alert email.
 '''
 
-import boto3, ec2, sns
+import boto3, ec2, sns, alarms
 
 
 
@@ -47,34 +47,20 @@ def main():
     # the average CPU Util is <= 10% for one data point within 10 minutes. it
     # will also send us an email at that time because it is going to pass this
     # information to the topic that we created.
+    # The alarm is named after the instance, so running this again for a new
+    # instance leaves the alarms of the earlier ones alone.
     cloudwatch_client = boto3.client('cloudwatch')
-    _ = cloudwatch_client.put_metric_alarm(
-        AlarmName='Web_server_LOW_CPU_Utilization',
-        ComparisonOperator='LessThanOrEqualToThreshold',
-        EvaluationPeriods=1,
-        MetricName='CPUUtilization',
-        Namespace='AWS/EC2',
-        Period=300,
-        Statistic='Average',
-        Threshold=10.0,
-        ActionsEnabled=True,
-        AlarmActions=[
-            f"arn:aws:swf:us-east-1:{account_id}:action/actions/AWS_EC2.Insta" \
-            f"nceId.Stop/1.0",
-            f"arn:aws:sns:us-east-1:{account_id}:{topic_name}",
-        ],
-        AlarmDescription='Alarm when server CPU is lower than 10%',
-        Dimensions=[
-            {
-                'Name' : 'InstanceId',
-                'Value' : instance_id
-            },
-        ]
+    region: str = cloudwatch_client.meta.region_name
+    _ = alarms.sync_fleet_alarms(
+        cloudwatch_client,
+        [instance_id],
+        'Web_server_LOW_CPU_Utilization',
+        alarms.stop_low_cpu(account_id, topic_name, region),
+        prune=False,
     )
 
 
 
 
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,458 @@
+'''
+Author: Joseph Hopwood
+Description: Module for tearing down whole fleets of EC2 instances at once.
+Instead of terminating one instance and waiting on it before the next, the
+fleet is terminated 1000 instances to a call, and one poll loop waits on all
+of it. Instances with termination protection are found by the calls that
+fail on them, and are either left alone or, when forced, unprotected and
+terminated too. The CloudWatch alarms of the fleet (see alarms.py) can go
+with it.
+
+Example:
+
+python3 cli.py teardown --tag env=test --alarms
+python3 cli.py teardown --instance-ids i-0123456789abcdef0 i-0fedcba9876543210 --force
+'''
+
+import argparse
+import concurrent.futures
+import re
+import time
+
+from common import clients, paginate
+
+import alarms
+
+# How many instance IDs we put in a single terminate call...
+TERMINATE_BATCH_SIZE: int = 1000
+
+# ...and in a single describe call, where they go in a filter. A filter takes
+# at most 200 values.
+DESCRIBE_BATCH_SIZE: int = 200
+
+# Termination protection can only be turned off one instance at a time, so
+# those calls are spread over a few threads.
+MAX_WORKERS: int = 8
+
+# How long we wait between polls, and on the whole fleet, in seconds. The
+# poll matches the instance_terminated waiter of boto3.
+POLL_SECONDS: float = 15.0
+DEFAULT_TIMEOUT: float = 600.0
+
+# Every state an instance is still up in.
+LIVE_STATES: list[str] = [
+    'pending', 'running', 'shutting-down', 'stopping', 'stopped',
+]
+
+# The IDs of instances in the message of a failed call.
+INSTANCE_ID: re.Pattern = re.compile(r"\bi-[0-9a-f]+\b")
+
+
+
+
+def disable_termination_protection(
+        ec2_client,
+        instance_ids: list[str],
+        max_workers: int = MAX_WORKERS
+):
+    """_Turn termination protection off on instances._
+
+    Args:
+        ec2_client: _A low level boto3 client for the EC2 service._
+        instance_ids (list[str]): _IDs of the instances._
+        max_workers (int, optional): _How many calls can be in flight at once.
+            Defaults to `MAX_WORKERS`._
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures: list = [
+            executor.submit(
+                ec2_client.modify_instance_attribute,
+                InstanceId=instance_id,
+                DisableApiTermination={'Value' : False},
+            )
+            for instance_id in instance_ids
+        ]
+
+        # Let's make any errors surface here.
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+
+
+
+
+def terminate_fleet(
+        ec2_client,
+        instance_ids: list[str],
+        force: bool = False,
+        dryrun: bool = False
+) -> dict[str, list]:
+    """_Terminate a fleet of instances, in batches. A batch fails as a whole
+    when any of its instances is protected or doesn't exist, so those are
+    picked out of the error and the rest of the batch is sent again._
+
+    Args:
+        ec2_client: _A low level boto3 client for the EC2 service._
+        instance_ids (list[str]): _IDs of the instances._
+        force (bool, optional): _Turn termination protection off and terminate
+            protected instances too. Defaults to False._
+        dryrun (bool, optional): _Dry run switch for testing. Defaults to
+            False._
+
+    Returns:
+        dict[str, list]: _What happened to every instance._
+        `
+        {  `<br>`
+            "terminating" : list[str],  `<br>`
+            "protected" : list[str],  `<br>`
+            "missing" : list[str],  `<br>`
+        }
+        `
+    """
+    result: dict[str, list] = {"terminating" : [], "protected" : [], "missing" : []}
+    unprotected: set[str] = set()
+
+    batches: list[list[str]] = [
+        instance_ids[i:i + TERMINATE_BATCH_SIZE]
+        for i in range(0, len(instance_ids), TERMINATE_BATCH_SIZE)
+    ]
+
+    while batches:
+        batch: list[str] = batches.pop()
+        if not batch:
+            continue
+
+        try:
+            ec2_client.terminate_instances(InstanceIds=batch, DryRun=dryrun)
+            result["terminating"].extend(batch)
+            continue
+        except clients.client_error() as error:
+            code: str = error.response["Error"]["Code"]
+            message: str = error.response["Error"].get("Message", "")
+
+            # A successful dry run still comes back as an "error".
+            if code == "DryRunOperation":
+                result["terminating"].extend(batch)
+                continue
+
+            if code != "OperationNotPermitted" \
+                    and not code.startswith("InvalidInstanceID"):
+                raise
+
+            named: set[str] = set(INSTANCE_ID.findall(message)) & set(batch)
+
+        # If the message doesn't say which instances it means, let's halve the
+        # batch until it does, or until it's down to the one.
+        if not named:
+            if len(batch) == 1:
+                named = set(batch)
+            else:
+                middle: int = len(batch) // 2
+                batches.extend([batch[:middle], batch[middle:]])
+                continue
+
+        if code != "OperationNotPermitted":
+            result["missing"].extend(sorted(named))
+
+        elif force and not named & unprotected:
+            disable_termination_protection(ec2_client, sorted(named))
+            unprotected |= named
+            batches.append(batch)
+            continue
+
+        else:
+            result["protected"].extend(sorted(named))
+
+        batches.append([
+            instance_id for instance_id in batch if instance_id not in named
+        ])
+
+    return result
+
+
+
+
+def get_instance_states(
+        ec2_client,
+        instance_ids: list[str],
+        states: list[str] = None
+) -> dict[str, str]:
+    """_Get the state of every instance in a set, 200 instances to a call._
+
+    Args:
+        ec2_client: _A low level boto3 client for the EC2 service._
+        instance_ids (list[str]): _IDs of the instances._
+        states (list[str], optional): _Only instances in these states.
+            Defaults to every state._
+
+    Returns:
+        dict[str, str]: _The state of every instance EC2 knows about, keyed
+            by its ID. Instances terminated a while ago, or launched only just
+            now, may not be in there._
+    """
+    found: dict[str, str] = {}
+
+    for i in range(0, len(instance_ids), DESCRIBE_BATCH_SIZE):
+        filters: list[dict] = [
+            {
+                'Name' : 'instance-id',
+                'Values' : instance_ids[i:i + DESCRIBE_BATCH_SIZE],
+            },
+        ]
+        if states:
+            filters.append({'Name' : 'instance-state-name', 'Values' : states})
+
+        for reservation in paginate.items(
+            ec2_client, 'describe_instances', 'Reservations', Filters=filters
+        ):
+            for instance in reservation['Instances']:
+                found[instance['InstanceId']] = instance['State']['Name']
+
+    return found
+
+
+
+
+def get_live_instance_ids(
+        ec2_client,
+        instance_ids: list[str],
+        states: list[str] = LIVE_STATES
+) -> set[str]:
+    """_Find which of a set of instances are still up. Instances terminated a
+    while ago are gone from EC2 altogether, which is just as good._
+
+    Args:
+        ec2_client: _A low level boto3 client for the EC2 service._
+        instance_ids (list[str]): _IDs of the instances._
+        states (list[str], optional): _The states that count as up. Defaults
+            to every state but terminated._
+
+    Returns:
+        set[str]: _IDs of the instances in any of those states._
+    """
+    return set(get_instance_states(ec2_client, instance_ids, states))
+
+
+
+
+def wait_for_termination(
+        ec2_client,
+        instance_ids: list[str],
+        timeout: float = DEFAULT_TIMEOUT,
+        poll_seconds: float = POLL_SECONDS
+) -> list[str]:
+    """_Wait for a whole fleet to be terminated, with one poll loop. Every
+    poll only asks about the instances that were still up the last time._
+
+    Args:
+        ec2_client: _A low level boto3 client for the EC2 service._
+        instance_ids (list[str]): _IDs of the instances._
+        timeout (float, optional): _Seconds to wait at most. Defaults to
+            DEFAULT_TIMEOUT._
+        poll_seconds (float, optional): _Seconds between polls. Defaults to
+            POLL_SECONDS._
+
+    Returns:
+        list[str]: _IDs of the instances still up when we stopped waiting.
+            Empty if the whole fleet is terminated._
+    """
+    deadline: float = time.monotonic() + timeout
+    remaining: list[str] = sorted(instance_ids)
+
+    while remaining:
+        remaining = sorted(get_live_instance_ids(ec2_client, remaining))
+        if not remaining or time.monotonic() + poll_seconds > deadline:
+            break
+        time.sleep(poll_seconds)
+
+    return remaining
+
+
+
+
+def delete_fleet_alarms(
+        cloudwatch_client,
+        instance_ids: list[str],
+        prefixes: list[str] = None
+) -> list[str]:
+    """_Delete the alarms that watch any of a set of instances._
+
+    Args:
+        cloudwatch_client: _A low level boto3 client for CloudWatch._
+        instance_ids (list[str]): _IDs of the instances._
+        prefixes (list[str], optional): _Alarm name prefixes to look under.
+            Defaults to the prefixes of `alarms.TEMPLATES`._
+
+    Returns:
+        list[str]: _Names of the alarms that were deleted._
+    """
+    if prefixes is None:
+        prefixes = [prefix for _, prefix in alarms.TEMPLATES.values()]
+
+    fleet: set[str] = set(instance_ids)
+    names: list[str] = []
+
+    for prefix in prefixes:
+        for name, alarm in alarms.get_existing_alarms(
+            cloudwatch_client, prefix
+        ).items():
+            if any(
+                dimension['Name'] == 'InstanceId' and dimension['Value'] in fleet
+                for dimension in alarm.get('Dimensions', [])
+            ):
+                names.append(name)
+
+    alarms.apply_alarm_changes(
+        cloudwatch_client, {"create" : [], "update" : [], "delete" : names}
+    )
+
+    return names
+
+
+
+
+def teardown_fleet(
+        ec2_client,
+        instance_ids: list[str],
+        cloudwatch_client=None,
+        force: bool = False,
+        wait: bool = True,
+        timeout: float = DEFAULT_TIMEOUT,
+        dryrun: bool = False
+) -> dict[str, list]:
+    """_Terminate a fleet of instances, wait for all of it, and delete its
+    alarms._
+
+    Args:
+        ec2_client: _A low level boto3 client for the EC2 service._
+        instance_ids (list[str]): _IDs of the instances._
+        cloudwatch_client (optional): _A low level boto3 client for
+            CloudWatch. The alarms are only deleted when given._
+        force (bool, optional): _Terminate protected instances too. Defaults
+            to False._
+        wait (bool, optional): _Wait for the fleet to be terminated. Defaults
+            to True._
+        timeout (float, optional): _Seconds to wait at most. Defaults to
+            DEFAULT_TIMEOUT._
+        dryrun (bool, optional): _Dry run switch for testing. Nothing is
+            waited on or deleted. Defaults to False._
+
+    Returns:
+        dict[str, list]: _See `terminate_fleet()`, plus the instances still
+            up when we stopped waiting under "running", and the alarms that
+            were deleted under "alarms"._
+    """
+    result: dict[str, list] = terminate_fleet(
+        ec2_client, instance_ids, force, dryrun
+    )
+    result["running"] = []
+    result["alarms"] = []
+
+    if dryrun:
+        return result
+
+    if wait:
+        result["running"] = wait_for_termination(
+            ec2_client, result["terminating"], timeout
+        )
+
+    # Alarms of instances that are gone for good can go too.
+    if cloudwatch_client is not None:
+        result["alarms"] = delete_fleet_alarms(
+            cloudwatch_client,
+            [
+                instance_id
+                for instance_id in result["terminating"] + result["missing"]
+                if instance_id not in result["running"]
+            ],
+        )
+
+    return result
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Fleet Teardown",
+        description="Terminate a fleet of instances and wait for all of it",
+    )
+    parser.add_argument(
+        "-i", "--instance-ids",
+        nargs="+",
+        help="IDs of the instances in the fleet",
+    )
+    parser.add_argument(
+        "-t", "--tag",
+        action="append",
+        default=[],
+        help="Key=Value tag the instances in the fleet have. Can be repeated",
+    )
+    parser.add_argument(
+        "-f", "--force",
+        action="store_true",
+        help="Turn termination protection off and terminate those too",
+    )
+    parser.add_argument(
+        "-a", "--alarms",
+        action="store_true",
+        help="Also delete the CloudWatch alarms of the fleet",
+    )
+    parser.add_argument(
+        "--no-wait",
+        action="store_true",
+        help="Don't wait for the fleet to be terminated",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_TIMEOUT,
+        help=f"Seconds to wait at most. Defaults to {DEFAULT_TIMEOUT:g}",
+    )
+    parser.add_argument(
+        "--dryrun",
+        action="store_true",
+        help="Find the fleet, but only dry run the termination",
+    )
+    args = parser.parse_args()
+
+    if not args.instance_ids and not args.tag:
+        parser.error("Give the fleet with --instance-ids and/or --tag")
+
+    tags: dict[str, str] = dict(tag.split("=", 1) for tag in args.tag)
+
+    ec2_client = clients.client('ec2')
+    cloudwatch_client = clients.client('cloudwatch') if args.alarms else None
+
+    instance_ids: list[str] = alarms.get_fleet_instance_ids(
+        ec2_client, args.instance_ids, tags
+    )
+
+    start: float = time.monotonic()
+    result: dict[str, list] = teardown_fleet(
+        ec2_client,
+        instance_ids,
+        cloudwatch_client,
+        args.force,
+        not args.no_wait,
+        args.timeout,
+        args.dryrun,
+    )
+
+    print(f"Fleet of {len(instance_ids)} instance(s), "
+        f"in {time.monotonic() - start:.0f}s:")
+    print(f" - {'terminating' if args.no_wait or args.dryrun else 'terminated'}: "
+        f"{len(result['terminating']) - len(result['running'])}")
+    print(f" - still running: {len(result['running'])}")
+    print(f" - protected: {len(result['protected'])}")
+    print(f" - already gone: {len(result['missing'])}")
+    print(f" - alarms deleted: {len(result['alarms'])}")
+    for instance_id in result['protected'] + result['running']:
+        print(f"   {instance_id}")
+
+
+
+
+if __name__ == "__main__":
+    main()
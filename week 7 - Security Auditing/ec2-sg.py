@@ -6,58 +6,43 @@ Description: Output a report of a specific or all security groups. Focused on
 identifying security groups with internet access that is too open.
 '''
 
-import boto3
 import argparse
 
-# Let's create a parser to handle the arguments passed ot the script.
-# Let's also add some helpful about metadata.
-parser: argparse.ArgumentParser = argparse.ArgumentParser(
-    prog="SG Vulnerability Checker",
-)
-
-# Let's add the parameter to give check a security group individually.
-parser.add_argument(
-    "-s", "--security-group",
-    type=str,
-    help="Name of the security group in AWS",
-    dest="sg",
-    )
+from common import clients
 
-# ...registering the arguments passed ...
-args = parser.parse_args()
 
-# Let's get our low level client to make API calls. Nice.
-client_ec2 = boto3.client('ec2')
 
-# Now. let's either make an API call to get information about a SINGLE security
-# group given that the user passed in an argument for "--security-group" into
-# the script, or make an API call to give use back information on EVERY security
-# group if that was not specified.
 
-response: dict = {}
+def find_open_rules(security_groups: list[dict]) -> list[dict]:
+    """_Look at every inbound rule of some security groups, and flag the ones
+    that are open to the public internet._
 
-# SINGLE - API call
-if args.sg:
-    response = client_ec2.describe_security_groups(
-        GroupNames=[
-            args.sg,
-        ],
-    )
-# EVERY - API call
-else:
-    response = client_ec2.describe_security_groups()
+    Args:
+        security_groups (list[dict]): _Security group metadata, as found in
+            `response["SecurityGroups"]` of a
+            `EC2.client.describe_security_groups()` call._
 
-try:
-    # Let's grab the list of security groups from the response so we can parse
-    # through it to find the information that we want.
-    security_groups: list = response["SecurityGroups"]
+    Returns:
+        list[dict]: _Key information about every inbound rule._
+        `
+        {  `<br>`
+            "group_id" : str,  `<br>`
+            "group_name" : str,  `<br>`
+            "ip_ranges" : list[str],  `<br>`
+            "from_port" : int | str,  `<br>`
+            "to_port" : int | str,  `<br>`
+            "too_open" : bool,  `<br>`
+        }
+        `
+    """
+    rules: list[dict] = []
 
     # Let's take a closer look at each security group so that we can check
     # the rules in each one..
     for group in security_groups:
 
         # Okay, let's crack open the rules and look inside.
-        for inbound_rule in group["IpPermissions"]:
+        for inbound_rule in group.get("IpPermissions", []):
 
             # We are going to yank out a list of the IP ranges associated with
             # each rule. Let's initialize it.
@@ -68,35 +53,106 @@ try:
             too_open = False
 
             # Okay, let's have a look at each of the IP ranges
-            for ip_range in inbound_rule["IpRanges"]:
+            for ip_range in inbound_rule.get("IpRanges", []):
 
                 # Let's add each IP to that list we made above
                 ip_ranges.append(ip_range["CidrIp"])
 
-                # Let's flag it if it is too open 
+                # Let's flag it if it is too open
                 if ip_range["CidrIp"] == "0.0.0.0/0":
                     too_open = True
 
-            # Now we can print the name of the group that the rule is a part of.
-            print(f"\nSecurity Group Name: {group['GroupName']}")
+            # Some rules ('default' im looking at you) allow all traffic, and
+            # don't have any ports at all.
+            rules.append({
+                "group_id" : group["GroupId"],
+                "group_name" : group["GroupName"],
+                "ip_ranges" : ip_ranges,
+                "from_port" : inbound_rule.get("FromPort", "All"),
+                "to_port" : inbound_rule.get("ToPort", "All"),
+                "too_open" : too_open,
+            })
+
+    return rules
+
+
+
+
+def print_rules(rules: list[dict]):
+    """_Print the report of the inbound rules._
+
+    Args:
+        rules (list[dict]): _See `find_open_rules()`._
+    """
+    for rule in rules:
+
+        # Now we can print the name of the group that the rule is a part of.
+        print(f"\nSecurity Group Name: {rule['group_name']}")
+
+        # And we can print the associated IP ranges in of the rule
+        print("IP Ranges:")
+        for ipr in rule["ip_ranges"]:
+            print(f"  - {ipr}")
+
+        # Let's also print the ports
+        print(f"From Port: {rule['from_port']}")
+        print(f"To Port: {rule['to_port']}")
+
+        # Finally --a warning message if it was flagged for being too open.
+        if rule["too_open"]:
+            print("WARNING: Open to the public internet!")
+
+    # this separates the printed result from the consoles next stdin
+    print("\n")
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    # Let's also add some helpful about metadata.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="SG Vulnerability Checker",
+    )
+
+    # Let's add the parameter to give check a security group individually.
+    parser.add_argument(
+        "-s", "--security-group",
+        type=str,
+        help="Name of the security group in AWS",
+        dest="sg",
+        )
+
+    # ...registering the arguments passed ...
+    args = parser.parse_args()
+
+    # Let's get our low level client to make API calls. Nice. (This is also
+    # the first time boto3 gets imported, so --help doesn't pay for it.)
+    client_ec2 = clients.client('ec2')
+
+    # Now. let's either make an API call to get information about a SINGLE
+    # security group given that the user passed in an argument for
+    # "--security-group" into the script, or make an API call to give use back
+    # information on EVERY security group if that was not specified.
+
+    response: dict = {}
+
+    # SINGLE - API call
+    if args.sg:
+        response = client_ec2.describe_security_groups(
+            GroupNames=[
+                args.sg,
+            ],
+        )
+    # EVERY - API call
+    else:
+        response = client_ec2.describe_security_groups()
 
-            # And we can print the associated IP ranges in of the rule
-            print("IP Ranges:")
-            for ipr in ip_ranges:
-                print(f"  - {ipr}")
+    print_rules(find_open_rules(response["SecurityGroups"]))
 
-            # Let's also print the ports
-            print(f"From Port: {inbound_rule['FromPort']}")
-            print(f"To Port: {inbound_rule['ToPort']}")
 
-            # Finally --a warning message if it was flagged for being too open.
-            if too_open:
-                print("WARNING: Open to the public internet!")
 
-# Some security groups ('default' im looking at you) dont have all these fields,
-# let's catch that possible error
-except KeyError:
-    pass
 
-# this separates the printed result from the consoles next stdin
-print("\n")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
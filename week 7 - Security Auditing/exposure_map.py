@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+
+'''
+Author: Joseph Hopwood
+Description: Output a map of exactly which public IP:port pairs on the account
+can be reached from the internet. ec2-sg.py knows which rules are open, and
+ec2_report.py knows which instances have a public IP, but neither knows which
+of those rules actually apply to which of those IPs. Here, instances, their
+network interfaces, their security groups and the rules of those groups are
+each fetched in bulk, and joined in memory through dicts keyed by ID. Every
+resource is looked at a fixed number of times, so the join stays linear and a
+100k instance account maps in seconds.
+
+Only rules open to the whole internet (0.0.0.0/0 or ::/0) count, on addresses
+that are up: interfaces in use, of running instances, in subnets that route to
+an internet gateway. Network ACLs aren't looked at.
+
+Example:
+
+python3 cli.py exposure-map
+python3 cli.py exposure-map -p 22 -p 3389 -j exposure.json
+'''
+
+import argparse
+import json
+
+from common import clients, paginate
+
+import vpc_topology
+
+# The CIDRs that mean "the whole internet", and the address family each opens.
+OPEN_CIDRS: dict[str, tuple[str, str]] = {
+    "CidrIpv4" : ("0.0.0.0/0", "ipv4"),
+    "CidrIpv6" : ("::/0", "ipv6"),
+}
+
+# Ports that should never be open to the internet: remote access and
+# databases.
+SENSITIVE_PORTS: dict[int, str] = {
+    22 : "SSH",
+    3389 : "RDP",
+    1433 : "SQL Server",
+    3306 : "MySQL",
+    5432 : "PostgreSQL",
+    6379 : "Redis",
+    27017 : "MongoDB",
+}
+
+# ICMP rules open message types, not ports. FromPort is the type and ToPort
+# the code, -1 for all of them. Their names, by what IpProtocol calls them.
+ICMP_PROTOCOLS: dict[str, str] = {
+    "icmp" : "icmp",
+    "1" : "icmp",
+    "icmpv6" : "icmpv6",
+    "58" : "icmpv6",
+}
+
+# Every describe call the map is built from, and the key its results come back
+# under.
+SOURCES: dict[str, tuple[str, str]] = {
+    "instances" : ("describe_instances", "Reservations"),
+    "network_interfaces" : ("describe_network_interfaces", "NetworkInterfaces"),
+    "security_group_rules" : (
+        "describe_security_group_rules", "SecurityGroupRules"
+    ),
+}
+
+
+
+
+def open_rules_by_group(security_group_rules: list[dict]) -> dict[str, list[dict]]:
+    """_Index the inbound rules that are open to the whole internet by the
+    group they belong to._
+
+    Args:
+        security_group_rules (list[dict]): _Rule metadata, as found in
+            `response["SecurityGroupRules"]` of a
+            `EC2.client.describe_security_group_rules()` call._
+
+    Returns:
+        dict[str, list[dict]]: _The open rules, keyed by group ID._
+    """
+    by_group: dict[str, list[dict]] = {}
+
+    for rule in security_group_rules:
+        if rule.get("IsEgress"):
+            continue
+        for key, (cidr, family) in OPEN_CIDRS.items():
+            if rule.get(key) == cidr:
+                by_group.setdefault(rule["GroupId"], []).append({
+                    "rule_id" : rule.get("SecurityGroupRuleId"),
+                    "protocol" : rule["IpProtocol"],
+                    "from_port" : rule.get("FromPort", -1),
+                    "to_port" : rule.get("ToPort", -1),
+                    "cidr" : cidr,
+                    "family" : family,
+                })
+
+    return by_group
+
+
+
+
+def interfaces_of(instance: dict) -> list[dict]:
+    """_The network interfaces of an instance, from its own metadata. Instances
+    list theirs in the same shape as `describe_network_interfaces()` does, and
+    the ones that don't get one made up from their primary IP and groups._"""
+    if instance.get("NetworkInterfaces"):
+        return [
+            dict(
+                interface,
+                Attachment={"InstanceId" : instance["InstanceId"]},
+                SubnetId=interface.get("SubnetId", instance.get("SubnetId")),
+            )
+            for interface in instance["NetworkInterfaces"]
+        ]
+
+    interface: dict = {
+        "NetworkInterfaceId" : instance["InstanceId"],
+        "Status" : "in-use",
+        "Attachment" : {"InstanceId" : instance["InstanceId"]},
+        "SubnetId" : instance.get("SubnetId"),
+        "Groups" : instance.get("SecurityGroups", []),
+    }
+    if instance.get("PublicIpAddress"):
+        interface["Association"] = {"PublicIp" : instance["PublicIpAddress"]}
+    return [interface]
+
+
+
+
+def public_addresses(interface: dict) -> list[tuple[str, str]]:
+    """_Every public address of a network interface: its public IPv4 (primary
+    and secondary) and its IPv6 addresses, which are all public._
+
+    Returns:
+        list[tuple[str, str]]: _(address, family) of every address._
+    """
+    addresses: dict[str, str] = {}
+
+    if interface.get("Association", {}).get("PublicIp"):
+        addresses[interface["Association"]["PublicIp"]] = "ipv4"
+    for private in interface.get("PrivateIpAddresses", []):
+        if private.get("Association", {}).get("PublicIp"):
+            addresses[private["Association"]["PublicIp"]] = "ipv4"
+    for ipv6 in interface.get("Ipv6Addresses", []):
+        addresses[ipv6["Ipv6Address"]] = "ipv6"
+
+    return list(addresses.items())
+
+
+
+
+def build_exposure_map(
+        instances: list[dict],
+        security_group_rules: list[dict],
+        network_interfaces: list[dict] = None,
+        topology: vpc_topology.NetworkTopology = None
+) -> list[dict]:
+    """_Join instances, network interfaces, security groups and their rules
+    into every public address and port the internet can reach. Every join is a
+    dict lookup, so the work grows with the number of resources, not with
+    their product._
+
+    Args:
+        instances (list[dict]): _Instance metadata, as found in the
+            `["Instances"]` of `response["Reservations"]` of a
+            `EC2.client.describe_instances()` call._
+        security_group_rules (list[dict]): _See `open_rules_by_group()`._
+        network_interfaces (list[dict], optional): _Interface metadata, as
+            found in `response["NetworkInterfaces"]` of a
+            `EC2.client.describe_network_interfaces()` call. It also has the
+            interfaces of load balancers, NAT gateways and the like. Defaults
+            to the interfaces of the instances only._
+        topology (vpc_topology.NetworkTopology, optional): _Leave out the
+            interfaces in subnets that don't route to an internet gateway.
+            Defaults to keeping them all._
+
+    Returns:
+        list[dict]: _Every exposed address and port range, ordered by address._
+        `
+        {  `<br>`
+            "address" : str,  `<br>`
+            "protocol" : str, "-1" for every protocol  `<br>`
+            "from_port" : int,  `<br>`
+            "to_port" : int,  `<br>`
+            "resource" : str, the instance, or the interface  `<br>`
+            "name" : str, of the instance, if it has one  `<br>`
+            "interface_id" : str,  `<br>`
+            "group_id" : str,  `<br>`
+            "rule_id" : str,  `<br>`
+        }
+        `
+    """
+    rules_by_group: dict[str, list[dict]] = open_rules_by_group(
+        security_group_rules
+    )
+    instances_by_id: dict[str, dict] = {
+        instance["InstanceId"] : instance for instance in instances
+    }
+
+    if network_interfaces is None:
+        network_interfaces = [
+            interface
+            for instance in instances
+            for interface in interfaces_of(instance)
+        ]
+
+    public_subnets: dict[str, bool] = {}
+    exposure: list[dict] = []
+
+    for interface in network_interfaces:
+        if interface.get("Status", "in-use") != "in-use":
+            continue
+
+        # An interface of a stopped instance isn't answering, public IP or not.
+        instance_id: str = interface.get("Attachment", {}).get("InstanceId")
+        instance: dict = instances_by_id.get(instance_id, {})
+        if instance and instance["State"]["Name"] != "running":
+            continue
+
+        addresses: list[tuple[str, str]] = public_addresses(interface)
+        if not addresses:
+            continue
+
+        # Many interfaces share a subnet, so every subnet is only looked up
+        # the once.
+        subnet_id: str = interface.get("SubnetId")
+        if topology is not None and subnet_id in topology.subnets:
+            if subnet_id not in public_subnets:
+                public_subnets[subnet_id] = topology.is_public(subnet_id)
+            if not public_subnets[subnet_id]:
+                continue
+
+        name: str = next(
+            (tag["Value"] for tag in instance.get("Tags", []) if tag["Key"] == "Name"),
+            None,
+        )
+
+        for group in interface.get("Groups", []):
+            for rule in rules_by_group.get(group["GroupId"], []):
+                for address, family in addresses:
+                    if family != rule["family"]:
+                        continue
+                    exposure.append({
+                        "address" : address,
+                        "protocol" : rule["protocol"],
+                        "from_port" : rule["from_port"],
+                        "to_port" : rule["to_port"],
+                        "resource" : instance_id or interface["NetworkInterfaceId"],
+                        "name" : name,
+                        "interface_id" : interface["NetworkInterfaceId"],
+                        "group_id" : group["GroupId"],
+                        "rule_id" : rule["rule_id"],
+                    })
+
+    exposure.sort(key=lambda entry: (entry["address"], entry["from_port"]))
+    return exposure
+
+
+
+
+def port_label(entry: dict) -> str:
+    """_Put the ports of an entry in a form people can read, e.g. "443/tcp".
+    ICMP has no ports, so those get their type instead, e.g. "icmp type 8"._"""
+    if entry["protocol"] == "-1":
+        return "all"
+    if entry["protocol"] in ICMP_PROTOCOLS:
+        label: str = ICMP_PROTOCOLS[entry["protocol"]]
+        if entry["from_port"] != -1:
+            label += f" type {entry['from_port']}"
+            if entry["to_port"] != -1:
+                label += f" code {entry['to_port']}"
+        return label
+    ports: str = (
+        f"{entry['from_port']}" if entry["from_port"] == entry["to_port"]
+        else f"{entry['from_port']}-{entry['to_port']}"
+    )
+    return f"{ports}/{entry['protocol']}"
+
+
+
+
+def sensitive_ports(entry: dict) -> list[str]:
+    """_Names of the sensitive ports an entry opens, if any._"""
+    if entry["protocol"] == "-1":
+        return list(SENSITIVE_PORTS.values())
+    if entry["protocol"] not in ("tcp", "6"):
+        return []
+    return [
+        name for port, name in SENSITIVE_PORTS.items()
+        if entry["from_port"] <= port <= entry["to_port"]
+    ]
+
+
+
+
+def filter_ports(exposure: list[dict], ports: list[int]) -> list[dict]:
+    """_Only the entries that open any of some ports. ICMP entries open no
+    ports at all, whatever their type._"""
+    return [
+        entry for entry in exposure
+        if entry["protocol"] == "-1"
+        or (entry["protocol"] not in ICMP_PROTOCOLS and any(
+            entry["from_port"] <= port <= entry["to_port"] for port in ports
+        ))
+    ]
+
+
+
+
+def print_exposure_map(exposure: list[dict]):
+    """_Print every exposed address and port._
+
+    Args:
+        exposure (list[dict]): _See `build_exposure_map()`._
+    """
+    for entry in exposure:
+        address: str = entry["address"]
+        if ":" in address:
+            address = f"[{address}]"
+
+        # ICMP has no port to put after the address.
+        separator: str = " " if entry["protocol"] in ICMP_PROTOCOLS else ":"
+        sensitive: list[str] = sensitive_ports(entry)
+        print(f"{address + separator + port_label(entry):<32}"
+            f"{entry['resource']:<24}{entry['name'] or '':<24}"
+            f"{entry['group_id']:<24}"
+            f"{'  <- ' + ', '.join(sensitive) if sensitive else ''}")
+
+    pairs: set[tuple] = {
+        (entry["address"], port_label(entry)) for entry in exposure
+        if entry["protocol"] not in ICMP_PROTOCOLS
+    }
+    icmp: set[str] = {
+        entry["address"] for entry in exposure
+        if entry["protocol"] in ICMP_PROTOCOLS
+    }
+    resources: set[str] = {entry["resource"] for entry in exposure}
+    print(f"\n{len(pairs)} address:port pair(s) reachable from the internet, "
+        + (f"{len(icmp)} address(es) open to ICMP, " if icmp else "")
+        + f"on {len(resources)} resource(s)\n")
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Exposure Map",
+        description="Map every public IP:port that is reachable from the "
+            "internet",
+    )
+    parser.add_argument(
+        "-p", "--port",
+        type=int,
+        action="append",
+        help="Only show this port. Can be repeated. Defaults to every port",
+        dest="ports",
+    )
+    parser.add_argument(
+        "-j", "--json",
+        type=str,
+        help="Also write the map to this JSON file",
+    )
+    args = parser.parse_args()
+
+    # Let's get our low level client (this is the first time boto3 gets
+    # imported, so --help doesn't pay for it), and fetch everything the map
+    # needs, once.
+    ec2_client = clients.client('ec2')
+
+    sources: dict[str, list] = {
+        source: list(paginate.items(ec2_client, operation, result_key))
+        for source, (operation, result_key) in SOURCES.items()
+    }
+
+    exposure: list[dict] = build_exposure_map(
+        [
+            instance
+            for reservation in sources["instances"]
+            for instance in reservation["Instances"]
+        ],
+        sources["security_group_rules"],
+        sources["network_interfaces"],
+        vpc_topology.NetworkTopology.from_api(ec2_client),
+    )
+    if args.ports:
+        exposure = filter_ports(exposure, args.ports)
+
+    print_exposure_map(exposure)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(exposure, file, indent=2)
+
+
+
+
+if __name__ == "__main__":
+    main()
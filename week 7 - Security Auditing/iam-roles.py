@@ -1,97 +1,181 @@
 '''
 Author: Joseph Hopwood
 Description: Output a report of all IAM roles created in the last 90
-days. Focused on identifying managed and unmanaged policies associated with 
+days. Focused on identifying managed and unmanaged policies associated with
 each role.
 '''
 
+import argparse
 import datetime
-import botocore.exceptions
-import pytz
-
-import boto3
-import botocore
-
-# Let's get the date and time of this moment 90 days ago
-# We will use this later to filter the results of IAM roles on our account.
-now: datetime.datetime = pytz.utc.localize(datetime.datetime.utcnow())
-ninety_days_ago: datetime.datetime = now - datetime.timedelta(days=90)
-
-# IAM client
-client_iam = boto3.client('iam')
-
-# Get a list of all the IAM roles on the account
-response_roles: dict = client_iam.list_roles()
-
-# Let's identify and organize the data that we want to get,
-role_metadata: list = []
-# It will be populated with dictionaries formatted as follows
-###########################################################
-# {
-#     "RoleName" : str,
-#     "CreateDate" : datetime.datetime,
-#     "ManagedPolicies" : [
-#         str,
-#     ],
-#     "UnmanagedPolicies" : [
-#         str
-#     ],
-# }
-###########################################################
-
-# Let's go through all the roles that it handed back, filter for the ones that
-# we want, and then extract the metadata from them that we are looking for.
-for role in response_roles["Roles"]:
-    
-    # First, let's find out when the roles was created. This is important so we
-    # can filter them based on their age.
-    role_create_date: datetime.datetime = role["CreateDate"]
-
-    # Let's filter such that we only get the roles back that were created in the
-    # last 90 days.
-    if ninety_days_ago < role_create_date:
-
-        # Let's extract the name of the role and save it for later. This is one
-        # of the things that we are looking for.
-        role_name: str = role["RoleName"]
-
-        try:
-
-            # Let's also request a list of all the managed policies associated
-            # with this role. We were looking for this metadata as well.
-            response_managed: dict = client_iam.list_attached_role_policies(
-                RoleName=role_name
-            )
+import os
+
+from common import clients, paginate
+
+import iam_analyzer
+import iam_snapshot
+
+# How many roles we are willing to ask IAM about at the same time. IAM throttles
+# pretty aggressively, so we don't want to go too wild here.
+MAX_WORKERS: int = 16
+
+
+
+
+def get_roles(iam_client):
+    """_Yield every IAM role on the account. `list_roles()` only hands back
+    100 roles at a time, so this walks through all of the pages._
+
+    Args:
+        iam_client: _A low level boto3 client for the IAM service._
+
+    Yields:
+        dict: _Metadata about a single role, as found in
+            `response["Roles"]` of a `IAM.client.list_roles()` call._
+    """
+    # Let's use a paginator, so that we don't miss anything past the first page.
+    # It fetches the next page while the caller works through this one.
+    yield from paginate.items(iam_client, 'list_roles', 'Roles')
+
+
+
+
+def get_managed_policies(iam_client, role_name: str) -> tuple[list, bool]:
+    """_Get the names of all the managed policies attached to a role._
+
+    Args:
+        iam_client: _A low level boto3 client for the IAM service._
+        role_name (str): _Name of the role to look up._
 
-            # Let's do the same thing fo the UNmanaged policies as well.
-            response_unmanaged: dict = client_iam.list_role_policies(
-                RoleName=role_name
+    Returns:
+        tuple[list, bool]: _The names of the managed policies, and whether or
+            not we were denied access while looking them up._
+    """
+    managed_policy_names: list = []
+
+    try:
+        # The names are a bit nested in the response, so we have to pull them
+        # out of each attached policy.
+        for att_policy in paginate.items(
+            iam_client, 'list_attached_role_policies', 'AttachedPolicies',
+            RoleName=role_name,
+        ):
+            managed_policy_names.append(att_policy['PolicyName'])
+
+    # Catch and diffuse cases where we dont have the perms to view a policy.
+    # We hand that back to the caller so it gets recorded for THIS role only.
+    except clients.client_error() as error:
+        if error.response["Error"]["Code"] == "AccessDenied":
+            return managed_policy_names, True
+        raise
+
+    return managed_policy_names, False
+
+
+
+
+def get_unmanaged_policies(iam_client, role_name: str) -> tuple[list, bool]:
+    """_Get the names of all the unmanaged (inline) policies of a role._
+
+    Args:
+        iam_client: _A low level boto3 client for the IAM service._
+        role_name (str): _Name of the role to look up._
+
+    Returns:
+        tuple[list, bool]: _The names of the unmanaged policies, and whether or
+            not we were denied access while looking them up._
+    """
+    unmanaged_policy_names: list = []
+
+    try:
+        unmanaged_policy_names.extend(
+            paginate.items(
+                iam_client, 'list_role_policies', 'PolicyNames',
+                RoleName=role_name,
             )
+        )
+
+    except clients.client_error() as error:
+        if error.response["Error"]["Code"] == "AccessDenied":
+            return unmanaged_policy_names, True
+        raise
+
+    return unmanaged_policy_names, False
+
+
+
+
+def audit_roles(
+        iam_client,
+        created_after: datetime.datetime,
+        max_workers: int = MAX_WORKERS
+) -> list[dict]:
+    """_Collect the role metadata for every role created after a given date.
+    Both policy lists of every role are fetched concurrently in a thread
+    pool._
+
+    Args:
+        iam_client: _A low level boto3 client for the IAM service._
+        created_after (datetime.datetime): _Only roles created after this
+            (timezone aware) moment are audited._
+        max_workers (int, optional): _How many IAM calls can be in flight at
+            once. Defaults to `MAX_WORKERS`._
+
+    Returns:
+        list[dict]: _Role metadata, in the order IAM listed the roles._
+        `
+        {  `<br>`
+            "RoleName" : str,  `<br>`
+            "CreateDate" : datetime.datetime,  `<br>`
+            "ManagedPolicies" : list[str],  `<br>`
+            "UnmanagedPolicies" : list[str],  `<br>`
+            "AccessDenied" : bool,  `<br>`
+        }
+        `
+    """
+    # We keep the futures for each role together, so that the results of one
+    # role can never get mixed up with the results of another.
+    pending: list[tuple] = []
+
+    # Imported here, so that --help never pays for the thread pool.
+    import concurrent.futures
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+
+        # Roles stream in page by page, and we can start asking about their
+        # policies while the next page is still on its way.
+        for role in get_roles(iam_client):
+
+            # Let's filter such that we only get the roles back that were
+            # created in the last 90 days.
+            if not created_after < role["CreateDate"]:
+                continue
+
+            pending.append((
+                role,
+                executor.submit(
+                    get_managed_policies, iam_client, role["RoleName"]
+                ),
+                executor.submit(
+                    get_unmanaged_policies, iam_client, role["RoleName"]
+                ),
+            ))
+
+        # Now, let's package everything up real cute as the results come in.
+        role_metadata: list[dict] = []
+        for role, managed_future, unmanaged_future in pending:
+            managed_names, managed_denied = managed_future.result()
+            unmanaged_names, unmanaged_denied = unmanaged_future.result()
+
+            role_metadata.append({
+                "RoleName" : role["RoleName"],
+                "CreateDate" : role["CreateDate"],
+                "ManagedPolicies" : managed_names,
+                "UnmanagedPolicies" : unmanaged_names,
+                "AccessDenied" : managed_denied or unmanaged_denied,
+            })
+
+    return role_metadata
 
-        # Catch and diffuse cases where we dont have the perms to view a policy
-        except botocore.exceptions.ClientError as error:
-            if error.response["Error"]["Code"] == "AccessDenied":
-                pass
-        
-        # Let's get the list of the names of the managed policies. We don't have
-        # to do this with the UNmanaged policies. But, with the managed ones,
-        # the names are a bit nested in the response and require a little more 
-        # work than just getting the list of names handed to us in the response.
-        managed_policy_names: list = []
-        for att_policy in response_managed["AttachedPolicies"]:
-            managed_policy_names.append(att_policy["PolicyName"])
-
-        # Now, we've obtained all the metadata that we were looking for. Let's 
-        # package it up real cute in this nice dictionary and ship it off to the
-        # list of role metadata that was created in the beginning of the
-        # script. Then, once we have all of the roles done, we can work with
-        # each dictionary easily, and print off the values.
-        role_metadata.append({
-            "RoleName" : role_name,
-            "CreateDate" : role_create_date,
-            "ManagedPolicies" : managed_policy_names,
-            "UnmanagedPolicies" : response_unmanaged["PolicyNames"],
-        })
 
 
 
@@ -102,14 +186,14 @@ def print_policies(category_name: str, display_category: str, role: dict):
     both categories of policies._
 
     Args:
-        category_name (str): _The category of policy it is. 
+        category_name (str): _The category of policy it is.
             `"UnmanagedPolicies"` or `"ManagedPolicies"`._
-        display_category (str): _What you would like to title the section the 
+        display_category (str): _What you would like to title the section the
             policies display under when they are printed out. For instance,
             "Managed Policies"._
         role (dict): _The role that will have it's policies printed._
     """
-    # Let's consider if the role has any policies under the category or not. 
+    # Let's consider if the role has any policies under the category or not.
     if role[category_name]:
 
         # If it does, then we can print the section title.
@@ -128,7 +212,111 @@ def print_policies(category_name: str, display_category: str, role: dict):
 
 
 
-for role in role_metadata:
-    print(f"\n  {role['RoleName']}, created {str(role['CreateDate'])}")
-    print_policies("ManagedPolicies", "Managed Policies", role)
-    print_policies("UnmanagedPolicies", "Unmanaged Policies", role)
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    # Let's also add some helpful about metadata.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="IAM Role Auditor",
+    )
+
+    # Let's add the parameter to answer the audit from a snapshot file instead
+    # of asking IAM about every role. If the file isn't there yet, we make it.
+    parser.add_argument(
+        "-s", "--snapshot",
+        type=str,
+        help="Path of an IAM snapshot file to audit from (created if missing)",
+        dest="snapshot",
+        )
+
+    # ...a switch to throw away an old snapshot and pull a new one...
+    parser.add_argument(
+        "-r", "--refresh",
+        action="store_true",
+        help="Pull a fresh snapshot even if the snapshot file already exists",
+        dest="refresh",
+        )
+
+    # ...and a query that only the snapshot can answer cheaply.
+    parser.add_argument(
+        "-p", "--policy-arn",
+        type=str,
+        help="List the roles with this managed policy attached (snapshot only)",
+        dest="policy_arn",
+        )
+
+    # ...and the permission questions, like "who can do s3:* on *".
+    parser.add_argument(
+        "-c", "--can",
+        type=str,
+        help="List the roles allowed to perform this action (snapshot only)",
+        dest="action",
+        )
+    parser.add_argument(
+        "-o", "--on",
+        type=str,
+        default="*",
+        help="Resource ARN for --can. Defaults to *",
+        dest="resource",
+        )
+
+    # ...registering the arguments passed ...
+    args = parser.parse_args()
+
+    # Let's get the date and time of this moment 90 days ago
+    # We will use this later to filter the results of IAM roles on our account.
+    now: datetime.datetime = datetime.datetime.now(datetime.timezone.utc)
+    ninety_days_ago: datetime.datetime = now - datetime.timedelta(days=90)
+
+    # IAM client. We let botocore back off adaptively when IAM throttles us,
+    # and give it enough connections for every worker in the pool.
+    client_iam = clients.client('iam', max_pool_connections=MAX_WORKERS)
+
+    role_metadata: list[dict] = []
+
+    # SNAPSHOT - a few big API calls at most, or none if we already have it
+    if args.snapshot:
+        snapshot: iam_snapshot.IamSnapshot
+
+        if os.path.exists(args.snapshot) and not args.refresh:
+            snapshot = iam_snapshot.IamSnapshot.load(args.snapshot)
+        else:
+            snapshot = iam_snapshot.IamSnapshot.from_api(client_iam)
+            snapshot.save(args.snapshot)
+
+        print(f"\nUsing IAM snapshot taken {str(snapshot.taken_at)}")
+
+        if args.policy_arn:
+            print(f"\n  Roles with {args.policy_arn} attached:")
+            for role_name in snapshot.roles_with_policy(args.policy_arn):
+                print(f"   - {role_name}")
+
+        if args.action:
+            policy_index = iam_analyzer.PolicyIndex.from_snapshot(
+                snapshot, client_iam
+            )
+            print(f"\n  Roles that can do {args.action} on {args.resource}:")
+            for role_name in policy_index.who_can(args.action, args.resource):
+                print(f"   - {role_name}")
+
+        role_metadata = snapshot.audit(ninety_days_ago)
+
+    # LIVE - go through all the roles, filter for the ones that we want, and
+    # then extract the metadata from them that we are looking for.
+    else:
+        if args.policy_arn or args.action:
+            parser.error("--policy-arn and --can need a --snapshot")
+        role_metadata = audit_roles(client_iam, ninety_days_ago)
+
+    for role in role_metadata:
+        print(f"\n  {role['RoleName']}, created {str(role['CreateDate'])}")
+        if role["AccessDenied"]:
+            print("    (AccessDenied) Unauthorized to view policies")
+        print_policies("ManagedPolicies", "Managed Policies", role)
+        print_policies("UnmanagedPolicies", "Unmanaged Policies", role)
+
+
+
+
+if __name__ == "__main__":
+    main()
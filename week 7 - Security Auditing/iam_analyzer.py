@@ -0,0 +1,441 @@
+'''
+Author: Joseph Hopwood
+Description: Module containing an effective-permission index over IAM policy
+documents. Policy statements are compiled once into an index keyed by service
+prefix, so questions like "which roles can do s3:* on *" are answered without
+walking every policy of every role.
+'''
+
+import json
+import re
+import urllib.parse
+
+import iam_snapshot
+
+
+
+
+def load_policy_document(document) -> dict:
+    """_Turn a policy document into a dictionary. boto3 usually decodes them
+    for us, but IAM hands them back URL encoded when it doesn't._
+
+    Args:
+        document (dict | str): _The policy document._
+
+    Returns:
+        dict: _The decoded policy document._
+    """
+    if isinstance(document, dict):
+        return document
+    return json.loads(urllib.parse.unquote(document))
+
+
+
+
+def as_list(value) -> list:
+    """_Policy fields (and the statement list itself) can be a single value or
+    a list of them. This makes it always a list._"""
+    if value is None:
+        return []
+    if isinstance(value, (str, dict)):
+        return [value]
+    return list(value)
+
+
+
+
+# Compiled wildcard patterns, shared by every statement that uses them.
+_pattern_cache: dict[tuple[str, bool], re.Pattern] = {}
+
+
+def compile_pattern(pattern: str, ignore_case: bool = False) -> re.Pattern:
+    """_Compile an IAM wildcard pattern (`*` and `?`) into a regex. Each
+    distinct pattern is only compiled once._
+
+    Args:
+        pattern (str): _The IAM action or resource pattern._
+        ignore_case (bool, optional): _Actions are case insensitive, resources
+            are not. Defaults to False._
+
+    Returns:
+        re.Pattern: _The compiled pattern, to be used with `fullmatch()`._
+    """
+    key: tuple[str, bool] = (pattern, ignore_case)
+    compiled: re.Pattern = _pattern_cache.get(key)
+
+    if compiled is None:
+        regex: str = "".join(
+            ".*" if char == "*" else "." if char == "?" else re.escape(char)
+            for char in pattern
+        )
+        compiled = re.compile(regex, re.IGNORECASE if ignore_case else 0)
+        _pattern_cache[key] = compiled
+
+    return compiled
+
+
+
+
+def service_of(action: str) -> str:
+    """_Get the service prefix of an action, or "*" if the prefix itself is a
+    wildcard (e.g. `"*"` or `"s*:Get*"`)._"""
+    service: str = action.split(":", 1)[0].lower()
+    if "*" in service or "?" in service or ":" not in action:
+        return "*"
+    return service
+
+
+
+
+class PolicyDocumentCache:
+    """
+    Managed policy documents keyed by policy ARN and version. A managed policy
+    that is attached to a thousand roles is fetched and parsed exactly once.
+    """
+
+
+    def __init__(self, iam_client=None):
+        """Initialize a new, empty cache.
+
+        Args:
+            iam_client (optional): A low level boto3 client for the IAM service.
+                Used to fetch documents the cache doesn't have yet. Without one,
+                the cache only knows what it was given.
+        """
+        self.iam_client = iam_client
+        self.documents: dict[tuple[str, str], dict] = {}
+        self.default_versions: dict[str, str] = {}
+
+
+    def add(self, policy_arn: str, version_id: str, document, default=False):
+        """Put a policy document in the cache.
+
+        Args:
+            policy_arn (str): ARN of the managed policy.
+            version_id (str): Version of the document.
+            document (dict | str): The policy document.
+            default (bool, optional): Whether this is the default version.
+        """
+        self.documents[(policy_arn, version_id)] = load_policy_document(document)
+        if default:
+            self.default_versions[policy_arn] = version_id
+
+
+    def get(self, policy_arn: str, version_id: str = None) -> tuple[str, dict]:
+        """Get a policy document, fetching it from IAM if we have to.
+
+        Args:
+            policy_arn (str): ARN of the managed policy.
+            version_id (str, optional): Version of the document. Defaults to
+                the default version of the policy.
+
+        Returns:
+            tuple[str, dict]: The version id and the policy document. The
+                document is None if it is unknown and there is no client.
+        """
+        version_id = version_id or self.default_versions.get(policy_arn)
+
+        if (policy_arn, version_id) in self.documents:
+            return version_id, self.documents[(policy_arn, version_id)]
+
+        if not self.iam_client:
+            return version_id, None
+
+        # We don't know which version is the default yet. Let's ask.
+        if not version_id:
+            response: dict = self.iam_client.get_policy(PolicyArn=policy_arn)
+            version_id = response["Policy"]["DefaultVersionId"]
+            self.default_versions[policy_arn] = version_id
+
+            if (policy_arn, version_id) in self.documents:
+                return version_id, self.documents[(policy_arn, version_id)]
+
+        response = self.iam_client.get_policy_version(
+            PolicyArn=policy_arn,
+            VersionId=version_id,
+        )
+        self.add(policy_arn, version_id, response["PolicyVersion"]["Document"])
+
+        return version_id, self.documents[(policy_arn, version_id)]
+
+
+
+
+class PolicyIndex:
+    """
+    Action/resource index over the compiled policy statements of many roles.
+    """
+
+
+    class Statement:
+        """
+        A single compiled policy statement.
+        """
+
+
+        def __init__(self, statement: dict):
+            """Compile a policy statement.
+
+            Args:
+                statement (dict): A statement from a policy document.
+            """
+            self.effect: str = statement.get("Effect", "Allow")
+
+            # Conditions aren't evaluated, so we only need to know if there
+            # are any.
+            self.conditional: bool = bool(statement.get("Condition"))
+
+            # Statements use either Action or NotAction, and either Resource
+            # or NotResource.
+            self.not_action: bool = "NotAction" in statement
+            self.actions: list[str] = as_list(
+                statement.get("NotAction" if self.not_action else "Action")
+            )
+            self.not_resource: bool = "NotResource" in statement
+            self.resources: list[str] = as_list(
+                statement.get("NotResource" if self.not_resource else "Resource")
+            )
+
+            self.action_patterns: list[re.Pattern] = [
+                compile_pattern(action, ignore_case=True)
+                for action in self.actions
+            ]
+            self.resource_patterns: list[re.Pattern] = [
+                compile_pattern(resource) for resource in self.resources
+            ]
+
+
+        def matches_action(self, action: str) -> bool:
+            """Whether this statement covers an action."""
+            matched: bool = any(
+                pattern.fullmatch(action) for pattern in self.action_patterns
+            )
+            return matched != self.not_action
+
+
+        def matches_resource(self, resource: str) -> bool:
+            """Whether this statement covers a resource."""
+            matched: bool = any(
+                pattern.fullmatch(resource) for pattern in self.resource_patterns
+            )
+            return matched != self.not_resource
+
+
+
+
+    def __init__(self, documents: PolicyDocumentCache = None):
+        """Initialize a new, empty index.
+
+        Args:
+            documents (PolicyDocumentCache, optional): Where managed policy
+                documents come from. Defaults to an empty cache with no client.
+        """
+        self.documents: PolicyDocumentCache = documents or PolicyDocumentCache()
+
+        # Every compiled statement lives here, and everything else refers to
+        # them by their position in this list.
+        self.statements: list[PolicyIndex.Statement] = []
+
+        # Statement ids of a policy document, keyed by (policy ARN, version)
+        # for managed policies and (role name, policy name) for inline ones.
+        self.compiled_policies: dict[tuple[str, str], list[int]] = {}
+
+        # Which roles each statement applies to.
+        self.statement_roles: dict[int, set[str]] = {}
+
+        # Effect -> service prefix -> action pattern -> statement ids. Anything
+        # with a wildcard service lands under "*".
+        self.action_index: dict[str, dict[str, dict[str, set[int]]]] = {
+            "Allow" : {},
+            "Deny" : {},
+        }
+
+        # NotAction statements can't be indexed by service, they are checked
+        # one by one. There are usually very few of them.
+        self.not_action_statements: dict[str, list[int]] = {
+            "Allow" : [],
+            "Deny" : [],
+        }
+
+        # Answers we have already worked out, until the index changes.
+        self._query_cache: dict[tuple[str, str], list[str]] = {}
+
+
+    @classmethod
+    def from_snapshot(
+            cls,
+            snapshot: iam_snapshot.IamSnapshot,
+            iam_client=None
+    ) -> "PolicyIndex":
+        """Build an index of every role in an IAM snapshot.
+
+        Args:
+            snapshot (iam_snapshot.IamSnapshot): The snapshot to index.
+            iam_client (optional): A low level boto3 client for the IAM service,
+                used for managed policies the snapshot doesn't hold.
+
+        Returns:
+            PolicyIndex: The new index.
+        """
+        documents: PolicyDocumentCache = PolicyDocumentCache(iam_client)
+
+        # Let's seed the document cache with everything the snapshot has.
+        for policy in snapshot.policies:
+            for version in policy.get("PolicyVersionList", []):
+                documents.add(
+                    policy["Arn"],
+                    version["VersionId"],
+                    version["Document"],
+                    default=version.get("IsDefaultVersion", False)
+                        or version["VersionId"] == policy.get("DefaultVersionId"),
+                )
+
+        index: PolicyIndex = cls(documents)
+
+        for role in snapshot.roles:
+            index.add_role(
+                role["RoleName"],
+                [
+                    att_policy["PolicyArn"]
+                    for att_policy in role.get("AttachedManagedPolicies", [])
+                ],
+                snapshot.inline_policies(role["RoleName"]),
+            )
+
+        return index
+
+
+    def _compile_policy(self, key: tuple[str, str], document) -> list[int]:
+        """Compile the statements of a policy document, once per key."""
+        if key in self.compiled_policies:
+            return self.compiled_policies[key]
+
+        statement_ids: list[int] = []
+
+        for statement in as_list(load_policy_document(document).get("Statement")):
+            compiled = self.Statement(statement)
+
+            # A statement that is neither Allow nor Deny is malformed, and IAM
+            # would reject it. Let's leave it out rather than guess.
+            if compiled.effect not in self.action_index:
+                continue
+
+            statement_id: int = len(self.statements)
+            self.statements.append(compiled)
+            self.statement_roles[statement_id] = set()
+            statement_ids.append(statement_id)
+
+            if compiled.not_action:
+                self.not_action_statements[compiled.effect].append(statement_id)
+                continue
+
+            by_service = self.action_index[compiled.effect]
+            for action in compiled.actions:
+                pattern: str = action.lower()
+                compile_pattern(pattern, ignore_case=True)
+                by_service.setdefault(service_of(action), {}).setdefault(
+                    pattern, set()
+                ).add(statement_id)
+
+        self.compiled_policies[key] = statement_ids
+        return statement_ids
+
+
+    def add_role(
+            self,
+            role_name: str,
+            managed_policy_arns: list[str],
+            inline_policies: dict[str, dict]
+    ):
+        """Add a role and its policies to the index.
+
+        Args:
+            role_name (str): Name of the role.
+            managed_policy_arns (list[str]): ARNs of the attached managed
+                policies.
+            inline_policies (dict[str, dict]): Inline policy documents, keyed
+                by policy name.
+        """
+        statement_ids: list[int] = []
+
+        for policy_arn in managed_policy_arns:
+            version_id, document = self.documents.get(policy_arn)
+            if document is None:
+                continue
+            statement_ids.extend(
+                self._compile_policy((policy_arn, version_id), document)
+            )
+
+        for policy_name, document in inline_policies.items():
+            statement_ids.extend(
+                self._compile_policy((role_name, policy_name), document)
+            )
+
+        for statement_id in statement_ids:
+            self.statement_roles[statement_id].add(role_name)
+
+        self._query_cache.clear()
+
+
+    def _matching_statements(
+            self,
+            effect: str,
+            action: str,
+            resource: str
+    ) -> set[int]:
+        """Find the statements of an effect that cover an action on a
+        resource."""
+        matched: set[int] = set()
+        by_service = self.action_index[effect]
+
+        # Only the patterns of this service (and the wildcard ones) can match.
+        for service in {service_of(action), "*"}:
+            for pattern, statement_ids in by_service.get(service, {}).items():
+                if compile_pattern(pattern, ignore_case=True).fullmatch(action):
+                    matched |= statement_ids
+
+        for statement_id in self.not_action_statements[effect]:
+            if self.statements[statement_id].matches_action(action):
+                matched.add(statement_id)
+
+        return {
+            statement_id
+            for statement_id in matched
+            if self.statements[statement_id].matches_resource(resource)
+        }
+
+
+    def who_can(self, action: str, resource: str = "*") -> list[str]:
+        """Find the roles whose policies allow an action on a resource.
+
+        Wildcards in the question are taken literally, so asking about
+        `"s3:*"` on `"*"` only finds roles that were granted all of S3 on every
+        resource, not roles that can merely do some S3 things somewhere.
+        Conditions and permission boundaries are not evaluated. An Allow with
+        a condition counts, and a Deny with one doesn't, so a role that can do
+        it under some conditions is never left out.
+
+        Args:
+            action (str): The action, for example `"s3:*"` or `"iam:PassRole"`.
+            resource (str, optional): The resource ARN. Defaults to `"*"`.
+
+        Returns:
+            list[str]: Sorted names of the roles that are allowed and not
+                explicitly denied without a condition.
+        """
+        key: tuple[str, str] = (action, resource)
+        if key in self._query_cache:
+            return self._query_cache[key]
+
+        allowed: set[str] = set()
+        for statement_id in self._matching_statements("Allow", action, resource):
+            allowed |= self.statement_roles[statement_id]
+
+        # An explicit deny always wins, but a conditional one only sometimes.
+        # We can't tell when, so those roles are kept.
+        for statement_id in self._matching_statements("Deny", action, resource):
+            if not self.statements[statement_id].conditional:
+                allowed -= self.statement_roles[statement_id]
+
+        self._query_cache[key] = sorted(allowed)
+        return self._query_cache[key]
@@ -0,0 +1,281 @@
+'''
+Author: Joseph Hopwood
+Description: Module containing an offline snapshot of the IAM configuration on
+the account. The snapshot is pulled with `get_account_authorization_details`,
+which hands back roles, their attached and inline policies, and the managed
+policy documents in a few big pages, instead of a couple of calls per role.
+'''
+
+import datetime
+import json
+
+from common import paginate
+
+# These are the only entity types that the role audits care about. Leaving out
+# users and groups keeps the pages small.
+SNAPSHOT_FILTER: list[str] = ['Role', 'LocalManagedPolicy', 'AWSManagedPolicy']
+
+
+
+
+def fetch_authorization_details(iam_client) -> dict:
+    """_Pull the roles and managed policies on the account in as few calls as
+    IAM lets us._
+
+    Args:
+        iam_client: _A low level boto3 client for the IAM service._
+
+    Returns:
+        dict: _The raw snapshot data._
+        `
+        {  `<br>`
+            "TakenAt" : datetime.datetime,  `<br>`
+            "Roles" : list[dict],  `<br>`
+            "Policies" : list[dict],  `<br>`
+        }
+        `
+    """
+    roles: list[dict] = []
+    policies: list[dict] = []
+
+    # Everything comes back in one paginated call. Let's just collect the pages.
+    for page in paginate.pages(
+        iam_client,
+        'get_account_authorization_details',
+        Filter=SNAPSHOT_FILTER,
+    ):
+        roles.extend(page.get('RoleDetailList', []))
+        policies.extend(page.get('Policies', []))
+
+    return {
+        "TakenAt" : datetime.datetime.now(datetime.timezone.utc),
+        "Roles" : roles,
+        "Policies" : policies,
+    }
+
+
+
+
+def _encode_dates(value):
+    """_`json.dump()` hook to write out the datetimes boto3 hands back._"""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+
+
+def _parse_date(obj: dict, key: str):
+    """_Turn one date we wrote out back into a datetime, if it is there._"""
+    value = obj.get(key)
+    if isinstance(value, str):
+        try:
+            obj[key] = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            pass
+
+
+
+
+def _decode_dates(data: dict) -> dict:
+    """_Turn the dates of a loaded snapshot back into datetimes. Only the
+    metadata fields boto3 hands back as datetimes are touched: policy
+    documents can have "...Date" keys of their own (like the condition key
+    aws:CurrentDate), and those stay the strings the API gives us._
+
+    Args:
+        data (dict): _Raw snapshot data, as it was written out._
+
+    Returns:
+        dict: _The same data, with datetimes._
+    """
+    _parse_date(data, 'TakenAt')
+
+    for role in data.get('Roles', []):
+        _parse_date(role, 'CreateDate')
+        _parse_date(role.get('RoleLastUsed', {}), 'LastUsedDate')
+        for profile in role.get('InstanceProfileList', []):
+            _parse_date(profile, 'CreateDate')
+            for profile_role in profile.get('Roles', []):
+                _parse_date(profile_role, 'CreateDate')
+                _parse_date(profile_role.get('RoleLastUsed', {}), 'LastUsedDate')
+
+    for policy in data.get('Policies', []):
+        _parse_date(policy, 'CreateDate')
+        _parse_date(policy, 'UpdateDate')
+        for version in policy.get('PolicyVersionList', []):
+            _parse_date(version, 'CreateDate')
+
+    return data
+
+
+
+
+class IamSnapshot:
+    """
+    Local, indexed cache of the roles and managed policies on the account. Once
+    it is built (or loaded from disk), every query is answered from memory.
+    """
+
+
+    def __init__(self, data: dict):
+        """Initialize a new snapshot from raw snapshot data, and index it.
+
+        Args:
+            data (dict): Raw snapshot data, see `fetch_authorization_details()`.
+        """
+        self.taken_at: datetime.datetime = data["TakenAt"]
+        self.roles: list[dict] = data["Roles"]
+        self.policies: list[dict] = data["Policies"]
+
+        # Let's index everything up front so that lookups don't have to scan.
+        self.roles_by_name: dict[str, dict] = {}
+        self.policies_by_arn: dict[str, dict] = {}
+        self.role_names_by_policy_arn: dict[str, list[str]] = {}
+
+        for role in self.roles:
+            self.roles_by_name[role["RoleName"]] = role
+            for att_policy in role.get("AttachedManagedPolicies", []):
+                self.role_names_by_policy_arn.setdefault(
+                    att_policy["PolicyArn"], []
+                ).append(role["RoleName"])
+
+        for policy in self.policies:
+            self.policies_by_arn[policy["Arn"]] = policy
+
+
+    @classmethod
+    def from_api(cls, iam_client) -> "IamSnapshot":
+        """Build a fresh snapshot from AWS.
+
+        Args:
+            iam_client: A low level boto3 client for the IAM service.
+
+        Returns:
+            IamSnapshot: The new snapshot.
+        """
+        return cls(fetch_authorization_details(iam_client))
+
+
+    @classmethod
+    def load(cls, path: str) -> "IamSnapshot":
+        """Load a snapshot that was saved earlier. No API calls are made.
+
+        Args:
+            path (str): Path to the snapshot file.
+
+        Returns:
+            IamSnapshot: The loaded snapshot.
+        """
+        with open(path, 'r') as file:
+            return cls(_decode_dates(json.load(file)))
+
+
+    def save(self, path: str):
+        """Write the snapshot out to disk so later audits can run offline.
+
+        Args:
+            path (str): Path to the snapshot file. It is overwritten.
+        """
+        with open(path, 'w') as file:
+            json.dump(
+                {
+                    "TakenAt" : self.taken_at,
+                    "Roles" : self.roles,
+                    "Policies" : self.policies,
+                },
+                file,
+                default=_encode_dates,
+            )
+
+
+    def role_metadata(self, role: dict) -> dict:
+        """Summarize a role the same way the live audit does.
+
+        Args:
+            role (dict): A role from the snapshot.
+
+        Returns:
+            dict: Role metadata, see `iam-roles.py`. Access is never denied
+                here, the snapshot already holds everything.
+        """
+        return {
+            "RoleName" : role["RoleName"],
+            "CreateDate" : role["CreateDate"],
+            "ManagedPolicies" : [
+                att_policy["PolicyName"]
+                for att_policy in role.get("AttachedManagedPolicies", [])
+            ],
+            "UnmanagedPolicies" : [
+                inline_policy["PolicyName"]
+                for inline_policy in role.get("RolePolicyList", [])
+            ],
+            "AccessDenied" : False,
+        }
+
+
+    def audit(self, created_after: datetime.datetime) -> list[dict]:
+        """Answer the role age audit from the snapshot.
+
+        Args:
+            created_after (datetime.datetime): Only roles created after this
+                (timezone aware) moment are included.
+
+        Returns:
+            list[dict]: Role metadata of every matching role.
+        """
+        return [
+            self.role_metadata(role)
+            for role in self.roles
+            if created_after < role["CreateDate"]
+        ]
+
+
+    def roles_with_policy(self, policy_arn: str) -> list[str]:
+        """Find every role that has a managed policy attached.
+
+        Args:
+            policy_arn (str): ARN of the managed policy.
+
+        Returns:
+            list[str]: Names of the roles.
+        """
+        return list(self.role_names_by_policy_arn.get(policy_arn, []))
+
+
+    def policy_document(self, policy_arn: str, version_id: str = None) -> dict:
+        """Get the document of a managed policy.
+
+        Args:
+            policy_arn (str): ARN of the managed policy.
+            version_id (str, optional): Version of the document. Defaults to
+                the default version of the policy.
+
+        Returns:
+            dict: The policy document, or None if the snapshot doesn't have it.
+        """
+        policy: dict = self.policies_by_arn.get(policy_arn)
+        if not policy:
+            return None
+
+        version_id = version_id or policy.get("DefaultVersionId")
+        for version in policy.get("PolicyVersionList", []):
+            if version["VersionId"] == version_id:
+                return version["Document"]
+        return None
+
+
+    def inline_policies(self, role_name: str) -> dict[str, dict]:
+        """Get the documents of the inline policies of a role.
+
+        Args:
+            role_name (str): Name of the role.
+
+        Returns:
+            dict[str, dict]: Policy documents, keyed by policy name.
+        """
+        role: dict = self.roles_by_name.get(role_name, {})
+        return {
+            inline_policy["PolicyName"] : inline_policy["PolicyDocument"]
+            for inline_policy in role.get("RolePolicyList", [])
+        }
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+
+'''
+Author: Joseph Hopwood
+Description: Output a report of how exposed every S3 bucket on the account is.
+The website scripts of week 2 and week 6 make buckets public on purpose, so
+let's keep an eye on which ones are. For each bucket we look at its public
+access block, whether its policy makes it public, its ACL, its default
+encryption and its website configuration.
+
+Each bucket takes five calls, so all of them are made at the same time from a
+thread pool. Every call goes to a client of the bucket's own region, and the
+region of each bucket is only looked up once.
+
+Example:
+
+python3 cli.py s3-audit
+python3 cli.py s3-audit -b my-bucket -j s3.json
+'''
+
+import argparse
+import json
+import threading
+
+from common import clients, paginate
+from common.findings import finding
+
+# How many calls are in flight at once. S3 is happy with a lot of them.
+MAX_WORKERS: int = 32
+
+# Every setting we look at: the call that gets it, and the error code S3
+# answers with when the bucket simply doesn't have it configured.
+POSTURE_CALLS: dict[str, tuple[str, str]] = {
+    "public_access_block" : (
+        "get_public_access_block", "NoSuchPublicAccessBlockConfiguration"
+    ),
+    "policy_status" : ("get_bucket_policy_status", "NoSuchBucketPolicy"),
+    "acl" : ("get_bucket_acl", None),
+    "encryption" : (
+        "get_bucket_encryption",
+        "ServerSideEncryptionConfigurationNotFoundError",
+    ),
+    "website" : ("get_bucket_website", "NoSuchWebsiteConfiguration"),
+}
+
+# Grantees that make an ACL public, and who they let in.
+PUBLIC_GRANTEES: dict[str, str] = {
+    "http://acs.amazonaws.com/groups/global/AllUsers" : "everyone",
+    "http://acs.amazonaws.com/groups/global/AuthenticatedUsers" :
+        "any AWS account",
+}
+
+# The four switches of a public access block. All of them should be on.
+BLOCK_SETTINGS: tuple[str] = (
+    "BlockPublicAcls",
+    "IgnorePublicAcls",
+    "BlockPublicPolicy",
+    "RestrictPublicBuckets",
+)
+
+
+
+
+class RegionalClients:
+    """
+    Hands out an S3 client per region, and knows which region each bucket is
+    in. Both are worked out once and cached, so they're safe to ask for from
+    every thread of the pool.
+    """
+
+
+    def __init__(self, s3_client, max_workers: int = MAX_WORKERS):
+        """Initialize a new set of clients.
+
+        Args:
+            s3_client: A low level boto3 client for S3, used to look up the
+                region of buckets.
+            max_workers (int, optional): How many threads share each client.
+                Defaults to MAX_WORKERS.
+        """
+        self.s3_client = s3_client
+        self.max_workers: int = max_workers
+        self.regions: dict[str, str] = {}
+        self.clients: dict[str, object] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+
+    def region_of(self, bucket: dict) -> str:
+        """The region a bucket is in. Newer `list_buckets` answers already
+        say; for the rest we ask `get_bucket_location`, once per bucket.
+
+        Args:
+            bucket (dict): Bucket metadata, as found in `response["Buckets"]`
+                of a `S3.client.list_buckets()` call.
+
+        Returns:
+            str: Name of the region.
+        """
+        name: str = bucket["Name"]
+        if name not in self.regions:
+            region: str = bucket.get("BucketRegion")
+            if not region:
+                location: dict = self.s3_client.get_bucket_location(Bucket=name)
+
+                # Buckets in us-east-1 have no location at all, and the
+                # oldest buckets in Ireland still say "EU".
+                region = location.get("LocationConstraint") or "us-east-1"
+                if region == "EU":
+                    region = "eu-west-1"
+
+            with self._lock:
+                self.regions[name] = region
+
+        return self.regions[name]
+
+
+    def client_for(self, region: str):
+        """The S3 client of a region, made the first time it's asked for."""
+        with self._lock:
+            if region not in self.clients:
+                self.clients[region] = clients.client(
+                    's3',
+                    max_pool_connections=self.max_workers,
+                    region_name=region,
+                )
+
+            return self.clients[region]
+
+
+
+
+def _error_code(error: Exception) -> str:
+    """_The error code AWS answered with, or the kind of error if it never
+    answered (a dropped connection, say)._"""
+    if isinstance(error, clients.client_error()):
+        return error.response["Error"]["Code"]
+    return type(error).__name__
+
+
+
+
+def get_setting(s3_client, bucket_name: str, setting: str) -> dict:
+    """_Get one setting of a bucket._
+
+    Args:
+        s3_client: _A low level boto3 client for S3, in the bucket's region._
+        bucket_name (str): _Name of the bucket._
+        setting (str): _Name of the setting, see `POSTURE_CALLS`._
+
+    Returns:
+        dict: _The answer of the call, without its metadata. None if the
+            bucket doesn't have the setting configured, or {"Error" : code} if
+            we couldn't read it._
+    """
+    operation, not_configured = POSTURE_CALLS[setting]
+
+    try:
+        response: dict = getattr(s3_client, operation)(Bucket=bucket_name)
+
+    # One bucket we can't read shouldn't sink the whole audit. Let's record
+    # why and carry on.
+    except Exception as error:
+        code: str = _error_code(error)
+        if code == not_configured:
+            return None
+        return {"Error" : code}
+
+    response.pop("ResponseMetadata", None)
+    return response
+
+
+
+
+def fetch_postures(
+        s3_client,
+        buckets: list[dict],
+        max_workers: int = MAX_WORKERS
+) -> dict[str, dict]:
+    """_Get every setting of every bucket, all at the same time. As soon as
+    the region of a bucket is known, its five calls go out to that region._
+
+    Args:
+        s3_client: _A low level boto3 client for S3._
+        buckets (list[dict]): _Bucket metadata, as found in
+            `response["Buckets"]` of a `S3.client.list_buckets()` call._
+        max_workers (int, optional): _How many calls are in flight at once.
+            Defaults to MAX_WORKERS._
+
+    Returns:
+        dict[str, dict]: _The settings of each bucket (see `get_setting()`),
+            keyed by setting name, and by bucket name above that. Every
+            bucket also gets its "region"._
+    """
+    # Imported here, so that --help never pays for the thread pool.
+    import concurrent.futures
+
+    regional: RegionalClients = RegionalClients(s3_client, max_workers)
+    postures: dict[str, dict] = {bucket["Name"]: {} for bucket in buckets}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        locating: dict = {
+            executor.submit(regional.region_of, bucket): bucket["Name"]
+            for bucket in buckets
+        }
+
+        settings: dict = {}
+        for future in concurrent.futures.as_completed(locating):
+            bucket_name: str = locating[future]
+
+            # A bucket we can't locate, be it denied or a dropped connection,
+            # is one we can't read. The rest of the audit goes on.
+            try:
+                region: str = future.result()
+            except Exception as error:
+                postures[bucket_name]["region"] = {"Error" : _error_code(error)}
+                continue
+
+            postures[bucket_name]["region"] = region
+            region_client = regional.client_for(region)
+            for setting in POSTURE_CALLS:
+                settings[
+                    executor.submit(
+                        get_setting, region_client, bucket_name, setting
+                    )
+                ] = (bucket_name, setting)
+
+        for future, (bucket_name, setting) in settings.items():
+            postures[bucket_name][setting] = future.result()
+
+    return postures
+
+
+
+
+
+def evaluate(bucket_name: str, posture: dict) -> list[dict]:
+    """_Work out how exposed a bucket is from its settings._
+
+    Args:
+        bucket_name (str): _Name of the bucket._
+        posture (dict): _Its settings, see `fetch_postures()`._
+
+    Returns:
+        list[dict]: _A finding per problem. Empty if the bucket is locked
+            down._
+    """
+    findings: list[dict] = []
+
+    # Without its region, we never asked about anything else. Anything more
+    # would be a guess.
+    region = posture.get("region")
+    if isinstance(region, dict) and "Error" in region:
+        return [
+            finding(
+                "s3_unreadable",
+                bucket_name,
+                f"Could not read region: {region['Error']}",
+            )
+        ]
+
+    # Anything we weren't allowed to read, we can't vouch for.
+    for setting, value in posture.items():
+        if isinstance(value, dict) and "Error" in value:
+            findings.append(
+                finding(
+                    "s3_unreadable",
+                    bucket_name,
+                    f"Could not read {setting}: {value['Error']}",
+                )
+            )
+
+    # PUBLIC ACCESS BLOCK - every switch should be on
+    block: dict = posture.get("public_access_block")
+    if block is None:
+        findings.append(
+            finding(
+                "s3_public_access_block_off",
+                bucket_name,
+                "Has no public access block",
+            )
+        )
+    elif "Error" not in block:
+        switches: dict = block["PublicAccessBlockConfiguration"]
+        off: list[str] = [
+            switch for switch in BLOCK_SETTINGS if not switches.get(switch)
+        ]
+        if off:
+            findings.append(
+                finding(
+                    "s3_public_access_block_off",
+                    bucket_name,
+                    f"Public access block leaves {', '.join(off)} off",
+                )
+            )
+
+    # POLICY - "Principal: *" and the like
+    policy_status: dict = posture.get("policy_status")
+    if policy_status and policy_status.get("PolicyStatus", {}).get("IsPublic"):
+        findings.append(
+            finding(
+                "s3_public_policy",
+                bucket_name,
+                "Bucket policy makes it public",
+                "CRITICAL",
+            )
+        )
+
+    # ACL - grants to everyone, or to every AWS account
+    acl: dict = posture.get("acl")
+    if acl and "Error" not in acl:
+        for grant in acl.get("Grants", []):
+            who: str = PUBLIC_GRANTEES.get(grant["Grantee"].get("URI"))
+            if who:
+                findings.append(
+                    finding(
+                        "s3_public_acl",
+                        bucket_name,
+                        f"ACL grants {grant['Permission']} to {who}",
+                        "CRITICAL",
+                    )
+                )
+
+    # ENCRYPTION - there should be a default
+    if posture.get("encryption") is None and "encryption" in posture:
+        findings.append(
+            finding(
+                "s3_not_encrypted",
+                bucket_name,
+                "Has no default encryption",
+            )
+        )
+
+    # WEBSITE - not a problem on its own, but good to know about
+    website: dict = posture.get("website")
+    if website and "Error" not in website:
+        findings.append(
+            finding(
+                "s3_website",
+                bucket_name,
+                "Hosts a static website "
+                    f"(index {website.get('IndexDocument', {}).get('Suffix')})",
+                "INFO",
+            )
+        )
+
+    return findings
+
+
+
+
+def audit_buckets(
+        s3_client,
+        bucket_names: list[str] = None,
+        max_workers: int = MAX_WORKERS
+) -> list[dict]:
+    """_Audit every bucket on the account, or only some of them._
+
+    Args:
+        s3_client: _A low level boto3 client for S3._
+        bucket_names (list[str], optional): _Only audit these buckets.
+            Defaults to every bucket._
+        max_workers (int, optional): _How many calls are in flight at once.
+            Defaults to MAX_WORKERS._
+
+    Returns:
+        list[dict]: _The findings of every bucket._
+    """
+    # No need to list every bucket if we already know which ones we want.
+    buckets: list[dict]
+    if bucket_names:
+        buckets = [{"Name" : bucket_name} for bucket_name in bucket_names]
+    else:
+        buckets = list(paginate.items(s3_client, 'list_buckets', 'Buckets'))
+
+    postures: dict[str, dict] = fetch_postures(s3_client, buckets, max_workers)
+
+    return [
+        bucket_finding
+        for bucket_name, posture in postures.items()
+        for bucket_finding in evaluate(bucket_name, posture)
+    ]
+
+
+
+
+def print_report(findings: list[dict]):
+    """_Print the report, grouped by bucket._
+
+    Args:
+        findings (list[dict]): _See `evaluate()`._
+    """
+    by_bucket: dict[str, list[dict]] = {}
+    for bucket_finding in findings:
+        by_bucket.setdefault(bucket_finding["resource"], []).append(
+            bucket_finding
+        )
+
+    for bucket_name, bucket_findings in by_bucket.items():
+        print(f"\nBucket: {bucket_name}")
+        for bucket_finding in bucket_findings:
+            print(f"  [{bucket_finding['severity']}] {bucket_finding['message']}")
+
+    print(f"\n{len(findings)} finding(s) across {len(by_bucket)} bucket(s)\n")
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="S3 Posture Auditor",
+        description="Report how exposed every S3 bucket is",
+    )
+    parser.add_argument(
+        "-b", "--bucket",
+        action="append",
+        help="Only audit this bucket. Can be repeated. Defaults to every bucket",
+        dest="buckets",
+    )
+    parser.add_argument(
+        "-j", "--json",
+        type=str,
+        help="Also write the findings to this JSON file",
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=MAX_WORKERS,
+        help=f"How many calls are in flight at once. Defaults to {MAX_WORKERS}",
+    )
+    args = parser.parse_args()
+
+    s3_client = clients.client('s3', max_pool_connections=args.workers)
+
+    findings: list[dict] = audit_buckets(s3_client, args.buckets, args.workers)
+    print_report(findings)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(findings, file, indent=2)
+
+
+
+
+if __name__ == "__main__":
+    main()
@@ -8,87 +8,11 @@ network lacks High Availability.
 It can either return info about a specific VPC, or all VPCs.
 '''
 
-import boto3
 import argparse
 
-# Let's create a parser to handle the arguments passed ot the script.
-# Let's also add some helpful about metadata.
-parser: argparse.ArgumentParser = argparse.ArgumentParser(
-    prog="Network High Availability Checker",
-)
-
-# Let's add the parameter to give check a VPC individually.
-parser.add_argument(
-    "-n", "--vpc-name",
-    type=str,
-    help="Name of the VPC in aws",
-    dest="vpc_name",
-    )
-
-# ...registering the arguments passed ...
-args = parser.parse_args()
+from common import clients, paginate
 
-# Let's begin by creating the low level client to interact with ec2
-client_ec2 = boto3.client("ec2")
-
-# In order ot determine whether or not a network can host highly available
-# infrastructure, we need to see if it has enough subnets. Specifically, they
-# they need to be subnets in different Availability Zones.
-
-# Let's begin by obtaining the networks we want to check. This script will
-# either do all networks on the account, or a single one that was queried by
-# a name that was passed in as an argument when the script was executed.
-
-response: dict = {}
-
-# For a single, named, VPC
-if args.vpc_name:
-    response = client_ec2.describe_vpcs(
-        Filters=[
-            {
-                'Name': 'tag:Name',
-                'Values': [
-                    args.vpc_name,
-                ]
-            },
-        ],
-    )
-
-# For all VPCs
-else:
-    response = client_ec2.describe_vpcs()
-
-# From this response, we are going to take out the information from it that we
-# want.
-
-# - VpcId: The user may want this, but we re also going to use it to get the 
-#       list of subnets that are associated with it.
-# - Name: This is helpful so the user can identify what vpc it is
-# - CidrIp: I think this is also relevant information.
-
-# Then, we are going to organize it nicely and put it in a dictionary. Then we
-# can populate the "subnets" value when we query them.
-"""
-[
-    {
-        "id" : str
-        "name" : str,
-        "cidr" : str,
-        "subnets" : [
-            {
-                "id" : str,
-                "name" : str,
-                "az" : str,
-                "cidr" : str
-            },
-            ...
-        ]
-    },
-    ...
-[
-"""
-# Let's create the collection of our vpc information:
-vpc_list: list = []
+import vpc_topology
 
 
 
@@ -104,7 +28,7 @@ def get_vpc_info(vpc: dict) -> dict:
 
     Returns:
         dict: _Key information about a VPC. the "subnet" value is always empty.
-            See get_associated_subnets_info()_  
+            See get_subnets_by_vpc()_  
         `
         {  `<br>`
         "id" : str,  `<br>`
@@ -139,155 +63,308 @@ def get_vpc_info(vpc: dict) -> dict:
 
 
 
-# Okay, now let's use it.
-# Let's add the info for all of the vpcs returned in the response.
-for vpc in response["Vpcs"]:
-    vpc_list.append(get_vpc_info(vpc))
-
-# Now that we have the ID(s) of the VPC(s), we can request a list of all the
-# associated subnets for each VPC. Then we can take the info we want.
+# Once we have the ID(s) of the VPC(s), we can request a list of all the
+# associated subnets. Rather than asking once per VPC, we ask for all of them
+# in one go and sort them out by VPC ourselves. Then we can take the info we
+# want.
 
 # - Subnet ID: if they are un-named, we need to know the IDs
 # - Name: For the user to know which subnet is which
 # - Availability Zone: So we can determine if the vpc supports high availability
+#       We keep the AZ ID too. AZ names are shuffled between accounts and
+#       repeat their letters across regions, the IDs (use1-az1) don't.
 # - CidrIp: Relevant information
 
 
 
 
 # Let's make a function for that.
-def get_associated_subnets_info(ec2_client, vpc_id: str) -> list[dict]:
-    """_Get a list of key information on each subnet in a VPC._
+def get_subnet_info(subnet: dict) -> dict:
+    """_Get key info from a subnet._
 
     Args:
-        ec2_client (_type_): _An instance of a low level client with the EC2
-            service._
-        vpc_id (str): _The ARN of the VPC that you want to get the subnets and
-            the information of._
+        subnet (dict): _Subnet metadata that was returned from a
+            `EC2.client.describe_subnets()` call --located within
+            `response["Subnets"]`._
 
     Returns:
-        list[dict]: _A list of dictionaries each containing key information
-            about a subnet._
+        dict: _Key information about a subnet._
 
         `
         {  `<br>`
             "id" :  str,  `<br>`
             "name" : str,  `<br>`
             "az" : str,  `<br>`
+            "az_id" : str,  `<br>`
             "cidr" : str,  `<br>`
         }
         `
-        
+    """
+    name = "-"
+
+    # Sometimes they don't have tags. We need to catch this error and stick
+    # with the default "-"
+    try:
+        for tag in subnet["Tags"]:
+            if tag["Key"] == "Name":
+                name = tag["Value"]
+    except KeyError:
+        pass
+
+    return {
+        "id" :  subnet['SubnetId'],
+        "name" : name,
+        "az" : subnet['AvailabilityZone'],
+        "az_id" : subnet['AvailabilityZoneId'],
+        "cidr" : subnet['CidrBlock'],
+    }
+
+
+
+
+def get_subnets_by_vpc(ec2_client, vpc_ids: list[str] = None) -> dict:
+    """_Get key information on the subnets of many VPCs at once, grouped by
+    the VPC they belong to._
+
+    Args:
+        ec2_client (_type_): _An instance of a low level client with the EC2
+            service._
+        vpc_ids (list[str], optional): _Only get the subnets of these VPCs.
+            Defaults to every subnet on the account._
+
+    Returns:
+        dict: _Lists of subnet info (see `get_subnet_info()`), keyed by the
+            ID of the VPC they belong to._
     """
     # This is be our return value
-    list_of_subnets: list[dict] = []
-    
-    # Let's get the list of subnets associated with our VPC
-    response = ec2_client.describe_subnets(
-        Filters=[
+    subnets_by_vpc: dict[str, list[dict]] = {}
+
+    # One paginated call for every subnet we are interested in.
+    kwargs: dict = {}
+    if vpc_ids:
+        kwargs["Filters"] = [
             {
                 'Name': 'vpc-id',
-                'Values': [
-                    vpc_id,
-                ]
+                'Values': vpc_ids,
             },
-        ],
-    )
+        ]
+
+    # Now, let's extract the key info, and drop it in with the rest of the
+    # subnets of its VPC.
+    for subnet in paginate.items(ec2_client, "describe_subnets", "Subnets",
+            **kwargs):
+        subnets_by_vpc.setdefault(subnet["VpcId"], []).append(
+            get_subnet_info(subnet)
+        )
 
-    # Now, let's extract the key info, package it in a dict, and add it to the
-    # list of subnets
-    for subnet in response["Subnets"]:
+    return subnets_by_vpc
 
-        name = "-"
 
-        # Sometimes they don't have tags. We need to catch this error and stick 
-        # with the default "-"
-        try:
-            for tag in subnet["Tags"]:
-                if tag["Key"] == "Name":
-                    name = tag["Value"]
-        except KeyError:
-            pass
 
-        list_of_subnets.append(
-            {
-                "id" :  subnet['SubnetId'],
-                "name" : name,
-                "az" : subnet['AvailabilityZone'],
-                "cidr" : subnet['CidrBlock'],
-            }
+
+def find_unavailable_vpcs(vpc_list: list[dict]) -> set[str]:
+    """_Check each VPC to see if they are highly available. For this, our
+    criteria is just that there are **At least 2 subnets** and the 2 subnets
+    are **in different AZs**._
+
+    Args:
+        vpc_list (list[dict]): _VPC info with its subnets filled in, see
+            `get_vpc_info()`._
+
+    Returns:
+        set[str]: _The IDs of the VPCs that are not highly available._
+    """
+    # This is easy enough, because all we have to do is make sure that the
+    # count of subnets is above two, and that there are at least two unique AZ
+    # IDs among them.
+
+    # Let's create a set that will hold the VPC IDs of flagged VPCs
+    flagged_vpcs: set[str] = set()
+
+    # Let's start checking!
+    for vpc in vpc_list:
+
+        # Check one: **At least 2 subnets**, and check two: **in different
+        # AZs**. A set keeps only the unique AZ IDs for us.
+        unique_az_ids: set[str] = {subnet["az_id"] for subnet in vpc["subnets"]}
+
+        if len(vpc["subnets"]) < 2 or len(unique_az_ids) < 2:
+            flagged_vpcs.add(vpc["id"])
+
+    return flagged_vpcs
+
+
+
+
+def print_vpcs(vpc_list: list[dict], flagged_vpcs: set[str]):
+    """_Print the VPCs and their subnets, with a warning on the flagged ones._
+
+    Args:
+        vpc_list (list[dict]): _VPC info with its subnets filled in._
+        flagged_vpcs (set[str]): _IDs of the VPCs that aren't highly
+            available._
+    """
+    for vpc in vpc_list:
+        print("\n")
+        print(f"Name: {vpc['name']}")
+        print(f"ARN: {vpc['id']}")
+        print(f"IP Cidr: {vpc['cidr']}")
+        print("Subnets:")
+        for subnet in vpc["subnets"]:
+            print(f"  - Name: {subnet['name']}")
+            print(f"    ARN: {subnet['id']}")
+            print(f"    AZ: {subnet['az']} ({subnet['az_id']})")
+            print(f"    IP Cidr: {subnet['cidr']}")
+
+        # Let's attach a warning to the flagged VPCs
+        if vpc["id"] in flagged_vpcs:
+            print("WARNING: Network is not Highly Available!")
+            for issue in vpc.get("routing_issues", []):
+                print(f"  - {issue}")
+        print("\n")
+
+
+
+
+def main():
+
+    # Let's create a parser to handle the arguments passed ot the script.
+    # Let's also add some helpful about metadata.
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog="Network High Availability Checker",
+    )
+
+    # Let's add the parameter to give check a VPC individually.
+    parser.add_argument(
+        "-n", "--vpc-name",
+        type=str,
+        help="Name of the VPC in aws",
+        dest="vpc_name",
         )
 
-    return list_of_subnets
+    # Let's add a switch for the deeper check that also looks at where each
+    # subnet routes its traffic (route tables, NAT gateways, internet
+    # gateways).
+    parser.add_argument(
+        "-r", "--routes",
+        action="store_true",
+        help="Also check route tables, NAT gateways and internet gateways",
+        dest="routes",
+        )
+
+    # ...registering the arguments passed ...
+    args = parser.parse_args()
+
+    # Let's begin by creating the low level client to interact with ec2
+    client_ec2 = clients.client("ec2")
 
+    # In order ot determine whether or not a network can host highly
+    # available infrastructure, we need to see if it has enough subnets.
+    # Specifically, they they need to be subnets in different Availability
+    # Zones.
+
+    # Let's begin by obtaining the networks we want to check. This script will
+    # either do all networks on the account, or a single one that was queried
+    # by a name that was passed in as an argument when the script was executed.
+
+    # For a single, named, VPC
+    kwargs: dict = {}
+    if args.vpc_name:
+        kwargs["Filters"] = [
+            {
+                'Name': 'tag:Name',
+                'Values': [
+                    args.vpc_name,
+                ]
+            },
+        ]
 
+    # VPCs come back in pages, so let's walk through all of them.
+    vpcs: list[dict] = list(
+        paginate.items(client_ec2, "describe_vpcs", "Vpcs", **kwargs)
+    )
 
+    # From this response, we are going to take out the information from it
+    # that we want.
 
-# Now, we can use that function to fill in the subnet information in our VPCs
-# in our list of VPCs
-for vpc in vpc_list:
-    vpc["subnets"] = get_associated_subnets_info(client_ec2, vpc["id"])
+    # - VpcId: The user may want this, but we re also going to use it to get
+    #       the list of subnets that are associated with it.
+    # - Name: This is helpful so the user can identify what vpc it is
+    # - CidrIp: I think this is also relevant information.
 
-# print(vpc_list)
+    # Then, we are going to organize it nicely and put it in a dictionary. Then
+    # we can populate the "subnets" value when we query them.
+    """
+    [
+        {
+            "id" : str
+            "name" : str,
+            "cidr" : str,
+            "subnets" : [
+                {
+                    "id" : str,
+                    "name" : str,
+                    "az" : str,
+                    "cidr" : str
+                },
+                ...
+            ]
+        },
+        ...
+    [
+    """
+    # Let's create the collection of our vpc information:
+    vpc_list: list = []
+
+    # Let's add the info for all of the vpcs returned in the response.
+    for vpc in vpcs:
+        vpc_list.append(get_vpc_info(vpc))
+
+    # Now, we can fill in the subnet information in our VPCs in our list of
+    # VPCs. If we are checking a single VPC, we only ask for its subnets,
+    # otherwise we just take them all. If we are doing the deeper routing
+    # check, the topology already brings all of the subnets along, so we don't
+    # have to ask for them twice.
+    subnets_by_vpc: dict[str, list[dict]] = {}
+    topology: vpc_topology.NetworkTopology = None
+    if vpc_list and args.routes:
+        topology = vpc_topology.NetworkTopology.from_api(
+            client_ec2,
+            [vpc["id"] for vpc in vpc_list] if args.vpc_name else None,
+        )
+        for subnet in topology.subnets.values():
+            subnets_by_vpc.setdefault(subnet["VpcId"], []).append(
+                get_subnet_info(subnet)
+            )
+    elif vpc_list:
+        subnets_by_vpc = get_subnets_by_vpc(
+            client_ec2,
+            [vpc["id"] for vpc in vpc_list] if args.vpc_name else None,
+        )
 
-# Now that we have all the information we want, we can go through and check each
-# VPC to see if they are highly available. For this, our criteria is just that
-# there are **At least 2 subnets** and the 2 subnets are **in different AZs**.
+    for vpc in vpc_list:
+        vpc["subnets"] = subnets_by_vpc.get(vpc["id"], [])
 
-# This is easy enough, because all we have to do is make sure that the count of
-# subnets is above two, and that the az's end with unique characters.
+    # print(vpc_list)
 
-# Let's divide these into two checks, and if the VPC doesn't pass both, we will
-# flag it and let the user know.
+    # Now that we have all the information we want, we can go through and check
+    # each VPC to see if they are highly available. If the VPC doesn't pass,
+    # we will flag it and let the user know.
+    flagged_vpcs: set[str] = find_unavailable_vpcs(vpc_list)
 
-# Let's create a list that will hold the VPC IDs of flagged VPCs
-flagged_vpcs_list: list[str] = []
+    # And the deeper check, answered straight from the cached topology.
+    if topology:
+        for vpc in vpc_list:
+            vpc["routing_issues"] = topology.evaluate_ha(vpc["id"])["issues"]
+            if vpc["routing_issues"]:
+                flagged_vpcs.add(vpc["id"])
 
-# Let's start checking!
-for vpc in vpc_list:
+    # Okay, now that we have flagged/passed all the VPCs, we can go ahead and
+    # print them out for the user to see.
+    print_vpcs(vpc_list, flagged_vpcs)
 
-    # Let's do check one: **At least 2 subnets**
-    if len(vpc["subnets"]) >= 2:
-        
-    # We are only gonna do check two if one passes, it's probably not
-    # optimal to have nested ifs like this for checks, but we only have two
-    # so this works.
 
-    # Okay, and let's do check two: **in different AZs**
 
-        # This list will keep track of the unique chars at the end of the
-        # subnets AZ names
-        unique_chars: list[str] = []
 
-        for subnet in vpc["subnets"]:
-            if subnet["az"][-1] not in unique_chars:
-                unique_chars.append(subnet["az"][-1])
-
-        if len(unique_chars) >= 2:
-            pass
-
-        else:
-            flagged_vpcs_list.append(vpc["id"])
-
-    else:
-        flagged_vpcs_list.append(vpc["id"])
-    
-    
-# Okay, now that we have flagged/passed all the VPCs, we can go ahead and print
-# them out for the user to see.
-for vpc in vpc_list:
-    print("\n")
-    print(f"Name: {vpc['name']}")
-    print(f"ARN: {vpc['id']}")
-    print(f"IP Cidr: {vpc['cidr']}")
-    print("Subnets:")
-    for subnet in vpc["subnets"]:
-        print(f"  - Name: {subnet['name']}")
-        print(f"    ARN: {subnet['id']}")
-        print(f"    AZ: {subnet['az']}")
-        print(f"    IP Cidr: {subnet['cidr']}")
-        
-    # Let's attach a warning to the flagged VPCs
-    if vpc["id"] in flagged_vpcs_list:
-        print("WARNING: Network is not Highly Available!")
-    print("\n")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+'''
+Author: Joseph Hopwood
+Description: Module containing an in-memory model of the network topology of
+the account. VPCs, subnets, route tables, NAT gateways and internet gateways are
+loaded with one paginated call each, no matter how many VPCs there are, and all
+High Availability questions are answered from the cached graph afterwards.
+'''
+
+from common import paginate
+
+# The route that sends traffic out to the internet.
+DEFAULT_ROUTE: str = "0.0.0.0/0"
+
+# Every describe call we make, the key their results come back under, and the
+# filter that narrows it down to specific VPCs.
+TOPOLOGY_CALLS: dict[str, tuple[str, str]] = {
+    "describe_vpcs" : ("Vpcs", "vpc-id"),
+    "describe_subnets" : ("Subnets", "vpc-id"),
+    "describe_route_tables" : ("RouteTables", "vpc-id"),
+    "describe_nat_gateways" : ("NatGateways", "vpc-id"),
+    "describe_internet_gateways" : ("InternetGateways", "attachment.vpc-id"),
+}
+
+
+
+
+def describe_all(ec2_client, operation: str, vpc_ids: list[str] = None) -> list:
+    """_Run one of the topology describe calls through its paginator._
+
+    Args:
+        ec2_client: _A low level boto3 client for the EC2 service._
+        operation (str): _Name of the describe call, see `TOPOLOGY_CALLS`._
+        vpc_ids (list[str], optional): _Only describe resources in these VPCs.
+            Defaults to everything on the account._
+
+    Returns:
+        list: _Every resource the call returned._
+    """
+    result_key, filter_name = TOPOLOGY_CALLS[operation]
+    kwargs: dict = {}
+
+    if vpc_ids:
+        # NAT gateways are the odd one out and call their filters "Filter".
+        kwargs["Filter" if operation == "describe_nat_gateways" else "Filters"] = [
+            {
+                'Name' : filter_name,
+                'Values' : vpc_ids,
+            },
+        ]
+
+    return list(paginate.items(ec2_client, operation, result_key, **kwargs))
+
+
+
+
+class NetworkTopology:
+    """
+    Graph of the network resources on the account, indexed by resource ID.
+    """
+
+
+    def __init__(
+            self,
+            vpcs: list[dict],
+            subnets: list[dict],
+            route_tables: list[dict],
+            nat_gateways: list[dict],
+            internet_gateways: list[dict]
+    ):
+        """Initialize a new topology, and index it.
+
+        Args:
+            vpcs (list[dict]): Results of `describe_vpcs`.
+            subnets (list[dict]): Results of `describe_subnets`.
+            route_tables (list[dict]): Results of `describe_route_tables`.
+            nat_gateways (list[dict]): Results of `describe_nat_gateways`.
+            internet_gateways (list[dict]): Results of
+                `describe_internet_gateways`.
+        """
+        self.vpcs: dict[str, dict] = {vpc["VpcId"]: vpc for vpc in vpcs}
+        self.subnets: dict[str, dict] = {
+            subnet["SubnetId"]: subnet for subnet in subnets
+        }
+        self.route_tables: dict[str, dict] = {
+            table["RouteTableId"]: table for table in route_tables
+        }
+
+        # Deleted and failed NAT gateways stick around for a while. They don't
+        # route anything, so let's leave them out.
+        self.nat_gateways: dict[str, dict] = {
+            nat["NatGatewayId"]: nat
+            for nat in nat_gateways
+            if nat.get("State") in ("pending", "available")
+        }
+        self.internet_gateways: dict[str, dict] = {
+            igw["InternetGatewayId"]: igw for igw in internet_gateways
+        }
+
+        # The adjacency of the graph. Every resource ID points at the IDs of
+        # the resources it is connected to.
+        self.edges: dict[str, set[str]] = {}
+
+        # Handy shortcuts for the questions we ask the most.
+        self.subnets_by_vpc: dict[str, list[str]] = {}
+        self.route_table_by_subnet: dict[str, str] = {}
+        self.main_route_table_by_vpc: dict[str, str] = {}
+        self.vpc_by_internet_gateway: dict[str, str] = {}
+
+        for subnet in self.subnets.values():
+            self.subnets_by_vpc.setdefault(subnet["VpcId"], []).append(
+                subnet["SubnetId"]
+            )
+            self._connect(subnet["VpcId"], subnet["SubnetId"])
+
+        for table in self.route_tables.values():
+            self._connect(table["VpcId"], table["RouteTableId"])
+
+            # A route table is either the main one of its VPC (used by every
+            # subnet without its own), or explicitly associated with subnets.
+            for association in table.get("Associations", []):
+                if association.get("Main"):
+                    self.main_route_table_by_vpc[table["VpcId"]] = (
+                        table["RouteTableId"]
+                    )
+                elif association.get("SubnetId"):
+                    self.route_table_by_subnet[association["SubnetId"]] = (
+                        table["RouteTableId"]
+                    )
+                    self._connect(association["SubnetId"], table["RouteTableId"])
+
+            for route in table.get("Routes", []):
+                target: str = self.route_target(route)
+                if target and target != "local":
+                    self._connect(table["RouteTableId"], target)
+
+        for nat in self.nat_gateways.values():
+            self._connect(nat["SubnetId"], nat["NatGatewayId"])
+
+        for igw in self.internet_gateways.values():
+            for attachment in igw.get("Attachments", []):
+                if attachment.get("State") in ("available", "attached"):
+                    self.vpc_by_internet_gateway[igw["InternetGatewayId"]] = (
+                        attachment["VpcId"]
+                    )
+                    self._connect(attachment["VpcId"], igw["InternetGatewayId"])
+
+
+    @classmethod
+    def from_api(cls, ec2_client, vpc_ids: list[str] = None) -> "NetworkTopology":
+        """Load the topology from AWS. This is always exactly one paginated
+        call per resource type, and they all run at the same time.
+
+        Args:
+            ec2_client: A low level boto3 client for the EC2 service.
+            vpc_ids (list[str], optional): Only load these VPCs. Defaults to
+                every VPC on the account.
+
+        Returns:
+            NetworkTopology: The loaded topology.
+        """
+        # Imported here, so that --help never pays for the thread pool.
+        import concurrent.futures
+
+        with concurrent.futures.ThreadPoolExecutor(len(TOPOLOGY_CALLS)) as executor:
+            futures: dict = {
+                operation: executor.submit(
+                    describe_all, ec2_client, operation, vpc_ids
+                )
+                for operation in TOPOLOGY_CALLS
+            }
+
+        return cls(
+            futures["describe_vpcs"].result(),
+            futures["describe_subnets"].result(),
+            futures["describe_route_tables"].result(),
+            futures["describe_nat_gateways"].result(),
+            futures["describe_internet_gateways"].result(),
+        )
+
+
+    def _connect(self, first_id: str, second_id: str):
+        """Add an edge between two resources."""
+        self.edges.setdefault(first_id, set()).add(second_id)
+        self.edges.setdefault(second_id, set()).add(first_id)
+
+
+    def neighbours(self, resource_id: str) -> set[str]:
+        """Get the IDs of every resource connected to a resource."""
+        return self.edges.get(resource_id, set())
+
+
+    @staticmethod
+    def route_target(route: dict) -> str:
+        """Get the ID of whatever a route sends its traffic to. Blackholed
+        routes don't send traffic anywhere, so they have no target."""
+        if route.get("State") == "blackhole":
+            return None
+        for key in (
+            "GatewayId",
+            "NatGatewayId",
+            "TransitGatewayId",
+            "NetworkInterfaceId",
+            "VpcPeeringConnectionId",
+            "InstanceId",
+        ):
+            if route.get(key):
+                return route[key]
+        return None
+
+
+    def route_table_of(self, subnet_id: str) -> dict:
+        """Get the route table a subnet actually uses."""
+        table_id: str = self.route_table_by_subnet.get(
+            subnet_id,
+            self.main_route_table_by_vpc.get(self.subnets[subnet_id]["VpcId"]),
+        )
+        return self.route_tables.get(table_id, {})
+
+
+    def default_route_target(self, subnet_id: str) -> str:
+        """Get where a subnet sends internet-bound traffic, if anywhere."""
+        for route in self.route_table_of(subnet_id).get("Routes", []):
+            if route.get("DestinationCidrBlock") == DEFAULT_ROUTE:
+                return self.route_target(route)
+        return None
+
+
+    def is_public(self, subnet_id: str) -> bool:
+        """Whether a subnet routes to an internet gateway of its own VPC."""
+        target: str = self.default_route_target(subnet_id)
+        return (
+            target in self.vpc_by_internet_gateway
+            and self.vpc_by_internet_gateway[target]
+                == self.subnets[subnet_id]["VpcId"]
+        )
+
+
+    def az_id_of(self, subnet_id: str) -> str:
+        """Get the AZ ID of a subnet."""
+        return self.subnets[subnet_id]["AvailabilityZoneId"]
+
+
+    def evaluate_ha(self, vpc_id: str) -> dict:
+        """Check a VPC against the High Availability conditions.
+
+        - It has subnets in at least 2 AZs.
+        - If it has public subnets, they are in at least 2 AZs.
+        - Every private subnet that reaches the internet through a NAT gateway
+          uses one in its own AZ, which sits in a public subnet. Otherwise
+          losing one AZ takes out the internet access of another.
+
+        Args:
+            vpc_id (str): The ID of the VPC.
+
+        Returns:
+            dict: The results of the evaluation.
+            `
+            {  `<br>`
+                "highly_available" : bool,  `<br>`
+                "az_ids" : set[str],  `<br>`
+                "public_az_ids" : set[str],  `<br>`
+                "nat_az_ids" : set[str],  `<br>`
+                "issues" : list[str],  `<br>`
+            }
+            `
+        """
+        subnet_ids: list[str] = self.subnets_by_vpc.get(vpc_id, [])
+        issues: list[str] = []
+
+        az_ids: set[str] = {self.az_id_of(subnet_id) for subnet_id in subnet_ids}
+        public_az_ids: set[str] = set()
+        nat_az_ids: set[str] = set()
+
+        for subnet_id in subnet_ids:
+            if self.is_public(subnet_id):
+                public_az_ids.add(self.az_id_of(subnet_id))
+                continue
+
+            # Private subnets either reach out through a NAT gateway, or they
+            # are isolated, which is fine.
+            target: str = self.default_route_target(subnet_id)
+            if target not in self.nat_gateways:
+                continue
+
+            nat_subnet_id: str = self.nat_gateways[target]["SubnetId"]
+            if nat_subnet_id not in self.subnets:
+                issues.append(f"{subnet_id} routes through {target}, which "
+                    "sits outside of the VPC")
+                continue
+
+            nat_az_id: str = self.az_id_of(nat_subnet_id)
+            nat_az_ids.add(nat_az_id)
+
+            if nat_az_id != self.az_id_of(subnet_id):
+                issues.append(f"{subnet_id} ({self.az_id_of(subnet_id)}) routes "
+                    f"through {target} in another AZ ({nat_az_id})")
+            if not self.is_public(nat_subnet_id):
+                issues.append(f"{target} sits in private subnet {nat_subnet_id}")
+
+        if len(az_ids) < 2:
+            issues.append("Subnets span fewer than 2 AZs")
+        if public_az_ids and len(public_az_ids) < 2:
+            issues.append("Public subnets span fewer than 2 AZs")
+
+        return {
+            "highly_available" : not issues,
+            "az_ids" : az_ids,
+            "public_az_ids" : public_az_ids,
+            "nat_az_ids" : nat_az_ids,
+            "issues" : issues,
+        }